@@ -0,0 +1,181 @@
+"""Consensus grades and inter-rater agreement between grading samples.
+
+With several grading samples per run (``SHERPA_GRADING_SAMPLES``) each
+rubric row has one grade per sample.  ``consensus_grade`` reduces them to
+the grade written to ``grading_results.csv`` and ``agreement_report``
+measures how far the samples agree, as the research workflow did by hand in
+the "Weighted Cohens Kappa" sheets: linearly weighted Cohen's kappa over
+the 0 / 0.5 / 1 scale, overall and per rubric category, for every pair of
+samples.
+"""
+
+from __future__ import annotations
+
+import itertools
+import statistics
+from collections import Counter, OrderedDict
+from typing import Optional, Sequence
+
+# Same order as the summary sheets (summary/extract_summaries.py).
+CATEGORY_ORDER = [
+    "Composite State",
+    "State",
+    "Transition",
+    "Action",
+    "Region",
+    "History State",
+    "Guard",
+]
+GRADE_LEVELS = (0.0, 0.5, 1.0)
+
+
+def parse_grade(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def format_grade(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def consensus_grade(grades: Sequence[Optional[str]]) -> tuple[Optional[str], int]:
+    """Majority grade of ``grades``, or their (low) median without a majority.
+
+    Returns the grade and how many samples gave exactly it.  The low median
+    always is one of the sampled grades, so it stays on the rubric's scale
+    (0 / 0.5 / 1, or a whole count for "additional elements").
+    """
+    values = [value for value in map(parse_grade, grades) if value is not None]
+    if not values:
+        return None, 0
+    grade, count = Counter(values).most_common(1)[0]
+    if count * 2 <= len(values):
+        grade = statistics.median_low(values)
+        count = values.count(grade)
+    return format_grade(grade), count
+
+
+def weighted_cohens_kappa(
+    rater_a: Sequence[float],
+    rater_b: Sequence[float],
+    levels: Sequence[float] = GRADE_LEVELS,
+) -> Optional[float]:
+    """Linearly weighted Cohen's kappa between two raters' paired grades.
+
+    Pairs where either grade is off ``levels`` are ignored.  Returns None
+    when kappa is undefined: no usable pairs, or both raters giving one and
+    the same grade throughout (the sheets show ``#DIV/0!`` there).
+    """
+    index = {level: i for i, level in enumerate(levels)}
+    pairs = [
+        (index[a], index[b])
+        for a, b in zip(rater_a, rater_b)
+        if a in index and b in index
+    ]
+    if not pairs:
+        return None
+    k = len(levels)
+    n = len(pairs)
+    observed = [[0] * k for _ in range(k)]
+    for i, j in pairs:
+        observed[i][j] += 1
+    rows = [sum(observed[i]) for i in range(k)]
+    cols = [sum(observed[i][j] for i in range(k)) for j in range(k)]
+
+    def weight(i: int, j: int) -> float:
+        return abs(i - j) / (k - 1)
+
+    disagreement = sum(
+        weight(i, j) * observed[i][j] for i in range(k) for j in range(k)
+    ) / n
+    expected = sum(
+        weight(i, j) * rows[i] * cols[j] for i in range(k) for j in range(k)
+    ) / (n * n)
+    if expected == 0:
+        return None
+    return 1 - disagreement / expected
+
+
+def agreement_report(
+    categories: Sequence[Optional[str]],
+    samples: Sequence[Sequence[Optional[str]]],
+    labels: Sequence[str],
+) -> dict:
+    """Pairwise weighted kappa between ``samples`` (grade columns, one per sample).
+
+    ``categories`` gives each row's rubric category (the Type column); rows
+    with category None (the "additional elements" counts) are not on the
+    grading scale and are left out of kappa.  The report has, for every
+    pair of samples, kappa overall and per category, the mean over pairs,
+    and the share of rows on which all samples agree.
+    """
+    grades = [[parse_grade(value) for value in sample] for sample in samples]
+    scored = [row for row, category in enumerate(categories) if category is not None]
+    by_category: dict[str, list[int]] = OrderedDict(
+        (category, []) for category in CATEGORY_ORDER
+    )
+    for row in scored:
+        by_category.setdefault(categories[row], []).append(row)
+
+    def kappa_block(a: list, b: list) -> dict:
+        return {
+            "overall": _round(
+                weighted_cohens_kappa([a[row] for row in scored], [b[row] for row in scored])
+            ),
+            "by_category": OrderedDict(
+                (
+                    category,
+                    _round(
+                        weighted_cohens_kappa(
+                            [a[row] for row in rows], [b[row] for row in rows]
+                        )
+                    ),
+                )
+                for category, rows in by_category.items()
+            ),
+        }
+
+    pairs = [
+        {
+            "samples": [labels[i], labels[j]],
+            "weighted_cohens_kappa": kappa_block(grades[i], grades[j]),
+        }
+        for i, j in itertools.combinations(range(len(samples)), 2)
+    ]
+    graded_rows = [
+        row
+        for row in range(len(categories))
+        if all(sample[row] is not None for sample in grades)
+    ]
+    unanimous = sum(1 for row in graded_rows if len({s[row] for s in grades}) == 1)
+    return {
+        "samples": list(labels),
+        "rows": len(categories),
+        "unanimous_rows": unanimous,
+        "percent_agreement": _round(unanimous / len(graded_rows)) if graded_rows else None,
+        "mean_weighted_cohens_kappa": _mean_block(
+            [pair["weighted_cohens_kappa"] for pair in pairs]
+        ),
+        "pairs": pairs,
+    }
+
+
+def _mean_block(blocks: list[dict]) -> dict:
+    def mean(values: list) -> Optional[float]:
+        values = [value for value in values if value is not None]
+        return _round(sum(values) / len(values)) if values else None
+
+    categories = blocks[0]["by_category"] if blocks else {}
+    return {
+        "overall": mean([block["overall"] for block in blocks]),
+        "by_category": OrderedDict(
+            (category, mean([block["by_category"][category] for block in blocks]))
+            for category in categories
+        ),
+    }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 4)
@@ -0,0 +1,452 @@
+"""Batch evaluation over a matrix of examples × models × strategies.
+
+Benchmarks used to mean one UI click per example/model pair.  A batch runs
+every cell of a matrix in-process instead:
+
+    python backend/batch.py --name march-bench \\
+        --examples printer_winter_2017 spa_manager_winter_2018 \\
+        --models anthropic/claude-4.5-sonnet openai/gpt-5.5 \\
+        --strategies single_prompt two_stage_prompt --grading both
+
+Omitted axes default to every ``state_machine_descriptions`` example, every
+``PROFILE_TO_OPENROUTER`` model and both strategies (graded).  The server
+starts the same runner with ``POST /api/batch``.
+
+Each batch lives in ``resources/batch_outputs/<name>/``:
+
+- ``manifest.json``: the matrix and, per cell, its run folder and outcome;
+- ``results.csv``: the consolidated results table, one row per cell,
+  rewritten as cells finish;
+- ``summary.json``: precision, recall and F1 per example, model and
+  strategy, overall and per rubric category (see ``grading_metrics``),
+  written when the batch finishes;
+- ``logs/<cell>.log``: what each cell's pipeline printed.
+
+Cells are ordinary pipeline runs and go through the generation scheduler at
+a lower priority than interactive runs, so its per-model limits apply.
+``SHERPA_BATCH_CONCURRENCY`` (or ``--concurrency``) bounds how many cells are
+in flight at once.  Running a batch name again resumes it: a cell whose run
+folder already has a terminal ``status.json`` (success, partial or failed) is
+skipped, everything else is run again.  ``--rerun-failed`` also repeats
+failed cells.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Optional
+
+import resources.state_machine_descriptions as sm_descriptions
+import progress
+from errors import RunStatusValue, read_status
+from grading import grading_sample_models
+from grading_metrics import batch_summary
+from model_profiles import PROFILE_TO_OPENROUTER, resolve_model
+from scheduler import MAX_CONCURRENT, QueueFullError, get_scheduler
+from single_prompt import arun_single_prompt
+from speculative import attempts_per_round
+from two_stage_prompt import arun_two_stage_prompt
+
+BATCH_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "resources", "batch_outputs"
+)
+STRATEGIES = ("single_prompt", "two_stage_prompt")
+# Interactive runs (priority 0) overtake batch cells queued less than
+# SHERPA_QUEUE_AGING_SECONDS before them.
+BATCH_PRIORITY = -1
+QUEUE_FULL_RETRY_SECONDS = 5
+
+CELL_FIELDS = ("example_key", "model", "strategy", "grading")
+RESULT_FIELDS = (
+    "status",
+    "error_type",
+    "error_message",
+    "duration_seconds",
+    "precision",
+    "recall",
+    "f1",
+    "completed_at",
+    "folder",
+)
+TERMINAL_STATUSES = {
+    RunStatusValue.SUCCESS.value,
+    RunStatusValue.PARTIAL.value,
+    RunStatusValue.FAILED.value,
+}
+
+
+@dataclass(frozen=True)
+class BatchCell:
+    example_key: str
+    model: str
+    strategy: str
+    grading: bool = True
+
+    @property
+    def cell_id(self) -> str:
+        graded = "graded" if self.grading else "ungraded"
+        return f"{self.example_key}|{self.model}|{self.strategy}|{graded}"
+
+    @property
+    def slug(self) -> str:
+        return _safe_name(self.cell_id.replace("|", "__"))
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def example_keys() -> list[str]:
+    return sorted(
+        name
+        for name in dir(sm_descriptions)
+        if not name.startswith("_") and isinstance(getattr(sm_descriptions, name), str)
+    )
+
+
+def build_matrix(
+    examples: Optional[Iterable[str]] = None,
+    models: Optional[Iterable[str]] = None,
+    strategies: Optional[Iterable[str]] = None,
+    grading: Iterable[bool] = (True,),
+) -> list[BatchCell]:
+    """Every cell of the matrix; omitted axes cover everything available.
+
+    Models may be profile keys or OpenRouter model strings.  Models vary
+    fastest, so consecutive cells spread over the per-model limits.
+    """
+    known = example_keys()
+    examples = list(examples or known)
+    unknown = [key for key in examples if key not in known]
+    if unknown:
+        raise ValueError(f"Unknown example(s): {', '.join(unknown)}")
+    strategies = list(strategies or STRATEGIES)
+    unknown = [name for name in strategies if name not in STRATEGIES]
+    if unknown:
+        raise ValueError(f"Unknown strategy(s): {', '.join(unknown)}")
+    models = list(dict.fromkeys(resolve_model(m) for m in models or PROFILE_TO_OPENROUTER))
+    cells = [
+        BatchCell(example_key, model, strategy, graded)
+        for example_key in examples
+        for strategy in strategies
+        for graded in dict.fromkeys(grading)
+        for model in models
+    ]
+    if not cells:
+        raise ValueError("The batch matrix is empty")
+    return cells
+
+
+def batch_concurrency(requested: Optional[int] = None) -> int:
+    if requested is None:
+        requested = int(os.environ.get("SHERPA_BATCH_CONCURRENCY", str(MAX_CONCURRENT)))
+    return max(1, requested)
+
+
+def batch_folder(name: str) -> str:
+    return os.path.join(BATCH_DIR, _safe_name(name))
+
+
+def default_batch_name() -> str:
+    return time.strftime("%Y_%m_%d_%H_%M_%S")
+
+
+def load_manifest(name: str) -> Optional[dict[str, Any]]:
+    """A batch's ``manifest.json``, or None if there is no such batch."""
+    path = os.path.join(batch_folder(name), "manifest.json")
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def stored_matrix(name: str) -> Optional[list[BatchCell]]:
+    """The matrix a batch was last run with, for resuming it as it was."""
+    manifest = load_manifest(name)
+    if not manifest:
+        return None
+    return [BatchCell(**cell) for cell in manifest.get("matrix", [])]
+
+
+def summarize(manifest: dict[str, Any]) -> dict[str, Any]:
+    """Manifest plus one results row per matrix cell (``pending`` if not run)."""
+    rows = []
+    for cell in manifest.get("matrix", []):
+        cell = BatchCell(**cell)
+        result = manifest["cells"].get(cell.cell_id, {"status": "pending"})
+        rows.append({**cell.to_dict(), **{k: result.get(k) for k in RESULT_FIELDS}})
+    return {
+        "name": manifest["name"],
+        "folder": manifest["folder"],
+        "created_at": manifest.get("created_at"),
+        "updated_at": manifest.get("updated_at"),
+        "counts": dict(Counter(row["status"] for row in rows)),
+        "results": rows,
+    }
+
+
+class _Manifest:
+    """A batch folder's manifest and results table, rewritten as cells change."""
+
+    def __init__(self, name: str, cells: list[BatchCell]):
+        self.name = _safe_name(name)
+        self.folder = batch_folder(self.name)
+        os.makedirs(os.path.join(self.folder, "logs"), exist_ok=True)
+        previous = load_manifest(self.name) or {}
+        self.data = {
+            "name": self.name,
+            "folder": self.folder,
+            "created_at": previous.get("created_at") or _now_iso(),
+            "updated_at": None,
+            "matrix": [cell.to_dict() for cell in cells],
+            "cells": previous.get("cells", {}),
+        }
+        self.save()
+
+    def is_done(self, cell: BatchCell, rerun_failed: bool) -> bool:
+        """Whether the cell's recorded run folder holds a terminal status."""
+        folder = self.data["cells"].get(cell.cell_id, {}).get("folder")
+        status = read_status(folder) if folder else None
+        if not status or status.get("status") not in TERMINAL_STATUSES:
+            return False
+        return not (rerun_failed and status["status"] == RunStatusValue.FAILED.value)
+
+    def log_path(self, cell: BatchCell) -> str:
+        return os.path.join(self.folder, "logs", f"{cell.slug}.log")
+
+    def update(self, cell: BatchCell, **result: Any) -> None:
+        self.data["cells"][cell.cell_id] = {**cell.to_dict(), **result}
+        self.save()
+
+    def save(self) -> None:
+        self.data["updated_at"] = _now_iso()
+        _write_atomic(
+            os.path.join(self.folder, "manifest.json"),
+            json.dumps(self.data, indent=2),
+        )
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CELL_FIELDS + RESULT_FIELDS)
+        writer.writeheader()
+        writer.writerows(summarize(self.data)["results"])
+        _write_atomic(os.path.join(self.folder, "results.csv"), buffer.getvalue())
+
+    def save_summary(self) -> str:
+        """Write the batch's ``summary.json`` from its graded cells' results."""
+        path = os.path.join(self.folder, "summary.json")
+        summary = batch_summary(
+            cell
+            for cell in self.data["cells"].values()
+            if cell.get("status") in TERMINAL_STATUSES
+        )
+        _write_atomic(path, json.dumps(summary, indent=2, ensure_ascii=False) + "\n")
+        return path
+
+
+async def run_batch(
+    cells: list[BatchCell],
+    name: Optional[str] = None,
+    concurrency: Optional[int] = None,
+    rerun_failed: bool = False,
+    render_formats=None,
+    speculative_attempts: Optional[int] = None,
+    on_cell: Optional[Callable[[dict[str, Any]], None]] = None,
+) -> dict[str, Any]:
+    """Run every cell not already done; returns ``summarize`` of the batch.
+
+    ``on_cell`` receives each cell's results row as it finishes (or is
+    skipped).  ``render_formats`` and ``speculative_attempts`` are passed to
+    every run.
+    """
+    manifest = _Manifest(name or default_batch_name(), cells)
+    limit = asyncio.Semaphore(batch_concurrency(concurrency))
+
+    def report(cell: BatchCell) -> None:
+        if on_cell is not None:
+            result = manifest.data["cells"][cell.cell_id]
+            on_cell({**cell.to_dict(), **{k: result.get(k) for k in RESULT_FIELDS}})
+
+    async def run_cell(cell: BatchCell) -> None:
+        if manifest.is_done(cell, rerun_failed):
+            report(cell)
+            return
+        async with limit:
+            started = {"started_at": _now_iso()}
+            manifest.update(cell, status="running", **started)
+
+            def on_folder(folder: str) -> None:
+                # Recorded before the run starts, so an interrupted batch
+                # finds the cell's status.json when it resumes.
+                started["folder"] = folder
+                manifest.update(cell, status="running", **started)
+
+            ticket = await _submit(
+                cell.model,
+                attempts_per_round(speculative_attempts),
+                tuple(grading_sample_models(cell.model)) if cell.grading else (),
+            )
+            try:
+                async with ticket:
+                    result = await _run_cell(
+                        cell,
+                        manifest.log_path(cell),
+                        render_formats,
+                        speculative_attempts,
+                        on_folder,
+                    )
+            except Exception as exc:
+                # Not terminal: a resumed batch runs this cell again unless
+                # its run folder's status.json is.
+                manifest.update(
+                    cell,
+                    status="error",
+                    error_type="unexpected",
+                    error_message=str(exc),
+                    completed_at=_now_iso(),
+                    **started,
+                )
+            else:
+                started["folder"] = result.folder
+                status = result.status or {}
+                error = status.get("error") or {}
+                overall = (status.get("metrics") or {}).get("overall") or {}
+                manifest.update(
+                    cell,
+                    status=status.get("status", "failed"),
+                    error_type=error.get("type"),
+                    error_message=error.get("message"),
+                    duration_seconds=result.duration_seconds,
+                    completed_at=result.completed_at,
+                    **overall,
+                    **started,
+                )
+        report(cell)
+
+    await asyncio.gather(*(run_cell(cell) for cell in cells))
+    manifest.save_summary()
+    return summarize(manifest.data)
+
+
+async def _submit(model: str, slots: int, extra_models: tuple[str, ...]):
+    """A scheduler ticket for a cell, waiting out a full queue instead of failing.
+
+    ``extra_models`` are the consensus grading models of a graded cell.
+    """
+    while True:
+        try:
+            return get_scheduler().submit(
+                model, priority=BATCH_PRIORITY, extra_models=extra_models, slots=slots
+            )
+        except QueueFullError:
+            await asyncio.sleep(QUEUE_FULL_RETRY_SECONDS)
+
+
+async def _run_cell(
+    cell: BatchCell, log_path: str, render_formats, speculative_attempts, on_folder
+):
+    run = arun_single_prompt if cell.strategy == "single_prompt" else arun_two_stage_prompt
+    with open(log_path, "a", encoding="utf-8") as log, progress.progress_scope(
+        lambda line: log.write(line + "\n")
+    ):
+        return await run(
+            system_prompt=getattr(sm_descriptions, cell.example_key),
+            model=cell.model,
+            system_name=cell.example_key,
+            enable_auto_grading=cell.grading,
+            example_key=cell.example_key,
+            render_formats=render_formats,
+            speculative_attempts=speculative_attempts,
+            on_folder=on_folder,
+        )
+
+
+def _safe_name(name: str) -> str:
+    safe = "".join(c if c.isalnum() or c in ("-", "_", ".") else "_" for c in name)
+    return safe.strip("._") or "batch"
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _write_atomic(dest: str, text: str) -> None:
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix=".batch_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+        os.replace(tmp, dest)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Run (or resume) a batch of generations over examples x models x strategies."
+    )
+    parser.add_argument("--name", help="Batch name; an existing batch is resumed")
+    parser.add_argument("--examples", nargs="+", metavar="KEY")
+    parser.add_argument("--models", nargs="+", metavar="MODEL")
+    parser.add_argument("--strategies", nargs="+", choices=STRATEGIES)
+    parser.add_argument("--grading", choices=["on", "off", "both"])
+    parser.add_argument("--concurrency", type=int)
+    parser.add_argument("--rerun-failed", action="store_true")
+    parser.add_argument(
+        "--list", action="store_true", help="Print the available examples and models"
+    )
+    args = parser.parse_args()
+
+    if args.list:
+        print("Examples:\n  " + "\n  ".join(example_keys()))
+        print("Models:\n  " + "\n  ".join(PROFILE_TO_OPENROUTER))
+        return 0
+
+    name = args.name or default_batch_name()
+    axes = (args.examples, args.models, args.strategies, args.grading)
+    cells = stored_matrix(name) if args.name and not any(axes) else None
+    if cells:
+        print(f"Resuming batch {name!r} with its stored matrix")
+    else:
+        grading = {"on": (True,), "off": (False,), "both": (True, False)}[
+            args.grading or "on"
+        ]
+        try:
+            cells = build_matrix(args.examples, args.models, args.strategies, grading)
+        except ValueError as exc:
+            parser.error(str(exc))
+
+    print(f"Batch {name!r}: {len(cells)} cell(s) -> {batch_folder(name)}")
+
+    def on_cell(row: dict[str, Any]) -> None:
+        graded = "graded" if row["grading"] else "ungraded"
+        print(
+            f"  {row['status']:<9} {row['example_key']} / {row['model']} / "
+            f"{row['strategy']} ({graded})",
+            flush=True,
+        )
+
+    summary = asyncio.run(
+        run_batch(cells, name, args.concurrency, args.rerun_failed, on_cell=on_cell)
+    )
+    counts = ", ".join(f"{count} {status}" for status, count in sorted(summary["counts"].items()))
+    print(f"Done: {counts}")
+    print(f"Results table: {os.path.join(summary['folder'], 'results.csv')}")
+    print(f"Metrics: {os.path.join(summary['folder'], 'summary.json')}")
+    return 0 if all(status in TERMINAL_STATUSES for status in summary["counts"]) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
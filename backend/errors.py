@@ -12,12 +12,17 @@ import json
 import logging
 import os
 import tempfile
-import tempfile
+import time
 from dataclasses import asdict, dataclass, field
 from datetime import datetime, timezone
 from enum import Enum
 from typing import Any, Optional
 
+try:
+    from . import run_index
+except ImportError:
+    import run_index
+
 logger = logging.getLogger(__name__)
 
 
@@ -76,6 +81,51 @@ class RunStatus:
         }
 
 
+@dataclass
+class RunResult:
+    """What a run entry point hands back to its caller.
+
+    Carries the run folder it wrote so callers never have to search the
+    output tree for it.  Truthiness follows ``success`` so existing
+    ``if run_single_prompt(...):`` call sites keep working.
+    """
+
+    success: bool
+    folder: Optional[str]
+    status: Optional[dict[str, Any]] = None
+    started_at: Optional[str] = None
+    completed_at: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    diagram_path: Optional[str] = None
+
+    def __bool__(self) -> bool:
+        return self.success
+
+    @classmethod
+    def collect(
+        cls,
+        paths: dict,
+        success: bool,
+        started_at: float,
+        diagram_path: Optional[str] = None,
+    ) -> "RunResult":
+        """Build the result for the run in ``paths`` that began at ``started_at``."""
+        finished_at = time.time()
+        folder = paths.get("log_base_dir")
+        return cls(
+            success=success,
+            folder=folder,
+            status=read_status(folder) if folder else None,
+            started_at=datetime.fromtimestamp(started_at, timezone.utc).isoformat(),
+            completed_at=datetime.fromtimestamp(finished_at, timezone.utc).isoformat(),
+            duration_seconds=round(finished_at - started_at, 3),
+            diagram_path=diagram_path,
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
@@ -105,12 +155,24 @@ def write_status(paths: dict, status: RunStatus) -> None:
         and status.completed_at is None
     ):
         status.completed_at = _now_iso()
+    data = status.to_dict()
+    # Keep spans and metrics recorded earlier in the run across status transitions.
+    previous = read_status(base) or {}
+    for key in ("spans", "metrics"):
+        if previous.get(key):
+            data[key] = previous[key]
+    if not _write_status_file(base, data):
+        return
+    run_index.update_run_status(base, status.status.value)
+
+
+def _write_status_file(base: str, data: dict[str, Any]) -> bool:
     dest = os.path.join(base, "status.json")
     try:
         fd, tmp = tempfile.mkstemp(dir=base, prefix=".status_", suffix=".tmp")
         try:
             with os.fdopen(fd, "w", encoding="utf-8") as f:
-                json.dump(status.to_dict(), f, indent=2)
+                json.dump(data, f, indent=2)
             os.replace(tmp, dest)
         except BaseException:
             with contextlib.suppress(OSError):
@@ -118,6 +180,28 @@ def write_status(paths: dict, status: RunStatus) -> None:
             raise
     except OSError as exc:
         logger.warning("Failed to write status.json to %s: %s", dest, exc)
+        return False
+    return True
+
+
+def record_spans(paths: dict, spans: list[dict[str, Any]]) -> None:
+    """Store a run's timing spans (see ``telemetry``) in its ``status.json``."""
+    base = paths.get("log_base_dir")
+    if not base:
+        return
+    data = read_status(base) or {"status": RunStatusValue.IN_PROGRESS.value}
+    data["spans"] = spans
+    _write_status_file(base, data)
+
+
+def record_metrics(paths: dict, metrics: dict[str, Any]) -> None:
+    """Store a run's grading metrics (see ``grading_metrics``) in its ``status.json``."""
+    base = paths.get("log_base_dir")
+    if not base:
+        return
+    data = read_status(base) or {"status": RunStatusValue.IN_PROGRESS.value}
+    data["metrics"] = metrics
+    _write_status_file(base, data)
 
 
 def read_status(folder: str) -> Optional[dict[str, Any]]:
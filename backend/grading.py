@@ -1,25 +1,37 @@
+import asyncio
 import os
 import re
 import csv
 import io
-from typing import Optional
+import json
+import time
+from typing import NamedTuple, Optional
 import sys
 
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.join(os.path.dirname(__file__), "resources"))
 
 
-from resources.util import call_openrouter_llm
-from resources.prompts.single_prompt.grading_prompt_template import (
-    build_grading_prompt,
+from resources.util import (
+    acall_openrouter_llm,
+    run_blocking,
+    run_sync,
 )
-from resources import state_machine_descriptions as sm_descriptions
-from resources.n_shot_examples_single_prompt_mermaid import (
-    get_example_mermaid_code,
+from resources.pre_grader import pre_grade_rows, pre_grading_enabled
+from resources.prompts.single_prompt.grading_prompt_template import (
+    build_grading_prompt_suffix,
 )
+from rubrics import RubricRegistry
+from grading_cache import get_grading_cache, grading_cache_enabled, grading_cache_key
+from agreement import agreement_report, consensus_grade, parse_grade
+from grading_metrics import category_counts, metrics_block
+from model_profiles import resolve_model
+import telemetry
 from errors import (
     ErrorType,
     RunError,
+    record_metrics,
+    record_spans,
     write_success,
     write_failure,
 )
@@ -27,36 +39,45 @@ from errors import (
 MAX_GRADING_ATTEMPTS = 3
 
 
-def _run_single_grading_attempt(
+async def _run_single_grading_attempt(
     prompt: str,
+    prompt_prefix: str,
     model: str,
     gt_fieldnames: list[str],
     gt_rows: list[dict[str, str]],
     paths: dict,
     attempt_idx: int,
+    label: str = "",
+    temperature: float = 0.0,
 ) -> tuple[bool, list[dict[str, str]], list[str], str, str, dict]:
     """Execute one grading LLM call and parse its CSV response.
 
+    ``label`` names the rubric chunk in log lines; chunked responses are
+    written to ``grading_output_path`` together by the caller.
+
     Returns:
         (rows_are_valid, rows, fieldnames, validation_error, grading_response, error_details)
     """
 
-    grading_response = call_openrouter_llm(
+    grading_response = await acall_openrouter_llm(
         prompt,
         max_tokens=8000,
-        temperature=0.0,
+        temperature=temperature,
         model=model,
+        cache_prefix=prompt_prefix,
     )
 
-    if paths.get("grading_output_path"):
+    validate_started = time.perf_counter()
+    if paths.get("grading_output_path") and not label:
         with open(paths["grading_output_path"], "w") as f:
             f.write(grading_response)
 
     _append_log(
         paths.get("llm_log_path"),
-        f"=== Automatic Grading Response (attempt {attempt_idx + 1}) ===\n",
+        f"=== Automatic Grading Response (attempt {attempt_idx + 1}){label} ===\n"
+        + grading_response
+        + "\n\n",
     )
-    _append_log(paths.get("llm_log_path"), grading_response + "\n\n")
 
     response_csv_text = _extract_csv_text_from_response(grading_response, gt_fieldnames)
     try:
@@ -67,9 +88,10 @@ def _run_single_grading_attempt(
         validation_error = f"Could not parse CSV output. Ensure the response is valid CSV only. Parser error: {exc}"
         _append_log(
             paths.get("llm_log_path"),
-            f"CSV Parsing Failed (attempt {attempt_idx + 1}): {validation_error}\n",
+            f"CSV Parsing Failed (attempt {attempt_idx + 1}){label}: {validation_error}\n",
         )
         error_details = {"parser_error": str(exc)}
+        telemetry.record("grading_validate", validate_started, valid=False)
         return (
             False,
             gt_rows,
@@ -110,7 +132,7 @@ def _run_single_grading_attempt(
         if not rows_are_valid:
             _append_log(
                 paths.get("llm_log_path"),
-                f"CSV Validation Failed (attempt {attempt_idx + 1}): {validation_error}\n",
+                f"CSV Validation Failed (attempt {attempt_idx + 1}){label}: {validation_error}\n",
             )
         elif was_reordered:
             _append_log(
@@ -130,11 +152,12 @@ def _run_single_grading_attempt(
         }
         _append_log(
             paths.get("llm_log_path"),
-            f"CSV Header/Content Check Failed (attempt {attempt_idx + 1}): {validation_error}\n",
+            f"CSV Header/Content Check Failed (attempt {attempt_idx + 1}){label}: {validation_error}\n",
         )
 
     rows = response_rows if rows_are_valid else gt_rows
     fieldnames = fieldnames if rows_are_valid else gt_fieldnames
+    telemetry.record("grading_validate", validate_started, valid=rows_are_valid)
 
     return (
         rows_are_valid,
@@ -146,10 +169,20 @@ def _run_single_grading_attempt(
     )
 
 
-def _resolve_ground_truth_csv_path(base_dir: str, example_key: str) -> str:
-    ground_truth_dir = os.path.join(base_dir, "resources", "ground_truth_grading")
+_rubric_registries: dict[str, RubricRegistry] = {}
 
-    return os.path.join(ground_truth_dir, f"{example_key}.csv")
+
+def get_rubric_registry(base_dir: str) -> RubricRegistry:
+    """Registry of the ground-truth rubrics under ``base_dir``."""
+    ground_truth_dir = os.path.abspath(
+        os.path.join(base_dir, "resources", "ground_truth_grading")
+    )
+    registry = _rubric_registries.get(ground_truth_dir)
+    if registry is None:
+        registry = _rubric_registries.setdefault(
+            ground_truth_dir, RubricRegistry(ground_truth_dir, _read_csv_rows)
+        )
+    return registry
 
 
 def _csv_has_non_header_data(csv_text: str) -> bool:
@@ -516,102 +549,312 @@ def _row_label(row: dict[str, str], immutable_columns: list[str], idx: int) -> s
     return f"row {idx + 1}"
 
 
-def run_automatic_grading(
+def _rows_to_csv_text(fieldnames: list[str], rows: list[dict[str, str]]) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(
+        buffer,
+        fieldnames=fieldnames,
+        quoting=csv.QUOTE_MINIMAL,
+        lineterminator="\n",
+        extrasaction="ignore",
+    )
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+async def _pre_grade(
     student_mermaid_code: str,
-    system_prompt: str,
-    system_name: Optional[str],
-    model: str,
+    fieldnames: list[str],
+    rows: list[dict[str, str]],
     paths: dict,
-    base_dir: str,
-    example_key: str,
-) -> Optional[str]:
-    """Run automatic grading using ground-truth CSV and persist grading artifacts.
+) -> dict:
+    """Pre-grade the rubric rows the parsed diagram settles, by row index."""
+    type_col = _pick_column(fieldnames, ("type",))
+    element_col = _pick_column(fieldnames, ("element",))
+    if not pre_grading_enabled() or not type_col or not element_col:
+        return {}
+
+    with telemetry.span("pre_grade", rows=len(rows)) as span:
+        pre_grades = await run_blocking(
+            pre_grade_rows, student_mermaid_code, rows, type_col, element_col
+        )
+        span["pre_graded"] = len(pre_grades)
 
-    Args:
-        student_mermaid_code: The Mermaid code generated by the LLM.
-        system_prompt: The system description/prompt used.
-        system_name: Optional display name for the system.
-        model: The model used for grading.
-        paths: Dictionary of file paths for output artifacts.
-        base_dir: Base directory for resolving relative paths.
-        example_key: The preset example key (e.g., 'printer_winter_2017') or a slug name for custom systems.
+    telemetry.inc(
+        "sherpa_grading_rows_total",
+        "Rubric rows graded, by grader.",
+        len(pre_grades),
+        grader="structural",
+    )
+    telemetry.inc(
+        "sherpa_grading_rows_total",
+        "Rubric rows graded, by grader.",
+        len(rows) - len(pre_grades),
+        grader="llm",
+    )
+    lines = [
+        f"  {_row_label(rows[idx], [type_col, element_col], idx)}: {grade.note}"
+        for idx, grade in sorted(pre_grades.items())
+    ]
+    _append_log(
+        paths.get("llm_log_path"),
+        "=== Structural Pre-grading ===\n"
+        f"{len(pre_grades)} of {len(rows)} rows pre-graded; "
+        f"{len(rows) - len(pre_grades)} left for the LLM.\n"
+        + "".join(line + "\n" for line in lines)
+        + "\n",
+    )
+    return pre_grades
 
-    Returns:
-        The raw grading response text on success.
 
-    Raises:
-        FileNotFoundError: Ground-truth CSV missing.
-        ValueError: Ground-truth CSV empty.
-        RuntimeError: All grading attempts failed validation.
+def _merge_pre_grades(
+    gt_rows: list[dict[str, str]],
+    pre_grades: dict,
+    llm_rows: list[dict[str, str]],
+    fieldnames: list[str],
+) -> list[dict[str, str]]:
+    """Interleave pre-graded rows with ``llm_rows`` back into rubric order.
+
+    Pre-graded rows are re-keyed to ``fieldnames`` by column position, since
+    the LLM's header may differ cosmetically from the ground truth's.
     """
-    print("Running automatic grading", flush=True)
+    if not pre_grades:
+        return list(llm_rows)
+    score_col = _pick_column(fieldnames, ("grading", "rater"))
+    notes_col = _pick_column(fieldnames, ("notes", "justification", "comment"))
+    remaining = iter(llm_rows)
+    merged: list[dict[str, str]] = []
+    for idx, gt_row in enumerate(gt_rows):
+        grade = pre_grades.get(idx)
+        if grade is None:
+            merged.append(next(remaining))
+            continue
+        row = dict(zip(fieldnames, gt_row.values()))
+        if score_col:
+            row[score_col] = grade.score
+        if notes_col:
+            row[notes_col] = grade.note
+        merged.append(row)
+    return merged
+
 
+def _finish_grading(
+    paths: dict,
+    rows: list[dict[str, str]],
+    fieldnames: list[str],
+    how: str,
+    attempts: int = 0,
+) -> None:
     try:
-        csv_path = _resolve_ground_truth_csv_path(base_dir, example_key)
-        _append_log(
-            paths.get("llm_log_path"), f"=== Grading CSV Path ===\n{csv_path}\n\n"
+        _write_structured_grading_files(paths, rows, fieldnames)
+    except IOError as write_exc:
+        _record_failure(
+            paths,
+            f"Failed to write CSV/TSV: {write_exc}",
+            write_exc,
         )
+        error = RunError(
+            type=ErrorType.UNEXPECTED,
+            message=f"Failed to write grading files: {write_exc}",
+            attempts=attempts,
+        )
+        write_failure(paths, error)
+        raise
+    metrics = metrics_block(category_counts(fieldnames, rows))
+    record_metrics(paths, metrics)
+    telemetry.annotate(f1=metrics["overall"]["f1"])
+    _append_log(
+        paths.get("llm_log_path"),
+        f"\n=== GRADING SUCCESS ===\nAutomatic grading completed successfully {how}.\n",
+    )
+    write_success(paths)
+    print("Automatic grading completed", flush=True)
 
-        if not os.path.exists(csv_path):
-            message = (
-                f"Automatic grading failed: ground-truth CSV not found at {csv_path}.\n"
-                "Create and fill this file to enable grading.\n\n"
-            )
-            _record_failure(paths, message)
-            error = RunError(
-                type=ErrorType.GRADING_VALIDATION,
-                message="Ground-truth CSV not found.",
-                details={"csv_path": csv_path},
-            )
-            write_failure(paths, error)
-            print("Automatic grading failed (missing CSV)", flush=True)
-            raise FileNotFoundError(message)
-
-        with open(csv_path, "r") as f:
-            ground_truth_csv = f.read()
 
-        run_ground_truth_path = os.path.join(
-            paths.get("log_base_dir", base_dir), "ground_truth.csv"
-        )
-        with open(run_ground_truth_path, "w") as f:
-            f.write(ground_truth_csv)
+def grading_chunk_rows() -> int:
+    """Rubric rows per grading call (``SHERPA_GRADING_CHUNK_ROWS``, 0 = no chunking)."""
+    return max(0, int(os.environ.get("SHERPA_GRADING_CHUNK_ROWS", "40")))
 
-        if not _csv_has_non_header_data(ground_truth_csv):
-            message = (
-                f"Automatic grading failed: ground-truth CSV is empty at {csv_path}.\n"
-                "Paste the grading sheet rows, then re-run generation.\n\n"
-            )
-            _record_failure(paths, message)
-            error = RunError(
-                type=ErrorType.GRADING_VALIDATION,
-                message="Ground-truth CSV is empty.",
-                details={"csv_path": csv_path},
-            )
-            write_failure(paths, error)
-            print("Automatic grading failed (empty CSV)", flush=True)
-            raise ValueError(message)
 
-        ground_truth_mermaid_code = (
-            get_example_mermaid_code(example_key) if example_key else ""
-        ) or ""
+def grading_sample_models(
+    model: str,
+    samples: Optional[int] = None,
+    sample_models: Optional[list[str]] = None,
+) -> list[str]:
+    """The model of each grading sample to run.
+
+    ``samples`` defaults to ``SHERPA_GRADING_SAMPLES`` (1 = single grader)
+    and ``sample_models`` to ``SHERPA_GRADING_MODELS`` (comma-separated),
+    else just ``model``.  Samples cycle through the models, and every listed
+    model grades at least once.
+    """
+    if samples is None:
+        samples = int(os.environ.get("SHERPA_GRADING_SAMPLES", "1"))
+    if sample_models is None:
+        sample_models = os.environ.get("SHERPA_GRADING_MODELS", "").split(",")
+    models = [resolve_model(name.strip()) for name in sample_models if name.strip()]
+    models = models or [model]
+    count = max(1, samples, len(models))
+    return [models[i % len(models)] for i in range(count)]
+
+
+def grading_sample_temperatures(models: list[str]) -> list[float]:
+    """Sampling temperature of each grading sample in ``models``.
+
+    A model that grades only once does so deterministically (0.0).  Samples
+    of a model that grades several times use ``SHERPA_GRADING_TEMPERATURE``
+    (default 0.7): at 0.0 they would be near-duplicate calls, and their
+    consensus and kappa would only restate one grader's answer.
+    """
+    temperature = float(os.environ.get("SHERPA_GRADING_TEMPERATURE", "0.7"))
+    return [temperature if models.count(model) > 1 else 0.0 for model in models]
+
+
+def _chunk_rubric_rows(
+    rows: list[dict[str, str]],
+    type_col: Optional[str],
+    element_col: Optional[str],
+    max_rows: int,
+) -> list[list[int]]:
+    """Split ``rows`` into contiguous chunks of at most ``max_rows`` (by index).
+
+    Chunks follow the rubric's structure: a composite state or region starts
+    a new section, the "additional elements" rows form one, and sections are
+    packed whole where they fit.  Action and guard rows always stay with the
+    state or transition row above them.
+    """
+    if max_rows <= 0 or len(rows) <= max_rows or not type_col:
+        return [list(range(len(rows)))]
+
+    sections: list[list[list[int]]] = []
+    in_additional = False
+    for idx, row in enumerate(rows):
+        kind = _normalize_header(row.get(type_col, ""))
+        additional = bool(element_col) and (
+            _normalize_header(row.get(element_col, "")) == "additionalelements"
+        )
+        if kind in ("action", "guard") and sections and not additional:
+            sections[-1][-1].append(idx)
+            continue
+        if (
+            not sections
+            or kind in ("compositestate", "region")
+            or additional != in_additional
+        ):
+            sections.append([])
+        in_additional = additional
+        sections[-1].append([idx])
+
+    chunks: list[list[int]] = [[]]
+    for section in sections:
+        if chunks[-1] and len(chunks[-1]) + sum(map(len, section)) > max_rows:
+            chunks.append([])
+        for group in section:
+            if chunks[-1] and len(chunks[-1]) + len(group) > max_rows:
+                chunks.append([])
+            chunks[-1].extend(group)
+    return chunks
+
+
+class _ChunkResult(NamedTuple):
+    valid: bool
+    rows: list[dict[str, str]]
+    fieldnames: list[str]
+    error: str
+    error_details: dict
+    response: str
+    prompt: str
+    attempts: int
+    first_row: int
+
+
+async def _grade_chunk(
+    student_mermaid_code: str,
+    prompt_prefix: str,
+    ground_truth_csv: Optional[str],
+    model: str,
+    gt_fieldnames: list[str],
+    gt_rows: list[dict[str, str]],
+    chunk: list[int],
+    paths: dict,
+    number: int,
+    total: int,
+    sample: str = "",
+    sample_number: int = 1,
+    use_cache: bool = False,
+    temperature: float = 0.0,
+) -> _ChunkResult:
+    """Grade the rubric rows ``chunk`` (indices into ``gt_rows``), with retries.
+
+    Every other rubric row is shown to the LLM as context only.
+    ``ground_truth_csv`` is the rubric's own text when the chunk covers it all.
+    With ``use_cache``, rows validated earlier for the same inputs are reused
+    and fresh ones are stored (``grading_cache``).
+    """
+    chunk_rows = [gt_rows[idx] for idx in chunk]
+    in_chunk = set(chunk)
+    other_rows = [row for idx, row in enumerate(gt_rows) if idx not in in_chunk]
+    parts = ([sample] if sample else []) + (
+        [f"chunk {number}/{total}"] if total > 1 else []
+    )
+    label = f" ({', '.join(parts)})" if parts else ""
 
-        grading_prompt = build_grading_prompt(
+    with telemetry.labels(**({"grading_chunk": number} if total > 1 else {})):
+        prompt_build_started = time.perf_counter()
+        chunk_csv = ground_truth_csv or _rows_to_csv_text(gt_fieldnames, chunk_rows)
+        other_rows_csv = (
+            _rows_to_csv_text(gt_fieldnames[:2], other_rows) if other_rows else ""
+        )
+        grading_prompt = prompt_prefix + build_grading_prompt_suffix(
             student_mermaid_code=student_mermaid_code,
-            ground_truth_csv=ground_truth_csv,
-            ground_truth_mermaid_code=ground_truth_mermaid_code,
-            system_description=system_prompt,
+            ground_truth_csv=chunk_csv,
+            other_rows_csv=other_rows_csv,
+        )
+        telemetry.record(
+            "prompt_build",
+            prompt_build_started,
+            prompt_chars=len(grading_prompt),
+            prefix_chars=len(prompt_prefix),
         )
 
-        if paths.get("grading_prompt_path"):
-            with open(paths["grading_prompt_path"], "w") as f:
-                f.write(grading_prompt)
-
-        _append_log(paths.get("llm_log_path"), "=== Automatic Grading Prompt ===\n")
-        _append_log(paths.get("llm_log_path"), grading_prompt + "\n\n")
-
-        print("Evaluating generation against ground truth", flush=True)
+        _append_log(
+            paths.get("llm_log_path"),
+            f"=== Automatic Grading Prompt{label} ===\n" + grading_prompt + "\n\n",
+        )
 
-        gt_fieldnames, gt_rows = _read_csv_rows(ground_truth_csv)
+        cache_key = (
+            grading_cache_key(
+                model,
+                sample_number,
+                temperature,
+                prompt_prefix,
+                chunk_csv,
+                other_rows_csv,
+                student_mermaid_code,
+            )
+            if use_cache
+            else None
+        )
+        cached = get_grading_cache().get(cache_key) if cache_key else None
+        if cached is not None and len(cached["rows"]) == len(chunk_rows):
+            _append_log(
+                paths.get("llm_log_path"),
+                f"=== Grading Cache Hit{label} ===\n"
+                f"Reusing {len(chunk_rows)} rows graded by {cached.get('model', model)} "
+                f"at {cached.get('created_at', '?')}.\n\n",
+            )
+            return _ChunkResult(
+                valid=True,
+                rows=[dict(zip(cached["fieldnames"], row)) for row in cached["rows"]],
+                fieldnames=cached["fieldnames"],
+                error="",
+                error_details={},
+                response=cached.get("response", ""),
+                prompt=grading_prompt,
+                attempts=0,
+                first_row=chunk[0],
+            )
 
         # Pre-compute immutable columns for retry prompts
         _score_col = _pick_column(gt_fieldnames, ("grading", "rater"))
@@ -621,7 +864,7 @@ def run_automatic_grading(
 
         last_validation_error = ""
         last_error_details: dict = {}
-        grading_response: Optional[str] = None
+        grading_response = ""
         retry_requirements = (
             "Use the exact header from the grading sheet, keep the same number and order of rows as the ground truth, "
             "do not add or remove rows, and only modify the grading and notes/justification columns. "
@@ -640,12 +883,12 @@ def run_automatic_grading(
                 specific_guidance = ""
                 if last_error_details.get("issue") in ("missing_rows", "extra_rows"):
                     row_list = []
-                    for i, gt_row in enumerate(gt_rows, start=1):
+                    for i, gt_row in enumerate(chunk_rows, start=1):
                         vals = [gt_row.get(col, "") for col in _immutable_cols]
                         row_list.append(f"  Row {i}: {', '.join(vals)}")
                     specific_guidance = (
-                        f"\nThe CSV must have exactly {len(gt_rows)} data rows (plus the header). "
-                        f"Here are all {len(gt_rows)} rows with their exact Type and Element values "
+                        f"\nThe CSV must have exactly {len(chunk_rows)} data rows (plus the header). "
+                        f"Here are all {len(chunk_rows)} rows with their exact Type and Element values "
                         "that you must preserve:\n" + "\n".join(row_list) + "\n\n"
                     )
                 elif last_error_details.get("mismatched_rows"):
@@ -666,51 +909,48 @@ def run_automatic_grading(
                     "Return a valid CSV only."
                 )
 
-            (
-                rows_are_valid,
-                rows,
-                fieldnames,
-                validation_error,
-                grading_response,
-                error_details,
-            ) = _run_single_grading_attempt(
-                effective_prompt,
-                model,
-                gt_fieldnames,
-                gt_rows,
-                paths,
-                attempt,
-            )
+            with telemetry.labels(grading_attempt=attempt + 1):
+                (
+                    rows_are_valid,
+                    rows,
+                    fieldnames,
+                    validation_error,
+                    grading_response,
+                    error_details,
+                ) = await _run_single_grading_attempt(
+                    effective_prompt,
+                    prompt_prefix,
+                    model,
+                    gt_fieldnames,
+                    chunk_rows,
+                    paths,
+                    attempt,
+                    label,
+                    temperature,
+                )
 
             if rows_are_valid:
-                try:
-                    _write_structured_grading_files(paths, rows, fieldnames)
-                except IOError as write_exc:
-                    _record_failure(
-                        paths,
-                        f"Failed to write CSV/TSV: {write_exc}",
-                        write_exc,
-                    )
-                    error = RunError(
-                        type=ErrorType.UNEXPECTED,
-                        message=f"Failed to write grading files: {write_exc}",
-                        attempts=attempt + 1,
+                if cache_key:
+                    get_grading_cache().put(
+                        cache_key, fieldnames, rows, grading_response, model
                     )
-                    write_failure(paths, error)
-                    raise
-                _append_log(
-                    paths.get("llm_log_path"),
-                    f"\n=== GRADING SUCCESS ===\nAutomatic grading completed successfully on attempt {attempt + 1}.\n",
+                return _ChunkResult(
+                    valid=True,
+                    rows=rows,
+                    fieldnames=fieldnames,
+                    error="",
+                    error_details={},
+                    response=grading_response,
+                    prompt=grading_prompt,
+                    attempts=attempt + 1,
+                    first_row=chunk[0],
                 )
-                write_success(paths)
-                print("Automatic grading completed", flush=True)
-                return grading_response
 
             last_validation_error = validation_error
             last_error_details = error_details
             _append_log(
                 paths.get("llm_log_path"),
-                f"\n--- Attempt {attempt + 1} Invalid ---\nValidation Error: {validation_error}\n",
+                f"\n--- Attempt {attempt + 1}{label} Invalid ---\nValidation Error: {validation_error}\n",
             )
             if attempt < MAX_GRADING_ATTEMPTS - 1:
                 _append_log(
@@ -718,15 +958,428 @@ def run_automatic_grading(
                     f"Retrying with error feedback...\n",
                 )
 
-        # Fallback: persist ground truth with error note so the UI shows the failure.
-        fallback_rows = gt_rows
+    return _ChunkResult(
+        valid=False,
+        rows=chunk_rows,
+        fieldnames=gt_fieldnames,
+        error=last_validation_error,
+        error_details=last_error_details,
+        response=grading_response,
+        prompt=grading_prompt,
+        attempts=MAX_GRADING_ATTEMPTS,
+        first_row=chunk[0],
+    )
+
+
+async def _grade_sample(
+    student_mermaid_code: str,
+    prompt_prefix: str,
+    ground_truth_csv: str,
+    model: str,
+    gt_fieldnames: list[str],
+    gt_rows: list[dict[str, str]],
+    chunks: list[list[int]],
+    paths: dict,
+    number: int,
+    total: int,
+    use_cache: bool,
+    temperature: float = 0.0,
+) -> list[_ChunkResult]:
+    """Grade every chunk once with ``model``: one grading sample of the rubric."""
+    sample = f"sample {number}/{total}" if total > 1 else ""
+    with telemetry.labels(**({"grading_sample": number} if total > 1 else {})):
+        return await asyncio.gather(
+            *(
+                _grade_chunk(
+                    student_mermaid_code,
+                    prompt_prefix,
+                    ground_truth_csv if len(chunk) == len(gt_rows) else None,
+                    model,
+                    gt_fieldnames,
+                    gt_rows,
+                    chunk,
+                    paths,
+                    chunk_number,
+                    len(chunks),
+                    sample,
+                    number,
+                    use_cache,
+                    temperature,
+                )
+                for chunk_number, chunk in enumerate(chunks, start=1)
+            )
+        )
+
+
+def _consensus_rows(
+    paths: dict,
+    fieldnames: list[str],
+    sample_rows: list[list[dict[str, str]]],
+    labels: list[str],
+    failed_labels: list[str],
+    temperatures: dict[str, float],
+) -> list[dict[str, str]]:
+    """Reduce per-sample grades to one consensus row each; record agreement.
+
+    Writes every sample's grade next to the consensus to
+    ``grading_samples.csv`` and the weighted kappa between samples, with
+    each sample's ``temperatures`` entry, to ``grading_agreement.json``.
+    """
+    type_col = _pick_column(fieldnames, ("type",))
+    element_col = _pick_column(fieldnames, ("element",))
+    score_col = _pick_column(fieldnames, ("grading", "rater"))
+    notes_col = _pick_column(fieldnames, ("notes", "justification", "comment"))
+
+    consensus: list[dict[str, str]] = []
+    sheet: list[dict[str, str]] = []
+    for position, row in enumerate(sample_rows[0]):
+        grades = [rows[position].get(score_col, "") for rows in sample_rows]
+        grade, agreeing = consensus_grade(grades)
+        merged = dict(row)
+        if score_col and grade is not None:
+            merged[score_col] = grade
+            if notes_col:
+                source = next(
+                    rows[position]
+                    for rows in sample_rows
+                    if parse_grade(rows[position].get(score_col)) == parse_grade(grade)
+                )
+                merged[notes_col] = (
+                    f"{source.get(notes_col, '')} "
+                    f"[consensus {agreeing}/{len(grades)}: {', '.join(grades)}]"
+                ).strip()
+        consensus.append(merged)
+        sheet.append(
+            {
+                "Type": row.get(type_col, ""),
+                "Element": row.get(element_col, ""),
+                **dict(zip(labels, grades)),
+                "Consensus": grade or "",
+            }
+        )
+
+    if paths.get("grading_samples_csv_path"):
+        with open(paths["grading_samples_csv_path"], "w", newline="", encoding="utf-8") as f:
+            f.write(_rows_to_csv_text(["Type", "Element", *labels, "Consensus"], sheet))
+
+    categories = [
+        None
+        if _normalize_header(row["Element"]) == "additionalelements"
+        else row["Type"]
+        for row in sheet
+    ]
+    report = agreement_report(
+        categories, [[row[label] for row in sheet] for label in labels], labels
+    )
+    report["failed_samples"] = failed_labels
+    report["temperatures"] = temperatures
+    if paths.get("grading_agreement_path"):
+        with open(paths["grading_agreement_path"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    overall = report["mean_weighted_cohens_kappa"]["overall"]
+    telemetry.annotate(weighted_kappa=overall, samples_graded=len(labels))
+    _append_log(
+        paths.get("llm_log_path"),
+        f"=== Grading Consensus ===\n{len(labels)} samples; "
+        f"{report['unanimous_rows']}/{report['rows']} rows unanimous; "
+        f"mean weighted Cohen's kappa {overall}.\n"
+        + (f"Failed samples: {', '.join(failed_labels)}\n" if failed_labels else "")
+        + "\n",
+    )
+    return consensus
+
+
+def run_automatic_grading(
+    student_mermaid_code: str,
+    system_prompt: str,
+    system_name: Optional[str],
+    model: str,
+    paths: dict,
+    base_dir: str,
+    example_key: str,
+    samples: Optional[int] = None,
+    sample_models: Optional[list[str]] = None,
+    use_cache: Optional[bool] = None,
+) -> Optional[str]:
+    """Blocking wrapper around ``arun_automatic_grading`` for synchronous callers."""
+    return run_sync(
+        arun_automatic_grading(
+            student_mermaid_code,
+            system_prompt,
+            system_name,
+            model,
+            paths,
+            base_dir,
+            example_key,
+            samples,
+            sample_models,
+            use_cache,
+        )
+    )
+
+
+async def arun_automatic_grading(
+    student_mermaid_code: str,
+    system_prompt: str,
+    system_name: Optional[str],
+    model: str,
+    paths: dict,
+    base_dir: str,
+    example_key: str,
+    samples: Optional[int] = None,
+    sample_models: Optional[list[str]] = None,
+    use_cache: Optional[bool] = None,
+) -> Optional[str]:
+    """Run automatic grading using ground-truth CSV and persist grading artifacts.
+
+    Args:
+        student_mermaid_code: The Mermaid code generated by the LLM.
+        system_prompt: The system description/prompt used.
+        system_name: Optional display name for the system.
+        model: The model used for grading.
+        paths: Dictionary of file paths for output artifacts.
+        base_dir: Base directory for resolving relative paths.
+        example_key: The preset example key (e.g., 'printer_winter_2017') or a slug name for custom systems.
+        samples: Independent grading samples to run concurrently and reduce to
+            a consensus grade per row (default ``SHERPA_GRADING_SAMPLES``, 1).
+            Samples of a model that grades more than once are drawn at
+            ``SHERPA_GRADING_TEMPERATURE`` (see ``grading_sample_temperatures``).
+        sample_models: Models the samples cycle through (profile keys or
+            OpenRouter ids; default ``SHERPA_GRADING_MODELS``, else ``model``).
+            Every listed model grades at least once.
+        use_cache: Reuse (and store) validated grades for identical inputs;
+            False bypasses the grading cache (default ``SHERPA_GRADING_CACHE``).
+
+    Returns:
+        The raw grading response text on success, or the written grading
+        CSV when every rubric row was pre-graded and the LLM was skipped.
+
+    Raises:
+        FileNotFoundError: Ground-truth CSV missing.
+        ValueError: Ground-truth CSV empty.
+        RuntimeError: All grading attempts failed validation.
+    """
+    models = grading_sample_models(model, samples, sample_models)
+    with telemetry.run_trace(on_close=lambda spans: record_spans(paths, spans)):
+        with telemetry.span("grading", model=model, samples=len(models)):
+            return await _grade(
+                student_mermaid_code,
+                system_prompt,
+                models,
+                paths,
+                base_dir,
+                example_key,
+                grading_cache_enabled(use_cache),
+            )
+
+
+async def _grade(
+    student_mermaid_code: str,
+    system_prompt: str,
+    models: list[str],
+    paths: dict,
+    base_dir: str,
+    example_key: str,
+    use_cache: bool,
+) -> Optional[str]:
+    print("Running automatic grading", flush=True)
+
+    try:
+        registry = get_rubric_registry(base_dir)
+        csv_path = registry.path_for(example_key)
+        _append_log(
+            paths.get("llm_log_path"), f"=== Grading CSV Path ===\n{csv_path}\n\n"
+        )
+
+        rubric = registry.get(example_key)
+        if rubric is None:
+            message = (
+                f"Automatic grading failed: ground-truth CSV not found at {csv_path}.\n"
+                "Create and fill this file to enable grading.\n\n"
+            )
+            _record_failure(paths, message)
+            error = RunError(
+                type=ErrorType.GRADING_VALIDATION,
+                message="Ground-truth CSV not found.",
+                details={"csv_path": csv_path},
+            )
+            write_failure(paths, error)
+            print("Automatic grading failed (missing CSV)", flush=True)
+            raise FileNotFoundError(message)
+
+        ground_truth_csv = rubric.csv_text
+
+        run_ground_truth_path = os.path.join(
+            paths.get("log_base_dir", base_dir), "ground_truth.csv"
+        )
+        with open(run_ground_truth_path, "w") as f:
+            f.write(ground_truth_csv)
+
+        if not _csv_has_non_header_data(ground_truth_csv):
+            message = (
+                f"Automatic grading failed: ground-truth CSV is empty at {csv_path}.\n"
+                "Paste the grading sheet rows, then re-run generation.\n\n"
+            )
+            _record_failure(paths, message)
+            error = RunError(
+                type=ErrorType.GRADING_VALIDATION,
+                message="Ground-truth CSV is empty.",
+                details={"csv_path": csv_path},
+            )
+            write_failure(paths, error)
+            print("Automatic grading failed (empty CSV)", flush=True)
+            raise ValueError(message)
+
+        gt_fieldnames, gt_rows = list(rubric.fieldnames), rubric.copy_rows()
+
+        # Rows the parsed diagram settles are graded without the LLM; only
+        # the rest go into the grading sheet it completes.
+        pre_grades = await _pre_grade(student_mermaid_code, gt_fieldnames, gt_rows, paths)
+        llm_indices = [idx for idx in range(len(gt_rows)) if idx not in pre_grades]
+        llm_rows = [gt_rows[idx] for idx in llm_indices]
+        if not llm_rows:
+            rows = _merge_pre_grades(gt_rows, pre_grades, [], gt_fieldnames)
+            _finish_grading(paths, rows, gt_fieldnames, "with every row pre-graded")
+            return _rows_to_csv_text(gt_fieldnames, rows)
+
+        # The prefix is static per example; only the suffix is built per run.
+        prompt_prefix = rubric.prompt_prefix(system_prompt)
+        chunks = [
+            [llm_indices[pos] for pos in chunk]
+            for chunk in _chunk_rubric_rows(
+                llm_rows,
+                _pick_column(gt_fieldnames, ("type",)),
+                _pick_column(gt_fieldnames, ("element",)),
+                grading_chunk_rows(),
+            )
+        ]
+        if len(chunks) > 1:
+            _append_log(
+                paths.get("llm_log_path"),
+                f"=== Chunked Grading ===\n{len(llm_rows)} rows in {len(chunks)} chunks "
+                f"of {', '.join(str(len(chunk)) for chunk in chunks)} rows.\n\n",
+            )
+
+        print("Evaluating generation against ground truth", flush=True)
+
+        temperatures = grading_sample_temperatures(models)
+        sample_results = await asyncio.gather(
+            *(
+                _grade_sample(
+                    student_mermaid_code,
+                    prompt_prefix,
+                    ground_truth_csv,
+                    sample_model,
+                    gt_fieldnames,
+                    gt_rows,
+                    chunks,
+                    paths,
+                    number,
+                    len(models),
+                    use_cache,
+                    temperature,
+                )
+                for number, (sample_model, temperature) in enumerate(
+                    zip(models, temperatures), start=1
+                )
+            )
+        )
+        results = sample_results[0]
+        if paths.get("grading_prompt_path"):
+            with open(paths["grading_prompt_path"], "w") as f:
+                f.write("\n\n".join(result.prompt for result in results))
+        if len(models) > 1:
+            grading_response = "\n\n".join(
+                f"=== Sample {number}/{len(models)} ({sample_model}) ===\n"
+                + "\n\n".join(result.response for result in sample)
+                for number, (sample_model, sample) in enumerate(
+                    zip(models, sample_results), start=1
+                )
+            )
+        else:
+            grading_response = "\n\n".join(result.response for result in results)
+        if paths.get("grading_output_path"):
+            with open(paths["grading_output_path"], "w") as f:
+                f.write(grading_response)
+
+        labels = [
+            f"sample_{number} ({sample_model})"
+            for number, sample_model in enumerate(models, start=1)
+        ]
+        sample_valid = [
+            all(result.valid for result in sample) for sample in sample_results
+        ]
+        if any(sample_valid):
+            graded = [
+                sample for sample, valid in zip(sample_results, sample_valid) if valid
+            ]
+            # Chunk headers may differ cosmetically; re-key by position.
+            fieldnames = graded[0][0].fieldnames
+            sample_rows = [
+                [
+                    dict(zip(fieldnames, row.values()))
+                    for result in sample
+                    for row in result.rows
+                ]
+                for sample in graded
+            ]
+            if len(models) > 1:
+                graded_rows = _consensus_rows(
+                    paths,
+                    fieldnames,
+                    sample_rows,
+                    [label for label, valid in zip(labels, sample_valid) if valid],
+                    [label for label, valid in zip(labels, sample_valid) if not valid],
+                    dict(zip(labels, temperatures)),
+                )
+            else:
+                graded_rows = sample_rows[0]
+            rows = _merge_pre_grades(gt_rows, pre_grades, graded_rows, fieldnames)
+            attempts = max(result.attempts for sample in graded for result in sample)
+            details = [f"{len(chunks)} chunks"] if len(chunks) > 1 else []
+            if len(models) > 1:
+                details.append(f"consensus of {len(graded)}/{len(models)} samples")
+            _finish_grading(
+                paths,
+                rows,
+                fieldnames,
+                (f"on attempt {attempts}" if attempts else "from the grading cache")
+                + (f" ({', '.join(details)})" if details else ""),
+                attempts,
+            )
+            return grading_response
+
+        failed = [result for result in results if not result.valid]
+        last_validation_error = failed[0].error
+        last_error_details = failed[0].error_details
+        if len(chunks) > 1:
+            last_validation_error = (
+                f"{len(failed)} of {len(chunks)} rubric chunks failed; "
+                f"first error: {last_validation_error}"
+            )
+        if len(models) > 1:
+            last_validation_error = (
+                f"all {len(models)} grading samples failed; {labels[0]}: "
+                f"{last_validation_error}"
+            )
+
+        # Fallback: persist ground truth with error note so the UI shows the
+        # failure; chunks that did validate keep their grades.
         fallback_fieldnames = gt_fieldnames
+        fallback_llm_rows = [
+            dict(zip(fallback_fieldnames, row.values()))
+            for result in results
+            for row in result.rows
+        ]
+        fallback_rows = _merge_pre_grades(
+            gt_rows, pre_grades, fallback_llm_rows, fallback_fieldnames
+        )
         if fallback_rows:
             notes_col = _pick_column(
                 fallback_fieldnames, ("notes", "justification", "comment")
             )
             if notes_col:
-                fallback_rows[0][
+                fallback_rows[failed[0].first_row][
                     notes_col
                 ] = f"Automatic grading failed after retries: {last_validation_error}"
 
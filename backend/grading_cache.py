@@ -0,0 +1,146 @@
+"""Persistent cache of validated grading results.
+
+Regrading the same diagram (``/api/automatic-grade`` twice, a re-run batch)
+would otherwise pay for an identical LLM grading call every time.  Each
+grading call's validated rows are stored under a hash of everything that
+determines them:
+
+- the grading prompt version (``GRADING_PROMPT_VERSION``, a digest of the
+  template's text), so editing the template invalidates every entry;
+- the grader model and sampling temperature, and the sample number under
+  consensus grading (so K samples stay K independent gradings);
+- the static prompt prefix (system description and reference solution);
+- the rubric rows graded and the ones shown as context (which covers
+  pre-grading and chunking);
+- the student diagram, whitespace-normalized like the render cache key.
+
+Entries are small JSON files under ``SHERPA_GRADING_CACHE_DIR`` (default
+``resources/grading_cache``); ``SHERPA_GRADING_CACHE=0`` or
+``use_cache=False`` on a grading run bypasses the cache.  Lookups are
+counted in ``sherpa_grading_cache_lookups_total`` on ``/metrics``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import Optional
+
+import telemetry
+from resources.prompts.single_prompt.grading_prompt_template import (
+    GRADING_PROMPT_VERSION,
+)
+from resources.render_cache import normalize_mermaid
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "SHERPA_GRADING_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources", "grading_cache"),
+)
+
+
+def grading_cache_enabled(use_cache: Optional[bool] = None) -> bool:
+    """``use_cache`` when given, else ``SHERPA_GRADING_CACHE`` (default on)."""
+    if use_cache is not None:
+        return use_cache
+    return os.environ.get("SHERPA_GRADING_CACHE", "1").lower() not in {"0", "false", "no"}
+
+
+def grading_cache_key(
+    model: str,
+    sample: int,
+    temperature: float,
+    prompt_prefix: str,
+    rubric_csv: str,
+    other_rows_csv: str,
+    student_mermaid_code: str,
+) -> str:
+    digest = hashlib.sha256()
+    for part in (
+        GRADING_PROMPT_VERSION,
+        model,
+        str(sample),
+        repr(float(temperature)),
+        prompt_prefix,
+        rubric_csv,
+        other_rows_csv,
+        normalize_mermaid(student_mermaid_code),
+    ):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class GradingCache:
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """The stored ``{"fieldnames", "rows", "response"}`` for ``key``, or None."""
+        try:
+            with open(self._entry_path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            result = "hit"
+        except FileNotFoundError:
+            entry, result = None, "miss"
+        except (OSError, ValueError) as exc:
+            logger.warning("Grading cache entry %s unusable: %s", key, exc)
+            entry, result = None, "miss"
+        telemetry.inc(
+            "sherpa_grading_cache_lookups_total",
+            "Grading cache lookups, by result.",
+            result=result,
+        )
+        return entry
+
+    def put(
+        self,
+        key: str,
+        fieldnames: list[str],
+        rows: list[dict[str, str]],
+        response: str,
+        model: str,
+    ) -> None:
+        """Store validated rows (best effort; a failed write only loses the entry)."""
+        entry = {
+            "fieldnames": list(fieldnames),
+            "rows": [[row.get(name, "") for name in fieldnames] for row in rows],
+            "response": response,
+            "model": model,
+            "prompt_version": GRADING_PROMPT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as exc:
+            logger.warning("Could not store grading cache entry %s: %s", key, exc)
+
+
+_cache: Optional[GradingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_grading_cache() -> GradingCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GradingCache()
+        return _cache
@@ -0,0 +1,195 @@
+"""Precision, recall and F1 per rubric category, computed from grading results.
+
+The evaluation workbooks (``summary/extract_summaries.py``) derive these
+numbers by hand from a graded rubric; here they come straight from a run's
+``grading_results.csv``.  Per category:
+
+- true positives are the grades of its rubric rows (1, 0.5 or 0 each);
+- expected elements are the number of those rows, so recall is TP / rows;
+- false positives are its "additional elements" count, so precision is
+  TP / (TP + additional elements);
+- F1 is their harmonic mean.
+
+"Overall" pools the counts of every category.  A metric is None where the
+workbooks show no value: recall of a category without rubric rows,
+precision with nothing found, F1 when either is missing.
+
+Counts are kept as a ``(categories, 3)`` array per run, so a batch stacks
+every run into one array, pools the runs of each group with ``np.add.at``
+and derives all of its metrics in one vectorized pass.  Blocks use the
+``{"overall": ..., "by_category": ...}`` shape of ``summary.json``.
+"""
+
+from __future__ import annotations
+
+import csv
+import os
+from collections import OrderedDict
+from typing import Hashable, Iterable, Optional, Sequence
+
+import numpy as np
+
+from agreement import CATEGORY_ORDER, parse_grade
+
+# Columns of a counts array.
+TRUE_POSITIVES, EXPECTED, ADDITIONAL = range(3)
+# Same precision as the summaries scraped from the workbooks.
+DECIMALS = 10
+
+STAGE_BY_STRATEGY = {"single_prompt": "1_stage", "two_stage_prompt": "2_stage"}
+
+
+def _column(fieldnames: Sequence[str], keywords: tuple[str, ...]) -> Optional[str]:
+    for keyword in keywords:
+        for name in fieldnames:
+            if keyword in name.strip().lower():
+                return name
+    return None
+
+
+def _category(value: Optional[str]) -> Optional[str]:
+    normalized = " ".join(str(value or "").split()).lower()
+    for category in CATEGORY_ORDER:
+        if category.lower() == normalized:
+            return category
+    return None
+
+
+def category_counts(fieldnames: Sequence[str], rows: Iterable[dict[str, str]]) -> np.ndarray:
+    """``(len(CATEGORY_ORDER), 3)`` array of TP, expected and additional counts.
+
+    Rows outside the known categories, and ungraded rows, are not counted.
+    """
+    type_col = _column(fieldnames, ("type",))
+    element_col = _column(fieldnames, ("element",))
+    score_col = _column(fieldnames, ("grading", "rater"))
+    counts = np.zeros((len(CATEGORY_ORDER), 3))
+    if not (type_col and element_col and score_col):
+        return counts
+    index = {category: i for i, category in enumerate(CATEGORY_ORDER)}
+    for row in rows:
+        category = _category(row.get(type_col))
+        grade = parse_grade(row.get(score_col))
+        if category is None or grade is None:
+            continue
+        if "additional elements" in (row.get(element_col) or "").lower():
+            counts[index[category], ADDITIONAL] += grade
+        else:
+            counts[index[category], TRUE_POSITIVES] += grade
+            counts[index[category], EXPECTED] += 1
+    return counts
+
+
+def read_counts(csv_path: str) -> Optional[np.ndarray]:
+    """``category_counts`` of a ``grading_results.csv``, or None when it is missing."""
+    try:
+        with open(csv_path, "r", newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            return category_counts(reader.fieldnames or [], reader)
+    except FileNotFoundError:
+        return None
+
+
+def _scores(counts: np.ndarray) -> np.ndarray:
+    """Precision, recall and F1 for counts of shape ``(..., categories, 3)``.
+
+    Returns shape ``(..., categories + 1, 3)``: one row per category, then
+    the pooled overall row.  Undefined metrics are NaN.
+    """
+    counts = np.concatenate([counts, counts.sum(axis=-2, keepdims=True)], axis=-2)
+    tp = counts[..., TRUE_POSITIVES]
+    found = tp + counts[..., ADDITIONAL]
+    expected = counts[..., EXPECTED]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(found > 0, tp / found, np.nan)
+        recall = np.where(expected > 0, tp / expected, np.nan)
+        f1 = np.where(
+            precision + recall > 0,
+            2 * precision * recall / (precision + recall),
+            np.where(precision + recall == 0, 0.0, np.nan),
+        )
+    return np.stack([precision, recall, f1], axis=-1)
+
+
+def _metrics(row: np.ndarray) -> dict[str, Optional[float]]:
+    return {
+        name: None if np.isnan(value) else round(float(value), DECIMALS)
+        for name, value in zip(("precision", "recall", "f1"), row)
+    }
+
+
+def _block(scores: np.ndarray) -> dict:
+    return {
+        "overall": _metrics(scores[-1]),
+        "by_category": OrderedDict(
+            (category, _metrics(scores[i])) for i, category in enumerate(CATEGORY_ORDER)
+        ),
+    }
+
+
+def metrics_block(counts: np.ndarray) -> dict:
+    """The ``summary.json`` metrics block for one run's (or pooled) counts."""
+    return _block(_scores(counts))
+
+
+def aggregate(
+    keys: Sequence[Hashable], counts: Sequence[np.ndarray]
+) -> "OrderedDict[Hashable, dict]":
+    """Metrics block per distinct key, pooling the counts of runs sharing it.
+
+    ``keys[i]`` groups run ``i``; all groups are scored in one pass.
+    """
+    groups = list(OrderedDict.fromkeys(keys))
+    if not groups:
+        return OrderedDict()
+    group_index = {key: i for i, key in enumerate(groups)}
+    pooled = np.zeros((len(groups), len(CATEGORY_ORDER), 3))
+    np.add.at(pooled, np.array([group_index[key] for key in keys]), np.stack(counts))
+    scores = _scores(pooled)
+    return OrderedDict((key, _block(scores[i])) for i, key in enumerate(groups))
+
+
+def null_block() -> dict:
+    return _block(np.full((len(CATEGORY_ORDER) + 1, 3), np.nan))
+
+
+def null_kappa_block() -> dict:
+    return {
+        "overall": None,
+        "by_category": OrderedDict((category, None) for category in CATEGORY_ORDER),
+    }
+
+
+def batch_summary(cells: Iterable[dict]) -> "OrderedDict[str, OrderedDict]":
+    """``summary.json`` for a batch's graded cells.
+
+    ``cells`` are manifest cell records (``example_key``, ``model``,
+    ``strategy``, ``folder``).  The result is keyed example -> model ->
+    stage, where the workbook summaries have name -> week -> stage: within
+    a batch the model is what varies.  A batch has no human grades, so
+    "Human" and the human-vs-LLM "weighted_cohens_kappa" are left null.
+    """
+    keys, counts = [], []
+    for cell in cells:
+        folder = cell.get("folder")
+        stage = STAGE_BY_STRATEGY.get(cell.get("strategy"))
+        if not (folder and stage and cell.get("grading", True)):
+            continue
+        run_counts = read_counts(os.path.join(folder, "grading_results.csv"))
+        if run_counts is None:
+            continue
+        keys.append((cell["example_key"], cell["model"], stage))
+        counts.append(run_counts)
+
+    summary: "OrderedDict[str, OrderedDict]" = OrderedDict()
+    for (example_key, model, stage), block in sorted(aggregate(keys, counts).items()):
+        summary.setdefault(example_key, OrderedDict()).setdefault(model, OrderedDict())[
+            stage
+        ] = OrderedDict(
+            [
+                ("Human", null_block()),
+                ("LLM", block),
+                ("weighted_cohens_kappa", null_kappa_block()),
+            ]
+        )
+    return summary
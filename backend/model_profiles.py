@@ -0,0 +1,19 @@
+"""Model profiles offered in the UI and their OpenRouter model strings.
+
+Shared by the server (``/api/models``, request model resolution) and the
+batch runner, which can run without the server.
+"""
+
+# Keys match app.py chat profile names (provider:model-id format)
+# Values are OpenRouter model strings
+PROFILE_TO_OPENROUTER: dict[str, str] = {
+    "anthropic/claude-4.5-sonnet": "anthropic/claude-4.5-sonnet",
+    "google/gemini-3.1-pro-preview": "google/gemini-3.1-pro-preview",
+    "openai/gpt-5.5": "openai/gpt-5.5",
+    "deepseek/deepseek-v4-pro": "deepseek/deepseek-v4-pro",
+}
+
+
+def resolve_model(name: str) -> str:
+    """OpenRouter model string for a profile key; other names pass through."""
+    return PROFILE_TO_OPENROUTER.get(name, name)
@@ -0,0 +1,192 @@
+"""Per-run progress channels.
+
+Pipelines report progress with plain ``print`` calls and ``logging``.  The
+server used to capture those with ``contextlib.redirect_stdout`` and a
+temporary root-logger handler, both of which are process-global: two
+concurrent generations would stream each other's lines.
+
+Instead, ``install()`` replaces ``sys.stdout`` / ``sys.stderr`` once with
+proxies that route writes to the progress callback bound to the *current
+context* (see ``progress_scope``), and adds a single root handler that does
+the same for log records.  Code running outside a scope writes to the real
+streams exactly as before.
+
+    with progress_scope(lambda line: queue.put(("progress", line))):
+        run_single_prompt(...)
+
+A scope may also take an ``on_token`` callback, which receives streamed LLM
+output as it arrives (see ``emit_token``).
+
+Context variables are not inherited by ``threading.Thread``; code that fans
+work out to threads should run it under ``contextvars.copy_context()``.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import io
+import logging
+import sys
+import threading
+from typing import Callable, Iterator, Optional
+
+ProgressCallback = Callable[[str], None]
+TokenCallback = Callable[[str, bool], None]
+
+LOG_FORMAT = "%(levelname)s %(name)s: %(message)s"
+
+
+class _Channel:
+    """Line-buffers writes for one run and hands complete lines to its callback."""
+
+    def __init__(
+        self, callback: ProgressCallback, on_token: Optional[TokenCallback] = None
+    ):
+        self._callback = callback
+        self.on_token = on_token
+        self._buf = ""
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> None:
+        with self._lock:
+            self._buf += text
+            if "\n" not in self._buf:
+                return
+            *lines, self._buf = self._buf.split("\n")
+        for line in lines:
+            self.emit(line)
+
+    def flush(self) -> None:
+        with self._lock:
+            line, self._buf = self._buf, ""
+        self.emit(line)
+
+    def emit(self, line: str) -> None:
+        line = line.strip()
+        if line:
+            self._callback(line)
+
+
+_current: contextvars.ContextVar[Optional[_Channel]] = contextvars.ContextVar(
+    "sherpa_progress_channel", default=None
+)
+
+
+class _ContextStream(io.TextIOBase):
+    """Stand-in for ``sys.stdout``/``sys.stderr`` that honours ``progress_scope``."""
+
+    def __init__(self, fallback):
+        self._fallback = fallback
+
+    def write(self, text: str) -> int:
+        channel = _current.get()
+        if channel is None:
+            return self._fallback.write(text)
+        channel.write(text)
+        return len(text)
+
+    def flush(self) -> None:
+        if _current.get() is None:
+            self._fallback.flush()
+
+    def isatty(self) -> bool:
+        return self._fallback.isatty()
+
+    def fileno(self) -> int:
+        return self._fallback.fileno()
+
+    @property
+    def encoding(self):
+        return self._fallback.encoding
+
+
+class _ContextLogHandler(logging.Handler):
+    """Send log records to the current run's channel.
+
+    Outside a scope, only warnings and above are written to stderr, which is
+    what Python does by default when no handler is configured.
+    """
+
+    def __init__(self, fallback):
+        super().__init__(level=logging.INFO)
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+        self._fallback = fallback
+
+    def emit(self, record: logging.LogRecord) -> None:
+        channel = _current.get()
+        if channel is None and record.levelno < logging.WARNING:
+            return
+        try:
+            message = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        if channel is None:
+            self._fallback.write(message + "\n")
+        else:
+            channel.emit(message)
+
+
+_install_lock = threading.Lock()
+_installed = False
+
+
+def install() -> None:
+    """Route stdout, stderr and logging through per-context channels. Idempotent."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        stderr = sys.stderr
+        sys.stdout = _ContextStream(sys.stdout)
+        sys.stderr = _ContextStream(stderr)
+        root = logging.getLogger()
+        root.addHandler(_ContextLogHandler(stderr))
+        if root.getEffectiveLevel() > logging.INFO:
+            root.setLevel(logging.INFO)
+        _installed = True
+
+
+def emit_token(text: str, reset: bool = False) -> None:
+    """Forward streamed LLM output to the current scope's ``on_token`` callback.
+
+    ``reset`` marks the start of a new completion.  No-op outside a scope.
+    """
+    channel = _current.get()
+    if channel is not None and channel.on_token is not None:
+        channel.on_token(text, reset)
+
+
+@contextlib.contextmanager
+def progress_scope(
+    callback: ProgressCallback, on_token: Optional[TokenCallback] = None
+) -> Iterator[None]:
+    """Deliver every line printed or logged in this context to ``callback``."""
+    install()
+    channel = _Channel(callback, on_token)
+    token = _current.set(channel)
+    try:
+        yield
+    finally:
+        channel.flush()
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def child_scope(prefix: str = "", forward_tokens: bool = True) -> Iterator[None]:
+    """Nested scope that forwards to the enclosing one.
+
+    Lines get ``prefix`` (e.g. ``"[attempt 2] "`` for concurrent attempts), and
+    ``forward_tokens=False`` mutes this context's token stream so only one of
+    several concurrent completions reaches the UI.  No-op outside a scope.
+    """
+    parent = _current.get()
+    if parent is None:
+        yield
+        return
+    with progress_scope(
+        lambda line: parent.emit(prefix + line),
+        parent.on_token if forward_tokens else None,
+    ):
+        yield
@@ -0,0 +1,180 @@
+"""
+Compare the ``sherpa`` and ``direct`` DOT backends (see ``dot_emitter``).
+
+Both graphs are reduced to what GraphViz draws: the cluster tree with its
+attributes, each node's final attributes and enclosing cluster, and the
+multiset of edges with their attributes.  Statement order and quoting are
+ignored.  Diagrams come from the n-shot/validation solutions plus synthetic
+diagrams from ``mermaid_parser_benchmark``.
+
+    python backend/resources/dot_backend_parity.py [--synthetic 20] [--render out_dir]
+
+``--render`` also writes ``<name>.sherpa.png`` / ``<name>.direct.png`` side by
+side for a visual check (needs the GraphViz ``dot`` binary).
+"""
+
+import argparse
+import os
+import re
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mermaid_parser_benchmark import synthetic_diagram
+from n_shot_examples_single_prompt_mermaid import n_shot_examples, validation_examples
+from resources.dot_emitter import build_state_graph
+from resources.mermaid_to_sherpa_parser import parse_mermaid_with_library
+from resources.util import _build_sherpa_graph, _collect_parallel_composite_paths
+
+_TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|(->|[{}\[\]=;,])|([^\s"{}\[\]=;,]+)')
+_KEYWORDS = {"graph", "node", "edge", "subgraph", "digraph", "strict"}
+
+
+def _tokens(source: str):
+    for quoted, punct, word in _TOKEN_RE.findall(source):
+        if punct:
+            yield ("punct", punct)
+        elif word:
+            yield ("id", word)
+        else:
+            yield ("id", quoted.replace('\\"', '"'))
+
+
+def normalize(source: str) -> dict:
+    """Cluster tree, node attributes and edge multiset of a DOT source."""
+    tokens = list(_tokens(source))
+    clusters = {}  # name -> (parent cluster, attrs)
+    nodes = {}  # name -> [enclosing cluster, attrs]
+    edges = Counter()
+    stack = [None]
+    i = 0
+
+    def attr_list(i):
+        attrs = {}
+        while i < len(tokens) and tokens[i] == ("punct", "["):
+            i += 1
+            while tokens[i] != ("punct", "]"):
+                key = tokens[i][1]
+                attrs[key] = tokens[i + 2][1]
+                i += 3
+                if tokens[i] in (("punct", ","), ("punct", ";")):
+                    i += 1
+            i += 1
+        return attrs, i
+
+    def touch(name):
+        nodes.setdefault(name, [stack[-1], {}])
+
+    while i < len(tokens):
+        kind, value = tokens[i]
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+        if value in ("digraph", "strict") and kind == "id":
+            while tokens[i] != ("punct", "{"):
+                i += 1
+            i += 1
+        elif value == "subgraph" and kind == "id":
+            stack.append(tokens[i + 1][1])
+            clusters[stack[-1]] = (stack[-2], {})
+            i += 3
+        elif value == "}":
+            stack.pop()
+            i += 1
+        elif kind == "id" and value in _KEYWORDS and nxt == ("punct", "["):
+            attrs, i = attr_list(i + 1)
+            if value == "graph":
+                target = clusters[stack[-1]][1] if stack[-1] else clusters.setdefault(None, (None, {}))[1]
+                target.update(attrs)
+        elif kind == "id" and nxt == ("punct", "->"):
+            tail, head = value, tokens[i + 2][1]
+            attrs, i = attr_list(i + 3)
+            touch(tail)
+            touch(head)
+            edges[(tail, head, tuple(sorted(attrs.items())))] += 1
+        elif kind == "id":
+            attrs, i = attr_list(i + 1)
+            touch(value)
+            nodes[value][1].update(attrs)
+        else:
+            i += 1
+    return {
+        "clusters": {k: (p, sorted(a.items())) for k, (p, a) in clusters.items()},
+        "nodes": {k: (c, sorted(a.items())) for k, (c, a) in nodes.items()},
+        "edges": edges,
+    }
+
+
+def diff(left: dict, right: dict) -> list:
+    problems = []
+    for part in ("clusters", "nodes"):
+        for key in sorted(set(left[part]) | set(right[part]), key=str):
+            if left[part].get(key) != right[part].get(key):
+                problems.append(f"{part[:-1]} {key}: {left[part].get(key)} != {right[part].get(key)}")
+    for edge in sorted(set(left["edges"]) | set(right["edges"]), key=str):
+        if left["edges"][edge] != right["edges"][edge]:
+            problems.append(f"edge {edge}: {left['edges'][edge]} != {right['edges'][edge]}")
+    return problems
+
+
+def graphs(mermaid_code: str):
+    (
+        states_list,
+        transitions_list,
+        _hierarchical_dict,
+        initial_state,
+        _parallel_regions,
+        _annotations,
+        root_initial_state,
+        nested_initial_states,
+        _declarations,
+    ) = parse_mermaid_with_library(mermaid_code)
+    if not initial_state and states_list:
+        first = states_list[0]
+        initial_state = first if isinstance(first, str) else first["name"]
+    args = (
+        states_list,
+        transitions_list,
+        initial_state,
+        root_initial_state,
+        nested_initial_states,
+        _collect_parallel_composite_paths(states_list),
+    )
+    return _build_sherpa_graph(*args), build_state_graph(*args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--synthetic", type=int, default=20, help="synthetic diagrams to add")
+    parser.add_argument("--render", metavar="DIR", help="also render both backends to PNG")
+    args = parser.parse_args()
+
+    diagrams = {
+        name: example["mermaid_code_solution"]
+        for name, example in {**n_shot_examples, **validation_examples}.items()
+    }
+    for seed in range(args.synthetic):
+        diagrams[f"synthetic_{seed}"] = synthetic_diagram(50 + 25 * seed, seed)
+
+    mismatched = 0
+    for name, code in diagrams.items():
+        try:
+            sherpa, direct = graphs(code)
+        except Exception as e:
+            print(f"{name}: skipped, sherpa backend failed: {e}")
+            continue
+        problems = diff(normalize(sherpa.source), normalize(direct.source))
+        mismatched += bool(problems)
+        print(f"{name}: {'OK' if not problems else f'{len(problems)} differences'}")
+        for problem in problems[:10]:
+            print(f"    {problem}")
+        if args.render:
+            os.makedirs(args.render, exist_ok=True)
+            for backend, graph in (("sherpa", sherpa), ("direct", direct)):
+                graph.render(os.path.join(args.render, f"{name}.{backend}"), format="png", cleanup=True)
+    print(f"{mismatched} of {len(diagrams)} diagrams differ")
+    sys.exit(1 if mismatched else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Build the GraphViz graph for a parsed Mermaid state diagram directly.
+
+The ``sherpa`` DOT backend instantiates a ``SherpaStateMachine`` on a
+``HierarchicalGraphMachine`` only to ask pytransitions for a graph, then
+patches the DOT text afterwards (``dot_transform``).  ``build_state_graph``
+draws the same diagram straight from ``parse_mermaid_with_library``'s
+output: a cluster per composite state, ltail/lhead on edges that touch one,
+intermediate dots for the edges GraphViz cannot clip (composite self-loops,
+composite -> own child, state -> composite ancestor) and the [*] markers.
+
+    SHERPA_DOT_BACKEND=sherpa   (default) pytransitions graph + DOT patching
+    SHERPA_DOT_BACKEND=direct   build_state_graph
+
+``dot_backend_parity.py`` diffs the two backends over the n-shot corpus.
+"""
+
+import os
+import re
+from collections import defaultdict, deque
+from typing import Optional
+
+import graphviz
+
+try:
+    from .dot_transform import EdgeIndex
+except ImportError:
+    from dot_transform import EdgeIndex
+
+DOT_BACKENDS = ("sherpa", "direct")
+
+# pytransitions' HierarchicalGraphMachine defaults, so both backends draw
+# the same picture.
+SEPARATOR = "_"
+TITLE = "State Machine"
+MACHINE_ATTRIBUTES = {"directed": "true", "strict": "false", "rankdir": "LR"}
+NODE_STYLES = {
+    "default": {
+        "style": "rounded,filled",
+        "shape": "rectangle",
+        "fillcolor": "white",
+        "color": "black",
+        "peripheries": "1",
+    },
+    "parallel": {
+        "shape": "rectangle",
+        "color": "black",
+        "fillcolor": "white",
+        "style": "dashed, rounded, filled",
+        "peripheries": "1",
+    },
+}
+GRAPH_STYLES = {
+    "default": {"color": "black", "fillcolor": "white", "style": "solid"},
+    "parallel": {"color": "black", "fillcolor": "white", "style": "dotted"},
+}
+EDGE_STYLE = {"color": "black"}
+
+INVISIBLE = {"style": "invis", "width": "0", "height": "0", "label": ""}
+INVISIBLE_DOT = {"shape": "point", "width": "0", "height": "0", "style": "invis", "label": ""}
+INITIAL_DOT = {
+    "fillcolor": "black",
+    "color": "black",
+    "height": "0.15",
+    "label": "",
+    "shape": "point",
+    "width": "0.15",
+}
+
+
+def dot_backend() -> str:
+    """How the in-process renderer builds the GraphViz graph.
+
+    ``SHERPA_DOT_BACKEND=sherpa`` (default) goes through ``SherpaStateMachine``
+    and patches pytransitions' DOT output; ``direct`` uses
+    ``build_state_graph``.
+    """
+    backend = os.environ.get("SHERPA_DOT_BACKEND", "sherpa").lower()
+    if backend not in DOT_BACKENDS:
+        raise ValueError(f"SHERPA_DOT_BACKEND must be one of {DOT_BACKENDS}, got {backend!r}")
+    return backend
+
+
+class _State:
+    __slots__ = ("name", "label", "parent", "initial", "children")
+
+    def __init__(self, name: str, label: str, parent: Optional["_State"]):
+        self.name = name  # full path, e.g. On_Busy
+        self.label = label  # bare name, e.g. Busy
+        self.parent = parent
+        self.initial = None  # child name, list of region names, or None
+        self.children = {}
+
+    @property
+    def is_composite(self) -> bool:
+        return bool(self.children)
+
+    @property
+    def is_parallel(self) -> bool:
+        return isinstance(self.initial, list)
+
+
+def _add_state(scope: dict, parent: Optional[_State], state, index: dict) -> None:
+    """Add a parser state to ``scope`` the way HierarchicalMachine nests it.
+
+    A string ``A_B`` is ``B`` inside ``A`` (``A`` is created if missing);
+    repeated names keep their first declaration.
+    """
+    prefix = parent.name + SEPARATOR if parent else ""
+    if isinstance(state, str):
+        head, sep, rest = state.partition(SEPARATOR)
+        node = scope.get(head)
+        if node is None:
+            node = scope[head] = index[prefix + head] = _State(prefix + head, head, parent)
+        if sep:
+            _add_state(node.children, node, rest, index)
+        return
+
+    name = state["name"]
+    node = scope.get(name)
+    if node is None:
+        node = scope[name] = index[prefix + name] = _State(prefix + name, name, parent)
+        node.initial = state.get("initial")
+    for child in state.get("children", state.get("states", [])):
+        _add_state(node.children, node, child, index)
+
+
+def _active_states(index: dict, initial: Optional[str]) -> set:
+    # pytransitions styles the model's current states "active"; the sherpa
+    # renderer maps that style back to the plain default, which only shows
+    # on states inside parallel regions.  Mirror it so both backends match.
+    active = set()
+    pending = [initial] if initial else []
+    while pending:
+        state = index.get(pending.pop())
+        if state is None:
+            continue
+        if state.is_parallel:
+            pending.extend(f"{state.name}{SEPARATOR}{region}" for region in state.initial)
+        elif state.is_composite and state.initial:
+            pending.append(f"{state.name}{SEPARATOR}{state.initial}")
+        else:
+            active.add(state.name)
+    return active
+
+
+def _ordered_transitions(transitions: list, roots: dict) -> list:
+    """Transitions in the order pytransitions' markup lists them.
+
+    Explicit transitions are grouped per trigger (first use), then per source
+    state; composite initial edges follow in breadth-first state order.
+    """
+    trigger_rank = {}
+    source_rank = {}
+    for transition in transitions:
+        trigger_rank.setdefault(transition["trigger"], len(trigger_rank))
+        source_rank.setdefault((transition["trigger"], transition["source"]), len(source_rank))
+    ordered = sorted(
+        transitions,
+        key=lambda t: (trigger_rank[t["trigger"]], source_rank[(t["trigger"], t["source"])]),
+    )
+
+    queue = deque([roots])
+    while queue:
+        for state in queue.popleft().values():
+            if state.initial and not state.is_parallel:
+                ordered.append(
+                    {
+                        "trigger": "",
+                        "source": state.name,
+                        "dest": f"{state.name}{SEPARATOR}{state.initial}",
+                    }
+                )
+            if state.is_composite:
+                queue.append(state.children)
+    return ordered
+
+
+class _Edge:
+    __slots__ = ("source", "dest", "label_pos", "labels", "attrs")
+
+    def __init__(self, source: str, dest: str, composites: set):
+        self.source = source
+        self.dest = dest
+        self.labels = []
+        self.attrs = {}
+        # Same clipping rules as pytransitions' NestedGraph._create_edge_attr.
+        self.label_pos = "label"
+        if source in composites:
+            self.attrs["ltail"] = "cluster_" + source
+            self.label_pos = "headlabel"
+        if dest in composites and not source.startswith(dest):
+            self.attrs["lhead"] = "cluster_" + dest
+            self.label_pos = "taillabel" if self.label_pos.startswith("l") else "label"
+        if "ltail" in self.attrs and dest.startswith(source):
+            del self.attrs["ltail"]
+
+    @property
+    def label(self) -> str:
+        return " | ".join(self.labels)
+
+    def clean_label(self) -> dict:
+        """Label attribute without the separator an empty merged label leaves."""
+        label = re.sub(r"\s*\|\s*$", "", self.label, count=1)
+        return {self.label_pos: re.sub(r"^\s*\|\s*", "", label, count=1)}
+
+
+def _merged_edges(transitions: list, composites: set) -> list:
+    """One edge per (source, dest), labels joined with `` | ``."""
+    by_source = defaultdict(dict)
+    for transition in transitions:
+        source = transition["source"]
+        dest = transition.get("dest")
+        label = transition.get("label", transition["trigger"])
+        if dest is None:
+            dest = source
+            label += " [internal]"
+        edge = by_source[source].get(dest)
+        if edge is None:
+            edge = by_source[source][dest] = _Edge(source, dest, composites)
+        edge.labels.append(label)
+    return [edge for dests in by_source.values() for edge in dests.values()]
+
+
+def build_state_graph(
+    states_list: list,
+    transitions_list: list,
+    initial_state: Optional[str],
+    root_initial_state: Optional[str],
+    nested_initial_states: dict,
+    parallel_composite_paths: set,
+) -> graphviz.Digraph:
+    """GraphViz graph for the diagram ``parse_mermaid_with_library`` returned.
+
+    Args:
+        states_list: Nested state definitions (strings and composite dicts)
+        transitions_list: Transition dicts with source, dest, trigger and label
+        initial_state: State the machine starts in
+        root_initial_state: Target of the top-level ``[*] -->``, if any
+        nested_initial_states: Composite path -> bare name of its ``[*]`` child
+        parallel_composite_paths: Paths of composites split into regions
+
+    Returns:
+        graphviz.Digraph ready to render
+    """
+    roots = {}
+    index = {}
+    for state in states_list:
+        _add_state(roots, None, state, index)
+    composites = {name for name, state in index.items() if state.is_composite}
+    active = _active_states(index, initial_state)
+
+    # ── Edges, routing the ones GraphViz cannot clip through a dot ────────────
+    edges = []  # (tail, head, attrs) in emission order
+    deferred_dots = defaultdict(list)  # composite (or None) -> dots placed in it
+    extra_edges = []
+    for edge in _merged_edges(_ordered_transitions(transitions_list, roots), composites):
+        source, dest = edge.source, edge.dest
+        # Initial edges ([*] -> child) keep pytransitions' unlabeled form.
+        if not edge.label and edge.label_pos != "taillabel":
+            edges.append((source, dest, {**edge.attrs, edge.label_pos: ""}))
+            continue
+
+        if source in composites:
+            exit_attrs = {"ltail": "cluster_" + source, **edge.clean_label(), "dir": "none"}
+            if source == dest:
+                # Composite self-loop: ltail and lhead on the same cluster
+                # cannot be drawn, so loop through a dot beside the cluster.
+                dot = f"_selfloop_{source}_{len(extra_edges) // 2}"
+                dot_parent = index[source].parent
+                enter_attrs = {"lhead": "cluster_" + source, "constraint": "false"}
+            elif dest.startswith(source + SEPARATOR):
+                # Composite -> own child: ltail is ignored when the head is
+                # inside the cluster, so leave through a dot and re-enter.
+                dot = f"_entry_{source}_{len(extra_edges) // 2}"
+                dot_parent = index[source].parent
+                enter_attrs = (
+                    {"lhead": "cluster_" + dest, "constraint": "false"}
+                    if dest in composites
+                    else {}
+                )
+            elif dest in composites and source.startswith(dest + SEPARATOR):
+                # Composite -> composite ancestor.
+                dot = f"_escape_{dest}_{len(extra_edges) // 2}"
+                dot_parent = index[dest].parent
+                enter_attrs = {"lhead": "cluster_" + dest, "constraint": "false"}
+            else:
+                edges.append((source, dest, {**edge.attrs, edge.label_pos: edge.label}))
+                continue
+        elif dest in composites and source.startswith(dest + SEPARATOR):
+            # State -> composite ancestor: the tail is inside the lhead
+            # cluster, so lhead is ignored; loop out through a dot.
+            dot = f"_escape_{dest}_{len(extra_edges) // 2}"
+            dot_parent = index[dest].parent
+            exit_attrs = {**edge.clean_label(), "dir": "none"}
+            enter_attrs = {"lhead": "cluster_" + dest, "constraint": "false"}
+        else:
+            edges.append((source, dest, {**edge.attrs, edge.label_pos: edge.label}))
+            continue
+
+        deferred_dots[dot_parent.name if dot_parent else None].append(dot)
+        extra_edges.append((source, dot, exit_attrs))
+        extra_edges.append((dot, dest, enter_attrs))
+    edges.extend((dot, INVISIBLE_DOT) for dot in deferred_dots.pop(None, ()))
+    edges.extend(extra_edges)
+
+    # ── [*] markers ───────────────────────────────────────────────────────────
+    marker_edges = []
+    if root_initial_state:
+        lhead = {"lhead": "cluster_" + root_initial_state} if root_initial_state in composites else {}
+        marker_edges.append(("_initial", root_initial_state, lhead))
+    # pytransitions merges [*] -> Child with regular transitions into the same
+    # child; when that merged edge was routed through a dot above, the
+    # composite's initial point lost its edge, so add it back.
+    edge_index = EdgeIndex()
+    for item in edges + marker_edges:
+        if len(item) == 3:
+            edge_index.add_edge(item[0], item[1])
+    parallel_initials = set()
+    for parent, child in nested_initial_states.items():
+        child_path = f"{parent}{SEPARATOR}{child}"
+        attrs = {"headlabel": ""}
+        if child_path in composites:
+            attrs["lhead"] = "cluster_" + child_path
+        if parent in parallel_composite_paths:
+            if parent in composites:
+                parallel_initials.add(parent)
+            tail = f"_initial_{parent}"
+        elif edge_index.has_edge(parent, child_path):
+            continue
+        else:
+            tail = parent
+        marker_edges.append((tail, child_path, attrs))
+        edge_index.add_edge(tail, child_path)
+
+    # Point nodes nothing connects to are hidden, as are the anchors of
+    # parallel composites and of composites without a [*] child.
+    connected = {
+        name for item in edges + marker_edges if len(item) == 3 for name in item[:2]
+    }
+
+    def point_attrs(name, attrs):
+        if name not in connected or name in parallel_composite_paths:
+            attrs = {**attrs, **INVISIBLE}
+        return attrs
+
+    # ── Emit ──────────────────────────────────────────────────────────────────
+    graph = graphviz.Digraph(
+        name=TITLE,
+        node_attr=NODE_STYLES["default"],
+        edge_attr=EDGE_STYLE,
+        graph_attr=GRAPH_STYLES["default"],
+    )
+    graph.graph_attr.update(**MACHINE_ATTRIBUTES)
+    graph.graph_attr.update(label=TITLE, compound="true", splines="ortho")
+
+    if root_initial_state:
+        graph.node("_initial", **point_attrs("_initial", INITIAL_DOT))
+        tail, head, attrs = marker_edges[0]
+        graph.edge(tail, head, **attrs)
+
+    def add_states(container, states, style):
+        for state in states.values():
+            if not state.is_composite:
+                attrs = NODE_STYLES["default" if state.name in active else style]
+                if state.name in parallel_composite_paths:
+                    attrs = {**attrs, **INVISIBLE}
+                container.node(state.name, label=state.label + r"\l", **attrs)
+                continue
+            cluster_attrs = {"label": state.label + r"\l", "rank": "source"}
+            cluster_attrs.update(GRAPH_STYLES["default" if state.name in active else style])
+            with container.subgraph(name="cluster_" + state.name, graph_attr=cluster_attrs) as sub:
+                if state.name in parallel_initials:
+                    sub.node(f"_initial_{state.name}", **point_attrs(f"_initial_{state.name}", INITIAL_DOT))
+                with sub.subgraph(
+                    name=f"cluster_{state.name}_root",
+                    graph_attr={"label": "", "color": "None", "rank": "min"},
+                ) as root:
+                    if state.name in nested_initial_states:
+                        anchor = {
+                            "fillcolor": "black",
+                            "shape": "point",
+                            "width": "0.0" if state.is_parallel else "0.1",
+                        }
+                    else:
+                        anchor = INVISIBLE
+                    root.node(state.name, **point_attrs(state.name, anchor))
+                add_states(sub, state.children, "parallel" if state.is_parallel else "default")
+                for dot in deferred_dots.get(state.name, ()):
+                    sub.node(dot, **INVISIBLE_DOT)
+
+    add_states(graph, roots, "default")
+    for item in edges + marker_edges[1 if root_initial_state else 0 :]:
+        if len(item) == 2:
+            graph.node(item[0], **item[1])
+        else:
+            tail, head, attrs = item
+            graph.edge(tail, head, **attrs)
+    return graph
@@ -0,0 +1,489 @@
+"""
+Post-processing of the GraphViz body pytransitions generates for a diagram.
+
+``DotBody`` parses ``graph.body`` once (subgraph names, closing braces and
+``->`` endpoints are extracted per line and cached) and keeps indexes of
+clusters and edges, so each rewrite step is a lookup instead of a rescan of
+the whole body:
+
+    body = DotBody(graph.body)
+    body.fix_hierarchical_transitions()
+    body.add_initial_state_markers(root_initial, nested_initials, parallel_paths)
+    graph.body = body.render()
+
+Lines inserted in the middle of the body are recorded against an anchor
+line and spliced in when the body is rendered, so the output is the same
+text the previous list-insert implementation produced, in linear time.
+"""
+
+import bisect
+import re
+from collections import defaultdict
+from typing import Iterable, Optional
+
+_SUBGRAPH_RE = re.compile(r"subgraph\s+(\S+)")
+_SUBGRAPH_ANYWHERE_RE = re.compile(r"(?=subgraph\s+(\S+))")
+_CLUSTER_RE = re.compile(r"subgraph\s+(cluster_\w+)")
+_ROOT_CLUSTER_RE = re.compile(r"subgraph\s+cluster_(\S+)_root\b")
+_WORD_RE = re.compile(r"\w")
+
+# Regex handles both quoted ("_initial") and unquoted (Active) node names.
+_FIX_EDGE_RE = re.compile(
+    r'(\s*)("(?:[^"]+)"|[A-Za-z_]\w*)\s*->\s*("(?:[^"]+)"|[A-Za-z_][^\s\[]*)(.*)',
+    re.DOTALL,
+)
+_POINT_NODE_RE = re.compile(r'^\s*"?([A-Za-z_][A-Za-z0-9_]*)"?\s*\[.*\bshape=point\b.*\]')
+_EDGE_RE = re.compile(r'^\s*("?[A-Za-z_][A-Za-z0-9_]*"?)\s*->\s*("?[A-Za-z_][^\s\[]*"?)')
+_HIDDEN_NODE_RE = re.compile(r"(\s*)(\S+)\s*\[")
+
+_INVISIBLE_DOT = '[shape=point width=0 height=0 style=invis label=""]'
+_INITIAL_DOT = '[fillcolor=black color=black height=0.15 label="" shape=point width=0.15]'
+_HEADER_MARKERS = ("digraph", "graph [", "node [", "edge [")
+
+
+def _run_before(text: str) -> str:
+    """Node token ending right before an arrow: ``"?name"?\\s*->``."""
+    text = text.rstrip()
+    if text.endswith('"'):
+        text = text[:-1]
+    start = len(text)
+    while start and text[start - 1] != '"' and not text[start - 1].isspace():
+        start -= 1
+    return text[start:]
+
+
+def _run_after(text: str) -> str:
+    """Node token starting right after an arrow: ``->\\s*"?name``."""
+    text = text.lstrip()
+    if text.startswith('"'):
+        text = text[1:]
+    end = 0
+    while end < len(text) and text[end] != '"' and not text[end].isspace():
+        end += 1
+    return text[:end]
+
+
+class DotLine:
+    """One ``graph.body`` item with the parts the rewrites look at."""
+
+    __slots__ = ("text", "subgraph", "cluster", "closes", "_arrows")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.subgraph = None  # first ``subgraph <name>`` token
+        self.cluster = None  # first ``subgraph cluster_<word>`` name
+        if "subgraph" in text:
+            match = _SUBGRAPH_RE.search(text)
+            self.subgraph = match.group(1) if match else None
+            match = _CLUSTER_RE.search(text)
+            self.cluster = match.group(1) if match else None
+        self.closes = text.strip() == "}"
+        self._arrows = None
+
+    @property
+    def arrows(self) -> list:
+        """``(tail, head)`` node tokens around every ``->`` in the line."""
+        if self._arrows is None:
+            parts = self.text.split("->")
+            self._arrows = [
+                (_run_before(left), _run_after(right))
+                for left, right in zip(parts, parts[1:])
+            ]
+        return self._arrows
+
+    def subgraph_keys(self) -> Iterable[str]:
+        """Every name ``n`` for which ``subgraph\\s+<n>\\b`` matches this line."""
+        if self.subgraph is None:
+            return
+        for match in _SUBGRAPH_ANYWHERE_RE.finditer(self.text):
+            token = match.group(1)
+            after = match.end(1)
+            following = self.text[after] if after < len(self.text) else ""
+            for k in range(1, len(token) + 1):
+                nxt = token[k] if k < len(token) else following
+                if bool(_WORD_RE.match(token[k - 1])) != bool(nxt and _WORD_RE.match(nxt)):
+                    yield token[:k]
+
+
+class EdgeIndex:
+    """Answers "is there an edge ``...P -> C...``" without rescanning lines."""
+
+    def __init__(self):
+        self._tails_by_head = defaultdict(list)
+        self._heads = []  # sorted distinct head tokens, for prefix ranges
+
+    def add(self, line: DotLine) -> None:
+        for tail, head in line.arrows:
+            self.add_edge(tail, head)
+
+    def add_edge(self, tail: str, head: str) -> None:
+        tails = self._tails_by_head[head]
+        if not tails:
+            bisect.insort(self._heads, head)
+        tails.append(tail)
+
+    def has_edge(self, tail_suffix: str, head_prefix: str) -> bool:
+        i = bisect.bisect_left(self._heads, head_prefix)
+        while i < len(self._heads) and self._heads[i].startswith(head_prefix):
+            if any(t.endswith(tail_suffix) for t in self._tails_by_head[self._heads[i]]):
+                return True
+            i += 1
+        return False
+
+
+class DotBody:
+    """A parsed ``graph.body`` plus the edits made to it."""
+
+    def __init__(self, body: Iterable[str]):
+        self.lines = [DotLine(text) for text in body]
+
+    def render(self) -> list:
+        return [line.text for line in self.lines]
+
+    # ── Composite-state edge fixes ──────────────────────────────────────────
+
+    def fix_hierarchical_transitions(self) -> None:
+        """
+        Fix GraphViz edges for cases pytransitions doesn't handle:
+
+        1. Composite state self-loop (e.g. Active -> Active):
+           GraphViz cannot render ltail=X lhead=X on the same cluster.
+           Solution: Replace with an intermediate dot node placed in the parent
+           cluster so the arrows visually loop around the cluster boundary.
+
+        2. Composite state -> own child (e.g. Cleaning -> Cleaning_HistoryPoint):
+           ltail alone is ignored by GraphViz when the destination is inside the
+           same cluster.  Solution: route through an intermediate dot node placed
+           in the parent cluster — one arrow exits the cluster to the dot, a
+           second arrow re-enters the cluster to the specific child node.
+
+        3. State -> composite ancestor (e.g. LoggedIn -> On): the source is
+           inside the lhead cluster, so lhead is ignored.  Same intermediate
+           dot trick, placed outside the target cluster.
+
+        Note: pytransitions already handles lhead (external -> composite) and
+        ltail (composite -> external), so those cases are left untouched.
+        """
+        # ── Build cluster hierarchy ─────────────────────────────────────────
+        # Real composite clusters (skip internal _root clusters).
+        # pytransitions names the initial-point node of cluster_X as X.
+        cluster_parent = {}  # cluster_name -> parent cluster name (or None)
+        cluster_stack = []  # all clusters incl. _root for correct brace matching
+        for line in self.lines:
+            if line.cluster:
+                if not line.cluster.endswith("_root"):
+                    cluster_parent[line.cluster] = (
+                        cluster_stack[-1] if cluster_stack else None
+                    )
+                cluster_stack.append(line.cluster)
+            elif line.closes and cluster_stack:
+                cluster_stack.pop()
+
+        # initial-point name -> cluster  e.g. 'Active' -> 'cluster_Active'
+        initial_to_cluster = {c[len("cluster_") :]: c for c in cluster_parent}
+
+        # ── Identify edges to fix ───────────────────────────────────────────
+        replaced = {}  # index -> residual statement (or None) replacing the line
+        deferred_nodes = defaultdict(list)  # parent cluster (or None) -> node lines
+        extra_edges = []  # replacement edge strings (top-level)
+        counter = 0
+
+        for i, line in enumerate(self.lines):
+            if "->" not in line.text:
+                continue
+            m = _FIX_EDGE_RE.match(line.text)
+            if not m:
+                continue
+
+            indent = m.group(1)
+            source_raw = m.group(2)
+            target_raw = m.group(3).rstrip()
+            rest = m.group(4)
+
+            source = source_raw.strip('"')
+            target = target_raw.strip('"')
+
+            source_cluster = initial_to_cluster.get(source)
+            target_cluster = initial_to_cluster.get(target)
+            if not source_cluster and not target_cluster:
+                continue
+
+            # Skip auto-generated pytransitions initial-state edges.
+            # Inner composite initial edges use headlabel=""; the outermost composite's
+            # initial edge (e.g. Active -> Active_WashCycle produced by pytransitions
+            # when initial='WashCycle' is set) uses label="" instead.  Both must be
+            # left untouched so the [*]->Child arrow stays in the diagram.
+            if 'headlabel=""' in rest or re.search(r'(?<![a-z])label=""', rest):
+                continue
+
+            # Extract just this edge's attribute block; anything after belongs to
+            # a second statement packed in the same body item by pytransitions.
+            edge_attrs, after_edge = rest, ""
+            bracket_depth = 0
+            for idx, ch in enumerate(rest):
+                if ch == "[":
+                    bracket_depth += 1
+                elif ch == "]":
+                    bracket_depth -= 1
+                    if bracket_depth == 0:
+                        edge_attrs = rest[: idx + 1]
+                        after_edge = rest[idx + 1 :]
+                        break
+            residual = "\t" + after_edge.lstrip("\t ") if after_edge.strip() else None
+
+            if not source_cluster:
+                # ── Case 3b: non-composite → composite ancestor ────────────────
+                # pytransitions emits no lhead when the source lives inside the
+                # destination cluster (e.g. Printing → LoggedIn).  Use an
+                # intermediate dot placed outside the target cluster so the arrow
+                # forms a clean self-loop on the target cluster's outer boundary.
+                if target_cluster and source.startswith(target + "_"):
+                    node_name = f"_escape_{target}_{counter}"
+                    counter += 1
+                    deferred_nodes[cluster_parent.get(target_cluster)].append(
+                        f'\t"{node_name}" {_INVISIBLE_DOT}'
+                    )
+                    clean = _clean_attrs(edge_attrs)
+                    # No ltail needed: source is a leaf node (non-composite),
+                    # so the edge should start directly from the source node.
+                    if clean.startswith("["):
+                        out_attrs = clean[:-1] + " dir=none]"
+                    elif clean:
+                        out_attrs = "[" + clean.strip("[]") + " dir=none]"
+                    else:
+                        out_attrs = "[dir=none]"
+                    # Edge 1: source node → dot (no arrowhead)
+                    extra_edges.append(
+                        f'{indent}{source_raw} -> "{node_name}" {out_attrs}'
+                    )
+                    # Edge 2: dot → arrowhead re-enters target cluster boundary
+                    extra_edges.append(
+                        f'{indent}"{node_name}" -> {target_raw} '
+                        f"[lhead={target_cluster} constraint=false]"
+                    )
+                    replaced[i] = residual
+                continue
+
+            # Strip any previously-added ltail/lhead (clean slate): lhead belongs
+            # only on Edge 2 (dot → target); keeping it on Edge 1 clips the edge
+            # at a cluster boundary the dot is outside of.
+            clean_attrs = _clean_attrs(edge_attrs)
+            if clean_attrs.startswith("["):
+                out_attrs = "[ltail=" + source_cluster + " " + clean_attrs[1:]
+            elif clean_attrs:
+                out_attrs = "[ltail=" + source_cluster + " " + clean_attrs.strip("[]") + "]"
+            else:
+                out_attrs = f"[ltail={source_cluster}]"
+            # Edge 1: cluster boundary ──(label)──> dot  (no arrowhead)
+            exit_edge = (
+                f'{indent}{source_raw} -> "{{}}" {out_attrs[:-1]} dir=none]'
+                if out_attrs.endswith("]")
+                else f'{indent}{source_raw} -> "{{}}" {out_attrs} [dir=none]'
+            )
+
+            if source == target:
+                # ── Case 1: self-loop on composite ────────────────────────────
+                # Dot node goes in the parent cluster (inside Active for Cleaning,
+                # at top level for Active itself).
+                node_name = f"_selfloop_{source}_{counter}"
+                dot_cluster = cluster_parent.get(source_cluster)
+                # Edge 2: dot ──> cluster boundary (constraint=false avoids
+                # pushing the dot node out of the parent cluster rank)
+                enter_edge = (
+                    f'{indent}"{node_name}" -> {target_raw} '
+                    f"[lhead={source_cluster} constraint=false]"
+                )
+            elif target.startswith(source + "_"):
+                # ── Case 2: composite -> own child ────────────────────────────
+                node_name = f"_entry_{source}_{counter}"
+                dot_cluster = cluster_parent.get(source_cluster)
+                # Edge 2: dot ──> target child.  If the child is itself
+                # composite, lhead stops the arrowhead at its cluster border.
+                target_child_cluster = initial_to_cluster.get(target)
+                if target_child_cluster:
+                    enter_edge = (
+                        f'{indent}"{node_name}" -> {target_raw} '
+                        f"[lhead={target_child_cluster} constraint=false]"
+                    )
+                else:
+                    enter_edge = f'{indent}"{node_name}" -> {target_raw}'
+            elif target_cluster and source.startswith(target + "_"):
+                # ── Case 3a: composite → composite ancestor ────────────────────
+                node_name = f"_escape_{target}_{counter}"
+                dot_cluster = cluster_parent.get(target_cluster)
+                enter_edge = (
+                    f'{indent}"{node_name}" -> {target_raw} '
+                    f"[lhead={target_cluster} constraint=false]"
+                )
+            else:
+                continue
+
+            counter += 1
+            deferred_nodes[dot_cluster].append(f'\t"{node_name}" {_INVISIBLE_DOT}')
+            extra_edges.append(exit_edge.replace('"{}"', f'"{node_name}"', 1))
+            extra_edges.append(enter_edge)
+            replaced[i] = residual
+
+        # ── Rebuild body, inject dot nodes at correct cluster boundaries ──────
+        fixed = []
+        cluster_stack = []
+        for i, line in enumerate(self.lines):
+            if i in replaced:
+                # Preserve any secondary statement packed in the same body item.
+                if replaced[i] is not None:
+                    fixed.append(DotLine(replaced[i]))
+                continue
+            if line.cluster:
+                cluster_stack.append(line.cluster)
+            elif line.closes and cluster_stack:
+                # Inject dot nodes deferred to this cluster before its closing brace.
+                fixed.extend(DotLine(t) for t in deferred_nodes.get(cluster_stack.pop(), ()))
+            fixed.append(line)
+
+        # Top-level dot nodes, then all replacement edges at the top level.
+        fixed.extend(DotLine(t) for t in deferred_nodes.get(None, ()))
+        fixed.extend(DotLine(t) for t in extra_edges)
+        self.lines = fixed
+
+    # ── Initial-state markers ───────────────────────────────────────────────
+
+    def add_initial_state_markers(
+        self,
+        root_initial_state: Optional[str],
+        nested_initial_states: dict,
+        parallel_composite_paths: set,
+    ) -> None:
+        """Add [*] markers the pytransitions graph lacks, hide unused ones."""
+        lines = self.lines
+        inserted = defaultdict(list)  # anchor index -> lines inserted after it
+        appended = []
+
+        if root_initial_state:
+            anchor = -1
+            for idx, line in enumerate(lines):
+                if any(marker in line.text for marker in _HEADER_MARKERS):
+                    anchor = idx
+                elif "subgraph" in line.text:
+                    break
+            root_marker = "_initial"
+            root_cluster = f"cluster_{root_initial_state}"
+            if any(line.subgraph == root_cluster for line in lines):
+                edge = f'\t"{root_marker}" -> "{root_initial_state}" [lhead={root_cluster}]'
+            else:
+                edge = f'\t"{root_marker}" -> "{root_initial_state}"'
+            # Later inserts at the same anchor go first, like list.insert.
+            inserted[anchor].append(DotLine(edge))
+            inserted[anchor].append(DotLine(f'\t"{root_marker}" {_INITIAL_DOT}'))
+
+        # Inject [*]→Child initial-state edges for nested composites.
+        # pytransitions merges [*]→Child with regular transitions that
+        # target the same child (e.g. "reset | ").  When Case 2 of
+        # fix_hierarchical_transitions replaces that merged edge with an
+        # intermediate-dot pair, the composite's entry black dot loses its
+        # outgoing edge.  Re-inject it using nested_initial_states.
+        if nested_initial_states:
+            extra = [line for group in inserted.values() for line in group]
+            cluster_names = {line.subgraph for line in lines + extra if line.subgraph}
+            subgraph_line = {}
+            for idx, line in enumerate(lines):
+                for key in line.subgraph_keys():
+                    subgraph_line.setdefault(key, idx)
+            edges = EdgeIndex()
+            for line in lines + extra:
+                if "->" in line.text:
+                    edges.add(line)
+
+            for parent_id, child_bare in nested_initial_states.items():
+                child_full = f"{parent_id}_{child_bare}"
+                child_cluster = f"cluster_{child_full}"
+                lhead = f" lhead={child_cluster}" if child_cluster in cluster_names else ""
+
+                # For parallel composites, pytransitions does not create an
+                # initial point node inside the cluster; add one right after
+                # the cluster's opening line so the black dot is visible.
+                if parent_id in parallel_composite_paths:
+                    init_node = f"_initial_{parent_id}"
+                    anchor = subgraph_line.get(f"cluster_{parent_id}")
+                    if anchor is not None:
+                        inserted[anchor].append(DotLine(f'\t\t"{init_node}" {_INITIAL_DOT}'))
+                    edge = DotLine(f'\t"{init_node}" -> "{child_full}" [headlabel=""{lhead}]')
+                elif _is_token(parent_id) and _is_token(child_full):
+                    if edges.has_edge(parent_id, child_full):
+                        continue
+                    edge = DotLine(f'\t"{parent_id}" -> "{child_full}" [headlabel=""{lhead}]')
+                else:
+                    pattern = re.compile(
+                        rf'"?{re.escape(parent_id)}"?\s*->\s*"?{re.escape(child_full)}"?'
+                    )
+                    current = self._splice(lines, inserted, appended)
+                    if any(pattern.search(line.text) for line in current):
+                        continue
+                    edge = DotLine(f'\t"{parent_id}" -> "{child_full}" [headlabel=""{lhead}]')
+                appended.append(edge)
+                edges.add(edge)
+
+        lines = self._splice(lines, inserted, appended)
+
+        # Point nodes left without edges are hidden; so are the cluster
+        # anchor nodes of parallel composites.
+        point_nodes = set()
+        nodes_with_edges = set()
+        # Hide initial point nodes for composite states that have no
+        # [*] --> child in the mermaid source.  pytransitions always creates a
+        # visible black-dot point node inside cluster_X_root for every
+        # composite X; keep it (it anchors ltail edges) but make it invisible.
+        composites_with_initial = set(nested_initial_states)
+        in_root_subgraph = False
+        hide_current = False
+        for line in lines:
+            text = line.text
+            m_node = _POINT_NODE_RE.match(text)
+            if m_node:
+                point_nodes.add(m_node.group(1))
+            m_edge = _EDGE_RE.match(text)
+            if m_edge:
+                nodes_with_edges.add(m_edge.group(1).strip('"'))
+                nodes_with_edges.add(m_edge.group(2).strip('"'))
+
+            root_match = _ROOT_CLUSTER_RE.search(text) if line.subgraph else None
+            if root_match:
+                in_root_subgraph = True
+                hide_current = root_match.group(1) not in composites_with_initial
+            elif in_root_subgraph and line.closes:
+                in_root_subgraph = False
+                hide_current = False
+            elif in_root_subgraph and hide_current and "shape=point" in text:
+                m_hidden = _HIDDEN_NODE_RE.match(text)
+                if m_hidden:
+                    line.text = (
+                        f'{m_hidden.group(1)}{m_hidden.group(2)} '
+                        f'[style=invis width=0 height=0 label=""]'
+                    )
+
+        for node_name in sorted(point_nodes - nodes_with_edges):
+            lines.append(DotLine(f'\t"{node_name}" [style=invis width=0 height=0 label=""]'))
+        for node_name in sorted(parallel_composite_paths):
+            lines.append(DotLine(f'\t"{node_name}" [style=invis width=0 height=0 label=""]'))
+        self.lines = lines
+
+    @staticmethod
+    def _splice(lines: list, inserted: dict, appended: list) -> list:
+        spliced = list(reversed(inserted.get(-1, ())))
+        for idx, line in enumerate(lines):
+            spliced.append(line)
+            if idx in inserted:
+                spliced.extend(reversed(inserted[idx]))
+        return spliced + appended
+
+
+def _clean_attrs(edge_attrs: str) -> str:
+    clean = re.sub(r"\bltail=[^\s\]]+\s*", "", edge_attrs).strip()
+    clean = re.sub(r"\blhead=[^\s\]]+\s*", "", clean).strip()
+    # Clean merged labels from pytransitions (e.g. "reset | " → "reset")
+    clean = re.sub(r'\s*\|\s*"', '"', clean)
+    return re.sub(r'="\s*\|\s*', '="', clean)
+
+
+def _is_token(name: str) -> bool:
+    """Names the edge index can match: no quotes or whitespace."""
+    return bool(name) and '"' not in name and not any(c.isspace() for c in name)
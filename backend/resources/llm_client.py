@@ -0,0 +1,192 @@
+"""Shared, pooled HTTP clients for LLM API calls.
+
+Every pipeline (single prompt, both two-stage stages, each grading attempt)
+goes through ``call_openrouter_llm`` / ``acall_openrouter_llm``.  Creating a
+fresh connection per call costs a DNS lookup plus TCP and TLS handshakes
+each time, so connections are pooled and reused (HTTP keep-alive):
+
+- synchronous callers share one ``requests.Session`` across all threads;
+- async callers share one ``httpx.AsyncClient`` per event loop, which
+  negotiates HTTP/2 when the ``h2`` package is installed.
+
+Configuration (environment):
+
+- ``SHERPA_LLM_POOL_SIZE``: connections kept per host (default 16).  Set it
+  at least as high as the number of concurrent generations.
+- ``SHERPA_LLM_POOL_RETRIES``: retries on connection errors (default 2).
+  These only cover opening a connection.
+
+A pooled keep-alive connection the server has already closed fails only
+once a request is written to it.  Async calls made through ``apost`` /
+``astream`` retry once on another connection when the connection drops
+before any response arrives (``STALE_CONNECTION_ERRORS``).  The server has
+answered nothing at that point, so retrying a completion cannot bill it
+twice; a drop after the response started is never retried.  The
+synchronous session relies on urllib3 discarding pooled connections it
+sees were dropped, and otherwise surfaces the error.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import collections
+import contextlib
+import os
+import threading
+import weakref
+from typing import Any, AsyncIterator, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+POOL_SIZE = int(os.environ.get("SHERPA_LLM_POOL_SIZE", "16"))
+POOL_RETRIES = int(os.environ.get("SHERPA_LLM_POOL_RETRIES", "2"))
+
+# Request timeout for LLM calls; a slow model must not hang a run forever.
+REQUEST_TIMEOUT = 300
+
+# Raised by a pooled connection the server closed while it sat idle.
+STALE_CONNECTION_ERRORS = (httpx.RemoteProtocolError, httpx.ReadError)
+
+_session: Optional[requests.Session] = None
+_adapter: Optional[HTTPAdapter] = None
+_session_lock = threading.Lock()
+
+# httpx.AsyncClient connections belong to the loop that opened them.
+_async_clients: "weakref.WeakKeyDictionary[Any, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+_async_stats: collections.Counter = collections.Counter()
+_stale_retries: collections.Counter = collections.Counter()
+
+
+def get_http_session() -> requests.Session:
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session, _adapter
+    with _session_lock:
+        if _session is None:
+            _adapter = HTTPAdapter(
+                pool_connections=POOL_SIZE,
+                pool_maxsize=POOL_SIZE,
+                max_retries=POOL_RETRIES,
+                # Block for a free connection rather than opening (and then
+                # discarding) extra ones once the pool is exhausted.
+                pool_block=True,
+            )
+            session = requests.Session()
+            session.mount("https://", _adapter)
+            session.mount("http://", _adapter)
+            _session = session
+        return _session
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Return the pooled async client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            transport=httpx.AsyncHTTPTransport(
+                http2=HTTP2_AVAILABLE,
+                retries=POOL_RETRIES,
+                limits=httpx.Limits(
+                    max_connections=POOL_SIZE,
+                    max_keepalive_connections=POOL_SIZE,
+                ),
+            ),
+            event_hooks={"response": [_count_async_response]},
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def _count_async_response(response: httpx.Response) -> None:
+    _async_stats["requests"] += 1
+    _async_stats[response.http_version] += 1
+
+
+async def _asend(request: httpx.Request) -> httpx.Response:
+    """Send ``request``, retrying once if the connection drops before the
+    response headers arrive.  The response body is not read yet."""
+    client = get_async_http_client()
+    try:
+        return await client.send(request, stream=True)
+    except STALE_CONNECTION_ERRORS:
+        _stale_retries["async"] += 1
+        return await client.send(request, stream=True)
+
+
+async def apost(url: str, **kwargs: Any) -> httpx.Response:
+    """``AsyncClient.post`` on the pooled client, with the stale-connection retry."""
+    response = await _asend(get_async_http_client().build_request("POST", url, **kwargs))
+    try:
+        await response.aread()
+    finally:
+        await response.aclose()
+    return response
+
+
+@contextlib.asynccontextmanager
+async def astream(method: str, url: str, **kwargs: Any) -> AsyncIterator[httpx.Response]:
+    """``AsyncClient.stream`` on the pooled client, with the stale-connection retry."""
+    response = await _asend(get_async_http_client().build_request(method, url, **kwargs))
+    try:
+        yield response
+    finally:
+        await response.aclose()
+
+
+async def close_async_http_client() -> None:
+    """Close the running loop's async client (call before the loop shuts down)."""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def http_pool_stats() -> dict[str, Any]:
+    """Connection reuse counters for both clients.
+
+    For the synchronous session, per-host ``requests`` greater than
+    ``connections_opened`` means keep-alive connections are being reused.
+    The async client reports how many responses arrived over each HTTP
+    version.
+    """
+    stats: dict[str, Any] = {
+        "pool_size": POOL_SIZE,
+        "hosts": {},
+        "async": {
+            "http2_enabled": HTTP2_AVAILABLE,
+            "open_clients": len(_async_clients),
+            "requests": _async_stats["requests"],
+            "stale_connection_retries": _stale_retries["async"],
+            "responses_by_http_version": {
+                k: v for k, v in _async_stats.items() if k != "requests"
+            },
+        },
+    }
+    with _session_lock:
+        adapter = _adapter
+    if adapter is None:
+        return stats
+
+    pools = adapter.poolmanager.pools
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        host = f"{pool.scheme}://{pool.host}:{pool.port}"
+        stats["hosts"][host] = {
+            "connections_opened": pool.num_connections,
+            "requests": pool.num_requests,
+            "idle_connections": pool.pool.qsize() if pool.pool is not None else 0,
+        }
+    return stats
@@ -0,0 +1,122 @@
+"""
+Scaling benchmark for ``parse_mermaid_with_library``.
+
+Generates synthetic stateDiagram-v2 diagrams with thousands of states
+(nested composites, parallel regions, history states, notes and transitions
+that cross hierarchy levels) and times the parse at doubling sizes.  With
+near-linear scaling the per-state cost stays roughly flat as the diagram
+grows.
+
+    python backend/resources/mermaid_parser_benchmark.py [--max-states 8000] [--backend converter]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mermaid_to_sherpa_parser import MERMAID_PARSER_BACKENDS, parse_mermaid_with_library
+
+LEAVES_PER_COMPOSITE = 6
+REGIONS_PER_PARALLEL = 3
+
+
+def synthetic_diagram(target_states: int, seed: int = 0) -> str:
+    """A diagram with about ``target_states`` states, shaped like the n-shot
+    solutions: composites nest a few levels deep, every fourth composite is
+    split into regions, and some leaf names repeat across branches."""
+    rng = random.Random(seed)
+    lines = ["stateDiagram-v2"]
+    counter = 0
+    made = 0
+
+    def fresh(prefix: str) -> str:
+        nonlocal counter
+        counter += 1
+        return f"{prefix}{counter}"
+
+    def composite(name: str, depth: int, indent: str, outer: list) -> None:
+        nonlocal made
+        lines.append(f"{indent}state {name} {{")
+        inner = indent + "    "
+        if depth % 4 == 1:
+            for _ in range(REGIONS_PER_PARALLEL):
+                region = fresh("Region")
+                lines.append(f"{inner}region {region} {{")
+                made += 1
+                body(depth + 1, inner + "    ", outer)
+                lines.append(f"{inner}}}")
+        else:
+            body(depth + 1, inner, outer)
+            lines.append(f"{inner}state H")
+        lines.append(f"{indent}}}")
+
+    def body(depth: int, indent: str, outer: list) -> None:
+        nonlocal made
+        leaves = [
+            fresh("S") if rng.random() < 0.8 else rng.choice(["Idle", "Ready", "Done"])
+            for _ in range(LEAVES_PER_COMPOSITE)
+        ]
+        leaves = list(dict.fromkeys(leaves))
+        for leaf in leaves:
+            lines.append(f"{indent}state {leaf}")
+        made += len(leaves)
+        lines.append(f"{indent}[*] --> {leaves[0]}")
+        for a, b in zip(leaves, leaves[1:]):
+            lines.append(f"{indent}{a} --> {b} : next [ready()] / step()")
+        if outer:
+            lines.append(f"{indent}{leaves[-1]} --> {rng.choice(outer)} : escape")
+        lines.append(f"{indent}note right of {leaves[0]}")
+        lines.append(f"{indent}    entry / start()")
+        lines.append(f"{indent}end note")
+        if depth < 6 and made < target_states:
+            child = fresh("C")
+            made += 1
+            composite(child, depth, indent, outer + leaves[:1])
+            lines.append(f"{indent}{leaves[0]} --> {child} : enter")
+            lines.append(f"{indent}{leaves[-1]} --> H : resume")
+
+    roots = []
+    while made < target_states:
+        root = fresh("Top")
+        made += 1
+        roots.append(root)
+        composite(root, 0, "    ", roots[:-1][-3:])
+    lines.append(f"    [*] --> {roots[0]}")
+    for a, b in zip(roots, roots[1:]):
+        lines.append(f"    {a} --> {b} : advance")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--min-states", type=int, default=250)
+    parser.add_argument("--max-states", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs")
+    parser.add_argument(
+        "--backend", choices=MERMAID_PARSER_BACKENDS, default="native", help="parser to time"
+    )
+    args = parser.parse_args()
+    os.environ["SHERPA_MERMAID_PARSER"] = args.backend
+
+    print(f"{'states':>8} {'transitions':>12} {'parse ms':>10} {'us/state':>9}")
+    size = args.min_states
+    while size <= args.max_states:
+        code = synthetic_diagram(size)
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            result = parse_mermaid_with_library(code)
+            best = min(best, time.perf_counter() - started)
+        states = sum(len(children) for children in result[2].values()) + len(result[0])
+        print(
+            f"{states:>8} {len(result[1]):>12} {best * 1000:>10.1f} "
+            f"{best * 1e6 / states:>9.1f}"
+        )
+        size *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Compare the ``native`` and ``converter`` Mermaid parsers (see
+``mermaid_parser_backend``) on the n-shot and validation solutions.
+
+The converter's ``parse_mermaid_with_library`` output for every solution is
+recorded once, where mermaid-parser-py and pythonmonkey are installed, into
+``mermaid_converter_outputs.json``; the native parser is then checked
+against that file anywhere, without SpiderMonkey.
+``backend/tests/test_mermaid_parser_parity.py`` runs the same check.
+
+    python backend/resources/mermaid_parser_parity.py --record   # needs the converter
+    python backend/resources/mermaid_parser_parity.py            # native vs recorded
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mermaid_to_sherpa_parser import parse_mermaid_with_library
+from n_shot_examples_single_prompt_mermaid import n_shot_examples, validation_examples
+
+CONVERTER_OUTPUTS_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "mermaid_converter_outputs.json"
+)
+
+FIELDS = (
+    "states_list",
+    "transitions",
+    "hierarchical_states",
+    "initial_state",
+    "parallel_regions",
+    "state_annotations",
+    "root_initial_state",
+    "nested_initial_states",
+    "state_declarations_map",
+)
+
+
+def corpus() -> dict:
+    return {
+        name: example["mermaid_code_solution"]
+        for name, example in {**n_shot_examples, **validation_examples}.items()
+    }
+
+
+def _comparable(value):
+    """parallel_regions holds parser objects; compare them by scoped id."""
+    if isinstance(value, dict):
+        return {k: _comparable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_comparable(v) for v in value]
+    if hasattr(value, "id_"):
+        return getattr(value, "scoped_id", value.id_)
+    return value
+
+
+def parse_output(mermaid_code: str, backend: str) -> dict:
+    """``parse_mermaid_with_library`` output by field, as stored in JSON."""
+    previous = os.environ.get("SHERPA_MERMAID_PARSER")
+    os.environ["SHERPA_MERMAID_PARSER"] = backend
+    try:
+        result = parse_mermaid_with_library(mermaid_code)
+    finally:
+        if previous is None:
+            os.environ.pop("SHERPA_MERMAID_PARSER", None)
+        else:
+            os.environ["SHERPA_MERMAID_PARSER"] = previous
+    return json.loads(json.dumps(dict(zip(FIELDS, _comparable(result)))))
+
+
+def load_converter_outputs(path: str = CONVERTER_OUTPUTS_PATH) -> dict:
+    """Recorded converter outputs by solution name; ``{}`` when not recorded."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def record_converter_outputs(path: str = CONVERTER_OUTPUTS_PATH) -> None:
+    outputs = {name: parse_output(code, "converter") for name, code in corpus().items()}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(outputs, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+
+def differences(native: dict, converter: dict) -> list:
+    """Fields on which the two outputs differ."""
+    return [name for name in FIELDS if native.get(name) != converter.get(name)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--record", action="store_true", help="record the converter's outputs first"
+    )
+    args = parser.parse_args()
+
+    if args.record:
+        record_converter_outputs()
+    recorded = load_converter_outputs()
+    if not recorded:
+        print(f"no converter outputs recorded in {CONVERTER_OUTPUTS_PATH}; run with --record")
+        sys.exit(2)
+
+    mismatched = 0
+    for name, code in corpus().items():
+        if name not in recorded:
+            mismatched += 1
+            print(f"✗ {name}: not recorded")
+            continue
+        fields = differences(parse_output(code, "native"), recorded[name])
+        mismatched += bool(fields)
+        print(f"✗ {name}: {', '.join(fields)} differ" if fields else f"✓ {name}")
+    print(f"\n{len(corpus()) - mismatched}/{len(corpus())} solutions identical")
+    sys.exit(1 if mismatched else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+"""
+Pure-Python parser for the Mermaid stateDiagram-v2 subset Sherpa renders.
+
+Drop-in replacement for mermaid-parser-py's ``StateDiagramConverter``: it
+returns the same kind of result object (states with ``id_`` / ``parent_id`` /
+``scoped_id``, transitions, history states, initial states and notes) and
+fills ``state_declarations_map``, so ``parse_mermaid_with_library`` can run
+its conversion to the Sherpa format unchanged on either backend.
+
+Supported syntax is what ``custom_mermaid_syntax.py`` teaches: state
+declarations, composite states, parallel ``region`` blocks, ``[*]`` initial
+pseudostates, history states named ``H``, ``event [guard] / action``
+transition labels and ``note right of`` blocks.  Unlike the converter it does
+not go through pythonmonkey, so it is thread-safe and needs no lock.
+
+Names are resolved the way the converter's fixed-up output expects: a name
+used in a block refers to the state declared closest to that block, searching
+the block's own subtree first and then each enclosing block's subtree.  A
+transition naming a state that is never declared is a ``MermaidSyntaxError``,
+the ``undeclared_state`` error of ``mermaid_validator``; only the history
+state ``H`` may be used inside a composite state without a declaration.
+
+``mermaid_parser_parity`` compares it with the converter on the n-shot and
+validation solutions.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+class MermaidSyntaxError(ValueError):
+    """Raised for input outside the supported stateDiagram-v2 subset."""
+
+    def __init__(self, message: str, line_no: int):
+        super().__init__(f"line {line_no}: {message}")
+        self.line_no = line_no
+
+
+@dataclass(eq=False)
+class State:
+    id_: str
+    parent_id: Optional[str]
+    scoped_id: str
+
+
+@dataclass(eq=False)
+class Composite(State):
+    pass
+
+
+@dataclass(eq=False)
+class Concurrent(Composite):
+    parallel_regions: list = field(default_factory=list)
+
+
+@dataclass(eq=False)
+class HistoryState(State):
+    parent_state_id: Optional[str] = None
+    is_history_state: bool = True
+
+
+@dataclass(eq=False)
+class Transition:
+    from_state: State
+    to_state: State
+    label: str = ""
+    is_history_transition: bool = False
+
+
+@dataclass
+class ConversionResult:
+    states: list = field(default_factory=list)
+    transitions: list = field(default_factory=list)
+    history_states: dict = field(default_factory=dict)
+    history_transitions: dict = field(default_factory=dict)
+    root_initial_state: Optional[str] = None
+    initial_states: dict = field(default_factory=dict)
+    state_notes: dict = field(default_factory=dict)
+
+
+HISTORY_STATE_NAME = "H"
+INITIAL_MARKER = "[*]"
+
+_NAME = r"[A-Za-z0-9_.]+"
+_BLOCK_RE = re.compile(
+    rf'^(state|region)\s+(?:"[^"]*"\s+as\s+)?({_NAME})\s*\{{$', re.IGNORECASE
+)
+_DECLARATION_RE = re.compile(
+    rf'^state\s+(?:"[^"]*"\s+as\s+)?({_NAME})(?:\s+as\s+"[^"]*")?'
+    rf"(?:\s*<<\w+>>)?(?:\s*:.*)?$",
+    re.IGNORECASE,
+)
+_TRANSITION_RE = re.compile(
+    rf"^(\[\*\]|{_NAME})\s*-->\s*(\[\*\]|{_NAME})\s*(?::(.*))?$"
+)
+_NOTE_RE = re.compile(
+    rf"^note\s+(?:right|left)\s+of\s+({_NAME})\s*(?::(.*))?$", re.IGNORECASE
+)
+_END_NOTE_RE = re.compile(r"^end\s+note$", re.IGNORECASE)
+_DESCRIPTION_RE = re.compile(rf"^({_NAME})\s*:(.*)$")
+_IGNORED_RE = re.compile(
+    r"^(%%|stateDiagram|direction\s|classDef\s|class\s|accTitle|accDescr)",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class _Block:
+    path: tuple
+    is_region: bool = False
+    # Child-block positions from the root; sorts blocks in breadth-first order
+    # within a level.
+    order: tuple = ()
+    declared: dict = field(default_factory=dict)  # name -> None, in source order
+    blocks: list = field(default_factory=list)
+
+
+def scan_statements(mermaid_code: str, strict: bool = True):
+    """Yield ``(line_no, kind, groups)`` for every meaningful line.
+
+    With ``strict=False`` problems are yielded as ``(line_no, "error",
+    (code, message))`` instead of raising ``MermaidSyntaxError``, so a caller can
+    report all of them (see ``mermaid_validator``).
+    """
+
+    def problem(code, message, line_no):
+        if strict:
+            raise MermaidSyntaxError(message, line_no)
+        return line_no, "error", (code, message)
+
+    lines = mermaid_code.split("\n")
+    i = 0
+    while i < len(lines):
+        line_no, line = i + 1, lines[i].strip()
+        i += 1
+        if not line or _IGNORED_RE.match(line):
+            continue
+        if line == "}":
+            yield line_no, "close", ()
+            continue
+        match = _BLOCK_RE.match(line)
+        if match:
+            yield line_no, "open", (match.group(1).lower() == "region", match.group(2))
+            continue
+        match = _TRANSITION_RE.match(line)
+        if match:
+            yield line_no, "transition", match.groups()
+            continue
+        match = _NOTE_RE.match(line)
+        if match:
+            target, inline = match.groups()
+            if inline is not None:
+                yield line_no, "note", (target, inline.strip())
+                continue
+            body = []
+            while i < len(lines) and not _END_NOTE_RE.match(lines[i].strip()):
+                body.append(lines[i].strip())
+                i += 1
+            if i == len(lines):
+                yield problem("unclosed_note", "note without 'end note'", line_no)
+                return
+            i += 1
+            yield line_no, "note", (target, "\n".join(body))
+            continue
+        match = _DECLARATION_RE.match(line)
+        if match:
+            yield line_no, "declare", (match.group(1),)
+            continue
+        match = _DESCRIPTION_RE.match(line)
+        if match:
+            yield line_no, "declare", (match.group(1),)
+            continue
+        yield problem("unsupported_syntax", f"unsupported statement {line!r}", line_no)
+
+
+class StateDiagramConverter:
+    """Parse stateDiagram-v2 text into a ``ConversionResult``."""
+
+    def __init__(self):
+        self.state_declarations_map = {}
+
+    def convert(self, mermaid_code: str) -> ConversionResult:
+        statements = list(scan_statements(mermaid_code))
+        blocks = self._scan_blocks(statements)
+        return _Builder(blocks).build(statements)
+
+    def _scan_blocks(self, statements) -> dict:
+        """First pass: block structure and the names declared in each block."""
+        blocks = {(): _Block(())}
+        stack = [()]
+        line_no = 0
+        for line_no, kind, groups in statements:
+            scope = stack[-1]
+            if kind == "open":
+                is_region, name = groups
+                if is_region and not scope:
+                    raise MermaidSyntaxError(
+                        f"region {name!r} must be inside a composite state", line_no
+                    )
+                path = scope + (name,)
+                self._declare(blocks[scope], name, scope)
+                if path not in blocks:
+                    parent = blocks[scope]
+                    blocks[path] = _Block(
+                        path, is_region, parent.order + (len(parent.blocks),)
+                    )
+                    parent.blocks.append(path)
+                stack.append(path)
+            elif kind == "close":
+                if len(stack) == 1:
+                    raise MermaidSyntaxError("unmatched '}'", line_no)
+                stack.pop()
+            elif kind == "declare":
+                self._declare(blocks[scope], groups[0], scope)
+        if len(stack) > 1:
+            raise MermaidSyntaxError(
+                f"block {stack[-1][-1]!r} is never closed", line_no
+            )
+        return blocks
+
+    def _declare(self, block: _Block, name: str, scope: tuple) -> None:
+        block.declared.setdefault(name)
+        self.state_declarations_map.setdefault(name, scope[-1] if scope else None)
+
+
+class _Builder:
+    """Second pass: create states and transitions in source order."""
+
+    def __init__(self, blocks: dict):
+        self.blocks = blocks
+        self.result = ConversionResult()
+        self.states = {}  # path -> State
+        # block -> {name: (sort key, closest block declaring it in the subtree)}
+        self.nearest = {path: {} for path in blocks}
+        for path, block in blocks.items():
+            for name in block.declared:
+                self._index(name, path)
+
+    def _index(self, name: str, path: tuple) -> None:
+        """Record that ``path`` declares ``name`` in every enclosing block."""
+        entry = ((len(path), self.blocks[path].order), path)
+        for depth in range(len(path), -1, -1):
+            nearest = self.nearest[path[:depth]]
+            current = nearest.get(name)
+            if current is None or entry[0] < current[0]:
+                nearest[name] = entry
+
+    def build(self, statements) -> ConversionResult:
+        stack = [()]
+        for line_no, kind, groups in statements:
+            scope = stack[-1]
+            if kind == "open":
+                path = scope + (groups[1],)
+                self._state(path)
+                stack.append(path)
+            elif kind == "close":
+                stack.pop()
+            elif kind == "declare":
+                self._state(scope + (groups[0],))
+            elif kind == "transition":
+                self._transition(line_no, scope, *groups)
+            elif kind == "note":
+                target, text = groups
+                self.result.state_notes.setdefault(target, []).append(text)
+        self._collect_regions()
+        return self.result
+
+    def _resolve(self, name: str, scope: tuple, line_no: int) -> tuple:
+        """Path of the declaration of ``name`` closest to ``scope``.
+
+        Searches the subtree of ``scope``, then of each enclosing block, in
+        breadth-first order.
+        """
+        for depth in range(len(scope), -1, -1):
+            found = self.nearest[scope[:depth]].get(name)
+            if found is not None:
+                return found[1] + (name,)
+        if name == HISTORY_STATE_NAME and scope:
+            self.blocks[scope].declared.setdefault(name)
+            self._index(name, scope)
+            return scope + (name,)
+        raise MermaidSyntaxError(
+            f"state {name!r} is never declared (add 'state {name}')", line_no
+        )
+
+    def _state(self, path: tuple) -> State:
+        state = self.states.get(path)
+        if state is not None:
+            return state
+        parent = self._state(path[:-1]) if len(path) > 1 else None
+        name = path[-1]
+        kwargs = dict(
+            id_=name,
+            parent_id=parent.id_ if parent else None,
+            scoped_id="_".join(path),
+        )
+        block = self.blocks.get(path)
+        if name == HISTORY_STATE_NAME and parent is not None and block is None:
+            state = HistoryState(parent_state_id=parent.id_, **kwargs)
+            self.result.history_states[parent.id_] = state
+        elif block is None:
+            state = State(**kwargs)
+        elif any(self.blocks[child].is_region for child in block.blocks):
+            state = Concurrent(**kwargs)
+        else:
+            state = Composite(**kwargs)
+        self.states[path] = state
+        self.result.states.append(state)
+        return state
+
+    def _transition(
+        self, line_no: int, scope: tuple, source: str, target: str, label
+    ) -> None:
+        if target == INITIAL_MARKER:
+            return  # final states are not rendered
+        to_path = self._resolve(target, scope, line_no)
+        if source == INITIAL_MARKER:
+            self._state(to_path)
+            if not scope:
+                self.result.root_initial_state = self.result.root_initial_state or target
+            else:
+                self.result.initial_states.setdefault(scope[-1], target)
+            return
+        from_state = self._state(self._resolve(source, scope, line_no))
+        to_state = self._state(to_path)
+        label = (label or "").strip()
+        is_history = isinstance(to_state, HistoryState)
+        if is_history:
+            trigger = re.split(r"[\[/]", label, maxsplit=1)[0].strip()
+            self.result.history_transitions[(from_state.id_, trigger)] = (
+                to_state.parent_state_id
+            )
+        self.result.transitions.append(
+            Transition(from_state, to_state, label, is_history)
+        )
+
+    def _collect_regions(self) -> None:
+        for path, state in self.states.items():
+            if not isinstance(state, Concurrent):
+                continue
+            for region_path in self.blocks[path].blocks:
+                if not self.blocks[region_path].is_region:
+                    continue
+                region = self.states[region_path]
+                state.parallel_regions.append(
+                    {
+                        "name": region.id_,
+                        "states": {region.id_: region},
+                        "initial": self.result.initial_states.get(region.id_),
+                    }
+                )
+
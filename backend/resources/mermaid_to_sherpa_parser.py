@@ -4,38 +4,79 @@ Convert mermaid-parser-py StateDiagramConverter output to Sherpa state machine f
 This is the UPDATED version that uses StateDiagramConverter instead of raw MermaidParser,
 which gives us the correct parent_id relationships and nearest common ancestor logic.
 Includes support for shallow history states (displayed as "H" pseudo-states).
+
+The converter result can come from mermaid-parser-py or from the pure-Python
+parser in ``mermaid_state_parser``; see ``mermaid_parser_backend``.
 """
 
+import os
 import re
 import sys
 import types
 
-# Fix for pythonmonkey import error in async/Chainlit context
-# pythonmonkey calls inspect.stack() during import which requires __main__ module
-# Only set if it doesn't exist to avoid conflicts with module reloading
-if "__main__" not in sys.modules:
-    main_module = types.ModuleType("__main__")
-    main_module.__file__ = "<synthetic __main__>"
-    sys.modules["__main__"] = main_module
-
 try:
-    from mermaid_parser.converters.state_diagram import StateDiagramConverter
-    from mermaid_parser.structs.state_diagram import HistoryState
-except Exception as e:
-    # If there's an import error, provide a helpful message
-    print(f"Error importing mermaid_parser: {e}", file=sys.stderr)
-    raise
+    from .mermaid_state_parser import StateDiagramConverter as NativeStateDiagramConverter
+except ImportError:
+    from mermaid_state_parser import StateDiagramConverter as NativeStateDiagramConverter
+
+MERMAID_PARSER_BACKENDS = ("native", "converter")
+
+
+def mermaid_parser_backend() -> str:
+    """Parser used by ``parse_mermaid_with_library``.
+
+    ``SHERPA_MERMAID_PARSER=converter`` (default) uses mermaid-parser-py's
+    pythonmonkey-backed ``StateDiagramConverter``, which is not thread-safe
+    and must be serialized by the caller; ``native`` uses the pure-Python
+    parser in ``mermaid_state_parser``.  The converter stays the default
+    until the native parser's parity with it is shown on the corpus (see
+    ``mermaid_parser_parity``).
+    """
+    backend = os.environ.get("SHERPA_MERMAID_PARSER", "converter").lower()
+    if backend not in MERMAID_PARSER_BACKENDS:
+        raise ValueError(
+            f"SHERPA_MERMAID_PARSER must be one of {MERMAID_PARSER_BACKENDS}, got {backend!r}"
+        )
+    return backend
+
+
+def _new_converter():
+    if mermaid_parser_backend() == "native":
+        return NativeStateDiagramConverter()
+
+    # Fix for pythonmonkey import error in async/Chainlit context
+    # pythonmonkey calls inspect.stack() during import which requires __main__ module
+    # Only set if it doesn't exist to avoid conflicts with module reloading
+    if "__main__" not in sys.modules:
+        main_module = types.ModuleType("__main__")
+        main_module.__file__ = "<synthetic __main__>"
+        sys.modules["__main__"] = main_module
+
+    try:
+        from mermaid_parser.converters.state_diagram import StateDiagramConverter
+    except Exception as e:
+        # If there's an import error, provide a helpful message
+        print(f"Error importing mermaid_parser: {e}", file=sys.stderr)
+        raise
+    return StateDiagramConverter()
+
+
+def _is_history_state(obj) -> bool:
+    return (
+        getattr(obj, "is_history_state", False)
+        or type(obj).__name__ == "HistoryState"
+    )
+
 
 def parse_mermaid_with_library(mermaid_code: str):
     """
-    Parse Mermaid stateDiagram-v2 using mermaid-parser-py StateDiagramConverter
-    and convert to Sherpa-compatible format.
+    Parse Mermaid stateDiagram-v2 with the configured parser (see
+    ``mermaid_parser_backend``) and convert to Sherpa-compatible format.
 
     Returns: (states_list, transitions_list, hierarchical_dict, initial_state, parallel_regions,
               state_annotations, root_initial_state, nested_initial_states, state_declarations_map)
     """
-    # Use StateDiagramConverter instead of raw MermaidParser
-    converter = StateDiagramConverter()
+    converter = _new_converter()
     result = converter.convert(mermaid_code)
 
     # Get the state declarations map for debugging
@@ -45,6 +86,7 @@ def parse_mermaid_with_library(mermaid_code: str):
     # Use scoped_id as the unique key to handle same-named states in different scopes
     all_states = {}  # scoped_id -> state object
     hierarchical_states = {}  # parent_id -> [children_ids] (for display names)
+    hierarchy_pairs = set()  # (parent_id, child_id) already in hierarchical_states
     initial_state = None
     transitions = []
     parallel_regions = []
@@ -80,7 +122,7 @@ def parse_mermaid_with_library(mermaid_code: str):
             continue
 
         # Skip HistoryState objects - they will be added as children of their parent composite
-        if isinstance(state, HistoryState) or getattr(state, "is_history_state", False):
+        if _is_history_state(state):
             continue
 
         # Use scoped_id as the unique key
@@ -94,7 +136,8 @@ def parse_mermaid_with_library(mermaid_code: str):
             # Add to parent's children list (using bare id for display)
             if parent_id not in hierarchical_states:
                 hierarchical_states[parent_id] = []
-            if state_id not in hierarchical_states[parent_id]:
+            if (parent_id, state_id) not in hierarchy_pairs:
+                hierarchy_pairs.add((parent_id, state_id))
                 hierarchical_states[parent_id].append(state_id)
 
         # Initialize children list for composite states
@@ -126,10 +169,16 @@ def parse_mermaid_with_library(mermaid_code: str):
             if actual_parent not in hierarchical_states:
                 hierarchical_states[actual_parent] = []
             for child in children:
-                if child not in hierarchical_states[actual_parent]:
+                if (actual_parent, child) not in hierarchy_pairs:
+                    hierarchy_pairs.add((actual_parent, child))
                     hierarchical_states[actual_parent].append(child)
             del hierarchical_states[region_id]
 
+    # First scoped_id for each bare id, used to recover full paths by name.
+    bare_to_scoped = {}
+    for scoped_key, bare in scoped_to_bare.items():
+        bare_to_scoped.setdefault(bare, scoped_key)
+
     # Step 2: Get initial state from converter result
     # The converter now extracts root_initial_state and initial_states for us
     root_initial_state = getattr(result, "root_initial_state", None)
@@ -233,7 +282,7 @@ def parse_mermaid_with_library(mermaid_code: str):
 
         # Check if this is a history transition (destination is a HistoryState)
         is_history_transition = getattr(transition, "is_history_transition", False)
-        if is_history_transition or isinstance(to_state, HistoryState):
+        if is_history_transition or _is_history_state(to_state):
             # The destination should be the H pseudo-state inside the parent composite
             # HistoryState has parent_state_id attribute
             parent_composite = getattr(to_state, "parent_state_id", None)
@@ -241,11 +290,11 @@ def parse_mermaid_with_library(mermaid_code: str):
                 # Find the full hierarchical path to the composite state
                 # Look up the composite's scoped path from all_states
                 composite_full_path = None
-                for scoped_key, state in all_states.items():
-                    bare = scoped_to_bare.get(scoped_key, scoped_key)
-                    if bare == parent_composite:
-                        composite_full_path = normalize_scoped_path(scoped_key, bare)
-                        break
+                scoped_key = bare_to_scoped.get(parent_composite)
+                if scoped_key is not None:
+                    composite_full_path = normalize_scoped_path(
+                        scoped_key, parent_composite
+                    )
 
                 if composite_full_path:
                     end_formatted = f"{composite_full_path}_H"
@@ -306,43 +355,6 @@ def parse_mermaid_with_library(mermaid_code: str):
             _cur_parent = _parent_stack[-1] if _parent_stack else None
             explicitly_declared.add((_cur_parent, _name))
 
-    # Build a function to calculate depth using hierarchical_states structure
-    def get_nesting_depth_from_hierarchy(state_name, hier_states, visited=None):
-        """Calculate how deeply nested a state is by counting how many ancestors it has"""
-        if visited is None:
-            visited = set()
-
-        # Prevent infinite recursion from circular references
-        if state_name in visited:
-            return 0
-        visited.add(state_name)
-
-        # Walk up the hierarchy to count ancestors
-        for potential_parent, children in hier_states.items():
-            if state_name in children:
-                # This state is a child of potential_parent
-                # Recursively get the depth of the parent and add 1
-                return 1 + get_nesting_depth_from_hierarchy(
-                    potential_parent, hier_states, visited
-                )
-        return 0  # Root level state
-
-    def is_ancestor(potential_ancestor, potential_descendant, hier_states):
-        """Return True if potential_ancestor is a (transitive) ancestor of potential_descendant."""
-        visited = set()
-        current = potential_descendant
-        while current and current not in visited:
-            visited.add(current)
-            for p, children in hier_states.items():
-                if current in children:
-                    if p == potential_ancestor:
-                        return True
-                    current = p
-                    break
-            else:
-                break
-        return False
-
     # Find states that appear as children of multiple parents
     child_to_parents = {}
     for parent, children in hierarchical_states.items():
@@ -351,6 +363,35 @@ def parse_mermaid_with_library(mermaid_code: str):
                 child_to_parents[child] = []
             child_to_parents[child].append(parent)
 
+    # Parent index: a state's parent is the first entry of hierarchical_states
+    # that lists it.  Built once so ancestor walks cost O(depth) instead of a
+    # scan of every composite per step.
+    parent_of = {child: parents[0] for child, parents in child_to_parents.items()}
+
+    def get_nesting_depth(state_name):
+        """Count how many ancestors a state has (stops at circular references)."""
+        depth = 0
+        visited = set()
+        current = state_name
+        while current not in visited:
+            visited.add(current)
+            if current not in parent_of:
+                break
+            depth += 1
+            current = parent_of[current]
+        return depth
+
+    def is_ancestor(potential_ancestor, potential_descendant):
+        """Return True if potential_ancestor is a (transitive) ancestor of potential_descendant."""
+        visited = set()
+        current = potential_descendant
+        while current and current not in visited and current in parent_of:
+            visited.add(current)
+            current = parent_of[current]
+            if current == potential_ancestor:
+                return True
+        return False
+
     # For each state that appears under multiple parents, keep it under the most nested parent.
     # IMPORTANT: only deduplicate when the duplicate is a *cross-reference* caused by the
     # converter — i.e. one parent is an ancestor of the other in the same hierarchy branch.
@@ -359,10 +400,7 @@ def parse_mermaid_with_library(mermaid_code: str):
     for state_name, parents in child_to_parents.items():
         if len(parents) > 1:
             # Calculate depth of each parent using the hierarchical structure
-            parent_depths = [
-                (parent, get_nesting_depth_from_hierarchy(parent, hierarchical_states))
-                for parent in parents
-            ]
+            parent_depths = [(parent, get_nesting_depth(parent)) for parent in parents]
             # Sort by depth (higher depth = more nested)
             parent_depths.sort(key=lambda x: x[1], reverse=True)
             deepest_parent = parent_depths[0][0]
@@ -370,7 +408,7 @@ def parse_mermaid_with_library(mermaid_code: str):
             # Remove from shallower parents ONLY when they are ancestors of the deepest parent.
             # If two parents are in unrelated branches, the state exists legitimately in both.
             for parent, depth in parent_depths[1:]:
-                if not is_ancestor(parent, deepest_parent, hierarchical_states):
+                if not is_ancestor(parent, deepest_parent):
                     # parent is not an ancestor of deepest_parent → different branch → different state
                     continue
                 # Don't remove if this child was explicitly declared at this level
@@ -379,9 +417,23 @@ def parse_mermaid_with_library(mermaid_code: str):
                     continue
                 if state_name in hierarchical_states.get(parent, []):
                     hierarchical_states[parent].remove(state_name)
+                    if parent_of.get(state_name) == parent:
+                        parent_of[state_name] = next(
+                            p
+                            for p in parents
+                            if state_name in hierarchical_states.get(p, [])
+                        )
 
     # Create a lookup for parallel region info by parent state
     parallel_info_by_state = {p["parent"]: p["regions"] for p in parallel_regions}
+    # state_id -> [(index into parallel_regions, region)] for every region listing it
+    regions_by_state = {}
+    for p_index, p in enumerate(parallel_regions):
+        for region in p["regions"]:
+            for region_state_id in region.get("states", {}):
+                regions_by_state.setdefault(region_state_id, []).append(
+                    (p_index, region)
+                )
 
     def build_nested_state(state_id):
         """Recursively build nested state structure, including history pseudo-states"""
@@ -490,16 +542,17 @@ def parse_mermaid_with_library(mermaid_code: str):
 
             # Try to find initial state for this composite from parallel regions info
             # The initial state is typically the first child or specified in region info
-            for p in parallel_regions:
-                for region in p["regions"]:
-                    if state_id in region.get("states", {}):
-                        region_initial = region.get("initial")
-                        if (
-                            region_initial
-                            and region_initial in hierarchical_states.get(state_id, [])
-                        ):
-                            result["initial"] = region_initial
-                            break
+            matched_p_index = None
+            for p_index, region in regions_by_state.get(state_id, []):
+                if p_index == matched_p_index:
+                    continue
+                region_initial = region.get("initial")
+                if (
+                    region_initial
+                    and region_initial in hierarchical_states.get(state_id, [])
+                ):
+                    result["initial"] = region_initial
+                    matched_p_index = p_index
 
             return result
         else:
@@ -629,15 +682,11 @@ def parse_mermaid_with_library(mermaid_code: str):
     # scoped paths like "Active_WashCycle" (matching subgraph names like cluster_Active_WashCycle).
     remapped_initial_states = {}
     for parent_id, child_id in nested_initial_states.items():
-        found = False
-        for scoped_id, state_obj in all_states.items():
-            bare_id = scoped_to_bare.get(scoped_id, scoped_id)
-            if bare_id == parent_id and parent_id in hierarchical_states:
-                normalized = re.sub(r"_region_\d+", "", scoped_id)
-                remapped_initial_states[normalized] = child_id
-                found = True
-                break
-        if not found:
+        scoped_id = bare_to_scoped.get(parent_id)
+        if scoped_id is not None and parent_id in hierarchical_states:
+            normalized = re.sub(r"_region_\d+", "", scoped_id)
+            remapped_initial_states[normalized] = child_id
+        else:
             remapped_initial_states[parent_id] = child_id
     nested_initial_states = remapped_initial_states
 
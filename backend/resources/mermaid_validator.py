@@ -0,0 +1,266 @@
+"""
+Structural checks for generated Mermaid, run before a render is paid for.
+
+``validate_mermaid`` scans the stateDiagram-v2 subset that
+``mermaid_state_parser`` accepts and reports every rule of
+``custom_mermaid_syntax`` it can check without building the state machine:
+unsupported statements, unbalanced ``{ }`` blocks, states that are never
+declared, missing or duplicate ``[*]`` initial states, transitions that enter
+a parallel region from outside its composite, and history states targeted from
+inside their own composite.  It runs in milliseconds in-process, so a bad LLM
+answer is rejected without a worker round-trip, and its diagnostics are fed
+back to the model on the next attempt.
+
+The checks follow the native parser's grammar.  Unless that parser renders
+the diagram (``SHERPA_MERMAID_PARSER=native``), only problems no parser gets
+past (unbalanced blocks, an empty diagram) are errors; the rest are reported
+as warnings and the render decides, so the converter never pays an LLM
+retry for a diagram it would have accepted.
+
+    python backend/resources/mermaid_validator.py diagram.mmd
+"""
+
+import os
+import sys
+from dataclasses import asdict, dataclass, replace
+from typing import Optional
+
+try:
+    from .mermaid_state_parser import HISTORY_STATE_NAME, INITIAL_MARKER, scan_statements
+    from .mermaid_to_sherpa_parser import mermaid_parser_backend
+except ImportError:
+    from mermaid_state_parser import HISTORY_STATE_NAME, INITIAL_MARKER, scan_statements
+    from mermaid_to_sherpa_parser import mermaid_parser_backend
+
+ERROR = "error"
+WARNING = "warning"
+# Errors under either parser backend; the rest only under the native one.
+BACKEND_INDEPENDENT_ERRORS = frozenset({"unbalanced_block", "empty_diagram"})
+
+
+@dataclass(frozen=True)
+class Diagnostic:
+    code: str
+    message: str
+    line: Optional[int] = None
+    severity: str = ERROR
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def __str__(self) -> str:
+        where = f"line {self.line}" if self.line else "diagram"
+        suffix = " (warning)" if self.severity == WARNING else ""
+        return f"{where}: [{self.code}] {self.message}{suffix}"
+
+
+def mermaid_validation_enabled() -> bool:
+    return os.environ.get("SHERPA_VALIDATE_MERMAID", "1").lower() not in {"0", "false", "no"}
+
+
+def has_errors(diagnostics) -> bool:
+    return any(d.severity == ERROR for d in diagnostics)
+
+
+def format_diagnostics(diagnostics) -> str:
+    """One ``- line N: [code] message`` bullet per diagnostic, errors first."""
+    ordered = sorted(diagnostics, key=lambda d: (d.severity != ERROR, d.line or 0))
+    return "\n".join(f"- {d}" for d in ordered)
+
+
+def validate_mermaid(mermaid_code: str) -> list:
+    """Every structural problem in ``mermaid_code`` as a ``Diagnostic``."""
+    diagnostics = _Validator().run(mermaid_code)
+    if mermaid_parser_backend() == "native":
+        return diagnostics
+    return [
+        d if d.code in BACKEND_INDEPENDENT_ERRORS else replace(d, severity=WARNING)
+        for d in diagnostics
+    ]
+
+
+class _Validator:
+    def __init__(self):
+        self.diagnostics = []
+        self.blocks = {(): {"region": False, "line": None, "children": []}}
+        self.declared = {}  # name -> [block path declaring it]
+        self.initials = {}  # block path -> [line numbers of ``[*] --> X``]
+        self.transitions = []  # (line, scope, source, target)
+
+    def report(self, code, message, line=None, severity=ERROR):
+        self.diagnostics.append(Diagnostic(code, message, line, severity))
+
+    def run(self, mermaid_code: str) -> list:
+        if not any(
+            line.strip().lower().startswith("statediagram")
+            for line in mermaid_code.split("\n")
+        ):
+            self.report(
+                "missing_header", "diagram does not start with 'stateDiagram-v2'",
+                severity=WARNING,
+            )
+        self._scan(mermaid_code)
+        if len(self.blocks) == 1 and not self.declared and not self.transitions:
+            self.report("empty_diagram", "diagram declares no states")
+            return self.diagnostics
+        entered = self._check_transitions()
+        self._check_initial_states(entered)
+        return self.diagnostics
+
+    def _declare(self, name, scope):
+        paths = self.declared.setdefault(name, [])
+        if scope not in paths:
+            paths.append(scope)
+
+    def _scan(self, mermaid_code):
+        stack = [()]
+        for line_no, kind, groups in scan_statements(mermaid_code, strict=False):
+            scope = stack[-1]
+            if kind == "error":
+                code, message = groups
+                self.report(code, message, line_no)
+            elif kind == "open":
+                is_region, name = groups
+                if is_region and not scope:
+                    self.report(
+                        "region_outside_composite",
+                        f"region {name!r} must be inside a composite state",
+                        line_no,
+                    )
+                path = scope + (name,)
+                self._declare(name, scope)
+                if path not in self.blocks:
+                    self.blocks[path] = {"region": is_region, "line": line_no, "children": []}
+                    self.blocks[scope]["children"].append(path)
+                stack.append(path)
+            elif kind == "close":
+                if len(stack) == 1:
+                    self.report("unbalanced_block", "'}' without a matching block", line_no)
+                else:
+                    stack.pop()
+            elif kind == "declare":
+                self._declare(groups[0], scope)
+            elif kind == "transition":
+                source, target, _label = groups
+                if source == INITIAL_MARKER and target != INITIAL_MARKER:
+                    self.initials.setdefault(scope, []).append(line_no)
+                self.transitions.append((line_no, scope, source, target))
+        for path in reversed(stack[1:]):
+            self.report(
+                "unbalanced_block",
+                f"block {path[-1]!r} is never closed",
+                self.blocks[path]["line"],
+            )
+
+    def _is_concurrent(self, path):
+        return any(self.blocks[child]["region"] for child in self.blocks[path]["children"])
+
+    def _check_initial_states(self, entered):
+        """A missing ``[*]`` is an error where entry is ambiguous: a region or
+        a composite some transition targets.  Otherwise, the root included,
+        the renderer can still place the start (a warning)."""
+        for path, block in self.blocks.items():
+            if path and self._is_concurrent(path):
+                continue  # each region carries its own initial state
+            lines = self.initials.get(path, [])
+            where = (
+                "the diagram"
+                if not path
+                else f"{'region' if block['region'] else 'composite state'} {path[-1]!r}"
+            )
+            if not lines:
+                ambiguous = block["region"] or (bool(path) and path in entered)
+                self.report(
+                    "missing_initial_state",
+                    f"{where} has no initial state ('[*] --> State')",
+                    block["line"],
+                    ERROR if ambiguous else WARNING,
+                )
+            for line_no in lines[1:]:
+                self.report(
+                    "multiple_initial_states",
+                    f"{where} already has an initial state (line {lines[0]})",
+                    line_no,
+                )
+
+    def _resolve(self, name, scope):
+        """Path of the state ``name`` as the parser resolves it from ``scope``:
+        the closest declaration in the subtree of ``scope`` or of the nearest
+        enclosing block that has one."""
+        candidates = self.declared.get(name)
+        if not candidates:
+            return None
+        for depth in range(len(scope), -1, -1):
+            inside = [p for p in candidates if p[:depth] == scope[:depth]]
+            if inside:
+                return min(inside, key=len) + (name,)
+        return None
+
+    def _check_transitions(self):
+        """Check every transition; returns the state paths transitions enter."""
+        entered = set()
+        for line_no, scope, source, target in self.transitions:
+            paths = {}
+            for role, name in (("source", source), ("target", target)):
+                if name == INITIAL_MARKER:
+                    continue
+                path = self._resolve(name, scope)
+                if path is None and not (name == HISTORY_STATE_NAME and scope):
+                    self.report(
+                        "undeclared_state",
+                        f"{role} {name!r} is never declared (add 'state {name}')",
+                        line_no,
+                    )
+                paths[role] = path
+            source_path, target_path = paths.get("source"), paths.get("target")
+            if target_path is not None and source != INITIAL_MARKER:
+                entered.add(target_path)
+            if source_path is None or target_path is None:
+                continue
+            self._check_region_entry(line_no, source, target, source_path, target_path)
+            self._check_history_target(line_no, source, target, source_path, target_path)
+        return entered
+
+    def _check_region_entry(self, line_no, source, target, source_path, target_path):
+        for depth in range(1, len(target_path) + 1):
+            region = target_path[:depth]
+            if region not in self.blocks or not self.blocks[region]["region"]:
+                continue
+            composite = region[:-1]
+            if source_path[: len(composite)] == composite and source_path != composite:
+                continue
+            if region == target_path:
+                message = f"{target!r} is a region; target its parent {composite[-1]!r} instead"
+            else:
+                message = (
+                    f"{source!r} enters region {region[-1]!r} of {composite[-1]!r} "
+                    f"from outside; target {composite[-1]!r} instead"
+                )
+            self.report("transition_into_region", message, line_no)
+            return
+
+    def _check_history_target(self, line_no, source, target, source_path, target_path):
+        if target != HISTORY_STATE_NAME or len(target_path) < 2:
+            return
+        composite = target_path[:-1]
+        if source_path[: len(composite)] == composite and source_path != composite:
+            self.report(
+                "history_from_inside",
+                f"substate {source!r} of {composite[-1]!r} must not target its history "
+                f"state; only {composite[-1]!r} itself or outside states may",
+                line_no,
+            )
+
+
+def main() -> int:
+    if len(sys.argv) != 2:
+        print("Usage: mermaid_validator.py <diagram.mmd>", file=sys.stderr)
+        return 2
+    with open(sys.argv[1]) as f:
+        diagnostics = validate_mermaid(f.read())
+    print(format_diagnostics(diagnostics) or f"{os.path.basename(sys.argv[1])}: OK")
+    return 1 if has_errors(diagnostics) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,448 @@
+"""
+Deterministic pre-grading of rubric rows from the parsed student diagram.
+
+Many rows of ``ground_truth_grading/*.csv`` are mechanically checkable:
+``State,"Idle"``, ``Transition,"logoff (Ready => Idle)"`` with the ``Guard``
+and ``Action`` rows under it, ``Region,"Heater"``, ``History State,"for
+Busy"``, ``State,"initial state (Fan → Off)"``.  ``pre_grade_rows`` parses
+the student Mermaid with ``parse_mermaid_with_library``, matches those rows
+against the parsed structure and grades every row it can confirm, so only
+the rest is sent to the grading LLM.  It only runs with the native parser
+(``SHERPA_MERMAID_PARSER=native``); see ``pre_grading_enabled``.
+
+Matching is deliberately one-sided: a row is pre-graded (always with 1) only
+when the diagram has an unambiguous counterpart.  A row without one may
+still be represented in substance (a renamed state, a guard written
+differently, two rubric transitions merged into one), and ``additional
+elements`` rows always need judgment, so those are left to the LLM.
+
+Names match when they are equal ignoring case, spacing and punctuation
+(``Scan & Email`` = ``ScanAndEmail``), or when they differ only by the name
+of an enclosing state (``Off`` in region ``Fan`` = ``FanOff``).
+
+    python backend/resources/pre_grader.py diagram.mmd ground_truth.csv
+"""
+
+import csv
+import os
+import re
+import sys
+from collections import Counter
+from dataclasses import dataclass
+from typing import Optional
+
+try:
+    from .mermaid_state_parser import HISTORY_STATE_NAME
+    from .mermaid_to_sherpa_parser import mermaid_parser_backend, parse_mermaid_with_library
+except ImportError:
+    from mermaid_state_parser import HISTORY_STATE_NAME
+    from mermaid_to_sherpa_parser import mermaid_parser_backend, parse_mermaid_with_library
+
+PRE_GRADED_SCORE = "1"
+ADDITIONAL_ELEMENTS = "additionalelements"
+
+_WITH_CONTEXT = re.compile(r"^(?P<name>.*?)\s*\((?P<context>[^()]*)\)\s*$")
+_TRANSITION = re.compile(
+    r"^(?P<event>.*?)\s*\((?P<source>[^()]*?)\s*(?:=>|⇒)\s*(?P<target>[^()]*?)\s*\)\s*$"
+)
+_BARE_TRANSITION = re.compile(r"^(?P<source>[^()]+?)\s*(?:=>|⇒)\s*(?P<target>[^()]+?)$")
+_INITIAL_STATE = re.compile(r"^initial state\s*\((?P<inner>[^()]*)\)$", re.IGNORECASE)
+_CONTEXT_ARROW = re.compile(r"\s*(?:→|⇒|=>|->)\s*")
+_STATE_ACTION = re.compile(r"^(?P<kind>entry|exit|do)\s*[/:]\s*(?P<action>.+)$", re.IGNORECASE)
+_ANNOTATION = re.compile(r"^(?P<state>.*?)\.(?P<kind>entry|exit|do):\s*(?P<action>.*)$")
+
+
+@dataclass(frozen=True)
+class PreGrade:
+    score: str
+    note: str
+
+
+def pre_grading_enabled() -> bool:
+    """``SHERPA_PRE_GRADE`` is on and the native Mermaid parser is in use.
+
+    With the ``converter`` backend, parsing would run SpiderMonkey in the
+    grading process behind the render lock, so every row goes to the LLM.
+    """
+    if os.environ.get("SHERPA_PRE_GRADE", "1").lower() in {"0", "false", "no"}:
+        return False
+    return mermaid_parser_backend() == "native"
+
+
+def pre_grade_rows(
+    student_mermaid_code: str,
+    rows: list,
+    type_column: str,
+    element_column: str,
+) -> dict:
+    """``PreGrade`` for every row of ``rows`` the diagram confirms, by row index.
+
+    Returns ``{}`` when the diagram does not parse; every row then needs the LLM.
+    """
+    try:
+        diagram = _Diagram(parse_mermaid_with_library(student_mermaid_code))
+    except Exception:
+        return {}
+    return _Matcher(diagram, rows, type_column, element_column).run()
+
+
+def _norm(text: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", (text or "").lower().replace("&", "and"))
+
+
+def _split_context(element: str) -> tuple:
+    """``"On (Jacuzzi)"`` -> ``("On", "Jacuzzi")``; no parentheses -> context None."""
+    match = _WITH_CONTEXT.match(element)
+    if match and match.group("name"):
+        return match.group("name"), match.group("context").strip() or None
+    return element, None
+
+
+def _names_match(path: tuple, target: str) -> bool:
+    """Whether the state at ``path`` is called ``target`` (normalized), possibly
+    prefixed or suffixed with the name of one of its enclosing states."""
+    name = _norm(path[-1])
+    if name == target:
+        return True
+    for ancestor in path[:-1]:
+        prefix = _norm(ancestor)
+        if prefix and name in (prefix + target, target + prefix):
+            return True
+    return False
+
+
+def _guard_terms(guard: str) -> frozenset:
+    text = (guard or "").strip()
+    if text.startswith("[") and text.endswith("]"):
+        text = text[1:-1]
+    text = text.lower()
+    for old, new in (("≥", ">="), ("≤", "<="), ("≠", "!="), ("&&", "&"), ("||", "|"), ("==", "=")):
+        text = text.replace(old, new)
+    text = re.sub(r"[\s\"']", "", text)
+    return frozenset(term for term in text.split("&") if term)
+
+
+def _action_terms(action: str) -> frozenset:
+    text = re.sub(r"[\s\"'{}]", "", (action or "").lower()).replace("()", "")
+    return frozenset(term for term in text.split(";") if term)
+
+
+def _show(path: tuple) -> str:
+    return ".".join(path)
+
+
+@dataclass(frozen=True)
+class _Transition:
+    source: tuple
+    target: tuple
+    event: str
+    guard: frozenset
+    actions: frozenset
+    label: str
+
+
+class _Diagram:
+    """The parsed student diagram, indexed by state path."""
+
+    def __init__(self, parsed):
+        states, transitions, _hier, _initial, _parallel, annotations, root_initial = parsed[:7]
+        self.kinds = {}  # path -> "state" | "composite" | "region" | "history"
+        self.initials = {(): {root_initial} if root_initial else set()}
+        self._walk(states, (), concurrent=False)
+
+        by_scoped_id = {"_".join(path): path for path in self.kinds}
+        self.transitions = []
+        for t in transitions:
+            source = by_scoped_id.get(t.get("source"))
+            target = by_scoped_id.get(t.get("dest"))
+            if source is None or target is None:
+                continue
+            trigger, label = t.get("trigger", ""), t.get("label", "")
+            # Completion transitions are given the trigger "auto".
+            if trigger == "auto" and not label.lower().startswith("auto"):
+                trigger = ""
+            actions = "; ".join(t[key] for key in ("before", "after") if t.get(key))
+            self.transitions.append(
+                _Transition(
+                    source,
+                    target,
+                    _norm(trigger),
+                    _guard_terms(t.get("conditions", "")),
+                    _action_terms(actions),
+                    label,
+                )
+            )
+
+        self.state_actions = {}  # (state name, kind) -> action terms
+        for annotation in annotations:
+            match = _ANNOTATION.match(annotation)
+            if match:
+                key = (match.group("state"), match.group("kind"))
+                self.state_actions[key] = self.state_actions.get(
+                    key, frozenset()
+                ) | _action_terms(match.group("action"))
+
+    def _walk(self, nodes, parent: tuple, concurrent: bool) -> None:
+        for node in nodes:
+            if isinstance(node, dict):
+                path = parent + (node["name"],)
+                self.kinds[path] = "region" if concurrent else "composite"
+                initial = node.get("initial")
+                if isinstance(initial, list):
+                    self.initials[path] = set(initial)
+                else:
+                    self.initials[path] = {initial} if initial else set()
+                self._walk(node.get("children", []), path, isinstance(initial, list))
+            else:
+                path = parent + (node,)
+                self.kinds[path] = "history" if node == HISTORY_STATE_NAME else "state"
+
+    def find(self, name: str, context: Optional[str], kinds: tuple) -> list:
+        """Paths of the states of ``kinds`` called ``name``, inside ``context`` if given."""
+        target = _norm(name)
+        if not target:
+            return []
+        scope = _norm(context) if context else None
+        return [
+            path
+            for path, kind in self.kinds.items()
+            if kind in kinds
+            and _names_match(path, target)
+            and (
+                scope is None
+                or any(_names_match(path[:depth], scope) for depth in range(1, len(path)))
+            )
+        ]
+
+    def history_states(self, context: Optional[str]) -> list:
+        scope = _norm(context) if context else None
+        return [
+            path
+            for path, kind in self.kinds.items()
+            if kind == "history"
+            and (scope is None or (len(path) > 1 and _names_match(path[:-1], scope)))
+        ]
+
+
+class _Matcher:
+    def __init__(self, diagram: _Diagram, rows: list, type_column: str, element_column: str):
+        self.diagram = diagram
+        self.rows = [
+            (_norm(row.get(type_column, "")), (row.get(element_column, "") or "").strip())
+            for row in rows
+        ]
+        self.grades = {}
+        self.used = set()  # indices of diagram transitions already matched
+        # How often the rubric names each element: a name listed n times
+        # needs n counterparts in the diagram.
+        self.names = Counter(
+            (kind, _norm(name), _norm(context or ""))
+            for kind, element in self.rows
+            if kind in ("state", "compositestate", "region")
+            and not _INITIAL_STATE.match(element)
+            for name, context in [_split_context(element)]
+        )
+        self.state_names = Counter(
+            _norm(_split_context(element)[0])
+            for kind, element in self.rows
+            if kind in ("state", "compositestate")
+        )
+        self.transition_rows = Counter(
+            _norm(element) for kind, element in self.rows if kind == "transition"
+        )
+        self.history_rows = sum(
+            1
+            for kind, element in self.rows
+            if kind == "historystate" and _norm(element) != ADDITIONAL_ELEMENTS
+        )
+
+    def grade(self, index: int, note: str) -> None:
+        self.grades[index] = PreGrade(PRE_GRADED_SCORE, f"Pre-graded: {note}")
+
+    def run(self) -> dict:
+        groups = list(self._groups())
+        # A rubric guard pins down which of several parallel transitions a row
+        # means, so rows with guards claim their transitions first.
+        transitions = [g for g in groups if g[1] == "transition"]
+        transitions.sort(key=lambda g: not any(kind == "guard" for _, kind, _ in g[3]))
+        for index, _kind, element, attached in transitions:
+            self._match_transition(index, element, attached)
+        for index, kind, element, attached in groups:
+            if _norm(element) == ADDITIONAL_ELEMENTS:
+                continue
+            if kind in ("state", "compositestate"):
+                self._match_state(index, kind, element, attached)
+            elif kind == "region":
+                self._match_region(index, element)
+            elif kind == "historystate":
+                self._match_history(index, element)
+        return self.grades
+
+    def _groups(self):
+        """``(index, kind, element, attached)`` per row, where ``attached`` are
+        the Guard/Action rows that directly follow it."""
+        group = None
+        for index, (kind, element) in enumerate(self.rows):
+            if kind in ("guard", "action") and group is not None:
+                group[3].append((index, kind, element))
+                continue
+            if group is not None:
+                yield group
+            group = (index, kind, element, []) if kind not in ("guard", "action") else None
+        if group is not None:
+            yield group
+
+    def _state(self, name: str, context: Optional[str] = None) -> Optional[tuple]:
+        """The one diagram state a transition endpoint names, if unambiguous."""
+        if "initialstate" in _norm(name):
+            return None
+        history = re.sub(r"^history state\b", "", name.strip(), flags=re.IGNORECASE)
+        if history != name.strip() or _split_context(name)[0].strip() == HISTORY_STATE_NAME:
+            paths = self.diagram.history_states(_history_context(name))
+        else:
+            if self.state_names[_norm(name)] > 1:
+                return None
+            paths = self.diagram.find(name, context, ("state", "composite"))
+        return paths[0] if len(paths) == 1 else None
+
+    def _match_transition(self, index: int, element: str, attached: list) -> None:
+        match = _TRANSITION.match(element) or _BARE_TRANSITION.match(element)
+        if not match:
+            return
+        event = match.groupdict().get("event") or ""
+        if any(mark in event for mark in "[]/"):
+            return
+        source = self._state(match.group("source"))
+        target = self._state(match.group("target"))
+        if source is None or target is None:
+            return
+        candidates = [
+            i
+            for i, t in enumerate(self.diagram.transitions)
+            if i not in self.used
+            and t.source == source
+            and t.target == target
+            # A row without an event ("Heat => Idle") accepts any trigger.
+            and (not event or t.event == _norm(event))
+        ]
+        if not candidates:
+            return
+
+        guards = [(i, text) for i, kind, text in attached if kind == "guard"]
+        chosen = None
+        if guards:
+            matching = [
+                c
+                for c in candidates
+                if all(
+                    _guard_terms(text) == self.diagram.transitions[c].guard
+                    for _, text in guards
+                )
+            ]
+            if matching:
+                chosen = matching[0]
+                for guard_index, text in guards:
+                    self.grade(guard_index, f"guard {text} matches the transition's guard.")
+            elif len(candidates) == 1 and self.transition_rows[_norm(element)] == 1:
+                chosen = candidates[0]  # the guard itself is left to the LLM
+        else:
+            chosen = min(candidates, key=lambda c: bool(self.diagram.transitions[c].guard))
+        if chosen is None:
+            return
+
+        self.used.add(chosen)
+        transition = self.diagram.transitions[chosen]
+        self.grade(
+            index,
+            f"transition {_show(source)} -> {_show(target)} ({transition.label or 'no label'}).",
+        )
+        for action_index, kind, text in attached:
+            if kind == "action" and _action_terms(text) <= transition.actions and _action_terms(text):
+                self.grade(action_index, f"the transition performs {text}.")
+
+    def _match_state(self, index: int, kind: str, element: str, attached: list) -> None:
+        initial = _INITIAL_STATE.match(element)
+        if initial:
+            self._match_initial(index, initial.group("inner"))
+            return
+        name, context = _split_context(element)
+        kinds = ("composite",) if kind == "compositestate" else ("state", "composite")
+        paths = self.diagram.find(name, context, kinds)
+        needed = self.names[(kind, _norm(name), _norm(context or ""))]
+        if not paths or len(paths) < needed:
+            return
+        described = "composite state" if kind == "compositestate" else "state"
+        if len(paths) != 1:
+            shown = ", ".join(_show(path) for path in paths)
+            self.grade(index, f"the diagram has {len(paths)} {described}s named {name}: {shown}.")
+            return
+        self.grade(index, f"{described} {_show(paths[0])} is in the diagram.")
+        for action_index, action_kind, text in attached:
+            action = _STATE_ACTION.match(text)
+            if action_kind != "action" or not action:
+                continue
+            expected = _action_terms(action.group("action"))
+            actual = self.diagram.state_actions.get(
+                (paths[0][-1], action.group("kind").lower()), frozenset()
+            )
+            if expected and expected <= actual:
+                self.grade(action_index, f"{text} is on {_show(paths[0])}.")
+
+    def _match_initial(self, index: int, inner: str) -> None:
+        parts = _CONTEXT_ARROW.split(inner.strip(), maxsplit=1)
+        context, name = (parts[0] or None, parts[1]) if len(parts) == 2 else (None, parts[0])
+        paths = self.diagram.find(name, context, ("state", "composite"))
+        if len(paths) > 1 and context:
+            # Prefer states directly inside the named scope over deeper ones.
+            paths = [p for p in paths if _names_match(p[:-1], _norm(context))]
+        if len(paths) != 1:
+            return
+        path = paths[0]
+        if path[-1] in self.diagram.initials.get(path[:-1], ()):
+            self.grade(index, f"{_show(path)} is the initial state of its scope.")
+
+    def _match_region(self, index: int, element: str) -> None:
+        name, context = _split_context(element)
+        paths = self.diagram.find(name, context, ("region",))
+        if paths and len(paths) >= self.names[("region", _norm(name), _norm(context or ""))]:
+            self.grade(index, f"region {_show(paths[0])} is in the diagram.")
+
+    def _match_history(self, index: int, element: str) -> None:
+        context = _history_context(element)
+        paths = self.diagram.history_states(context)
+        if paths and (context or len(paths) >= self.history_rows):
+            self.grade(index, f"history state {_show(paths[0])} is in the diagram.")
+
+
+def _history_context(element: str) -> Optional[str]:
+    """The composite a history state row refers to: ``"for Busy"``,
+    ``"History State for On"`` and ``"H (Active)"`` name one, ``"H"`` does not."""
+    text = re.sub(r"^history state\b", "", element.strip(), flags=re.IGNORECASE).strip()
+    text = re.sub(r"^for\b", "", text, flags=re.IGNORECASE).strip()
+    name, context = _split_context(text)
+    if name.strip() in ("", HISTORY_STATE_NAME):
+        return context
+    return text
+
+
+def main() -> int:
+    if len(sys.argv) != 3:
+        print("Usage: pre_grader.py <diagram.mmd> <ground_truth.csv>", file=sys.stderr)
+        return 2
+    with open(sys.argv[1]) as f:
+        mermaid_code = f.read()
+    with open(sys.argv[2], newline="") as f:
+        reader = csv.DictReader(f)
+        fieldnames, rows = reader.fieldnames or [], list(reader)
+    type_column, element_column = fieldnames[0], fieldnames[1]
+    grades = pre_grade_rows(mermaid_code, rows, type_column, element_column)
+    for index, row in enumerate(rows):
+        grade = grades.get(index)
+        verdict = f"{grade.score}  {grade.note}" if grade else "-  (LLM)"
+        print(f"{row[type_column]:<16} {row[element_column]:<45} {verdict}")
+    print(f"{len(grades)}/{len(rows)} rows pre-graded")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
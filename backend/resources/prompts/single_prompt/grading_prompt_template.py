@@ -1,10 +1,16 @@
-def build_grading_prompt(
-    student_mermaid_code: str,
-    ground_truth_mermaid_code: str,
-    ground_truth_csv: str,
-    system_description: str,
+import hashlib
+
+
+def build_grading_prompt_prefix(
+    ground_truth_mermaid_code: str, system_description: str
 ) -> str:
-    """Build the automatic grading prompt for a generated Mermaid state machine."""
+    """Static part of the grading prompt for one example.
+
+    It depends only on the example (description and reference solution), so
+    it is identical across every grading call for that example: it can be
+    built once and reused, and providers with prompt caching serve it from
+    their cache.  ``build_grading_prompt_suffix`` appends the per-run part.
+    """
     return f"""<role>
 You are a professor specializing in state machine modeling and grading.
 You evaluate student state machine submissions against the system description, the ground truth CSV, and the corresponding ground truth Mermaid code, and complete the grading CSV with high precision.
@@ -17,33 +23,6 @@ The grading sheet CSV already contains the rubric rows and must be preserved exa
 The ground truth Mermaid code is provided to help you understand how the rubric applies to the system description, but do not simply copy elements from the ground truth Mermaid code into the grading sheet.
 </context>
 
-<documents>
-    <document index="1">
-        <source>system_description</source>
-        <document_content>
-{system_description}
-        </document_content>
-    </document>
-    <document index="2">
-        <source>student_submission_mermaid</source>
-        <document_content>
-{student_mermaid_code}
-        </document_content>
-    </document>
-    <document index="3">
-        <source>ground_truth_grading_sheet_csv</source>
-        <document_content>
-{ground_truth_csv}
-        </document_content>
-    </document>
-    <document index="4">
-        <source>ground_truth_mermaid_code</source>
-        <document_content>
-{ground_truth_mermaid_code}
-        </document_content>
-    </document>
-</documents>
-
 <instructions>
 Your task is to return the completed grading sheet CSV. Failure to follow the instructions will result in a score of 0 for the entire grading task, so please read carefully and double-check your work before submitting.
 
@@ -140,4 +119,94 @@ Do not include explanations before or after the CSV.
 Not respecting the output requirement will be considered a failure to follow instructions and will result in a score of 0 for the entire grading task.
 </output_requirement>
 </instructions>
+
+<documents>
+    <document index="1">
+        <source>system_description</source>
+        <document_content>
+{system_description}
+        </document_content>
+    </document>
+    <document index="2">
+        <source>ground_truth_mermaid_code</source>
+        <document_content>
+{ground_truth_mermaid_code}
+        </document_content>
+    </document>
+"""
+
+
+def build_grading_prompt_suffix(
+    student_mermaid_code: str,
+    ground_truth_csv: str,
+    other_rows_csv: str = "",
+) -> str:
+    """Per-run part of the grading prompt: the grading sheet and the submission.
+
+    ``other_rows_csv`` lists the rubric rows graded elsewhere: pre-graded
+    from the parsed diagram (see ``pre_grader``) or in another chunk of a
+    large rubric.  They are left out of the grading sheet but shown so that
+    "additional elements" are still judged against the whole rubric.
+    """
+    other_rows_document = (
+        f"""
+    <document index="5">
+        <source>other_rubric_rows</source>
+        <document_content>
+{other_rows_csv}
+        </document_content>
+    </document>"""
+        if other_rows_csv
+        else ""
+    )
+    other_rows_context = (
+        """
+The rubric rows in other_rubric_rows are graded separately. They are not part of the grading sheet: do not add them to your output. They are still expected elements of the solution, so never count the student elements that satisfy them as "additional elements"."""
+        if other_rows_csv
+        else ""
+    )
+    return f"""    <document index="3">
+        <source>ground_truth_grading_sheet_csv</source>
+        <document_content>
+{ground_truth_csv}
+        </document_content>
+    </document>
+    <document index="4">
+        <source>student_submission_mermaid</source>
+        <document_content>
+{student_mermaid_code}
+        </document_content>
+    </document>{other_rows_document}
+</documents>
+{other_rows_context}
+Complete the grading sheet in ground_truth_grading_sheet_csv for student_submission_mermaid, following the instructions above, and return only the final CSV.
 """
+
+
+def build_grading_prompt(
+    student_mermaid_code: str,
+    ground_truth_mermaid_code: str,
+    ground_truth_csv: str,
+    system_description: str,
+    other_rows_csv: str = "",
+) -> str:
+    """Build the automatic grading prompt for a generated Mermaid state machine."""
+    return build_grading_prompt_prefix(
+        ground_truth_mermaid_code, system_description
+    ) + build_grading_prompt_suffix(
+        student_mermaid_code, ground_truth_csv, other_rows_csv
+    )
+
+
+def _prompt_version() -> str:
+    """Digest of the prompt text, built with fixed placeholder arguments."""
+    placeholders = ("{student}", "{reference}", "{rubric}", "{description}")
+    digest = hashlib.sha256()
+    for other_rows_csv in ("", "{other_rows}"):
+        digest.update(build_grading_prompt(*placeholders, other_rows_csv).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+# Cached grading results (``grading_cache``) are keyed by this, so any edit to
+# the prompt text, prefix or suffix, invalidates them without a manual bump.
+GRADING_PROMPT_VERSION = _prompt_version()
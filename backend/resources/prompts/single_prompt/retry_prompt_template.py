@@ -0,0 +1,53 @@
+"""
+Retry prompt for the Single Prompt State Machine Framework.
+
+When an attempt's Mermaid is rejected by ``mermaid_validator`` before
+rendering, the next attempt re-sends the original prompt with a
+<previous_attempt> section appended: the rejected diagram and the
+validator's line-numbered diagnostics.  The model then repairs the listed
+problems instead of regenerating from scratch and repeating them.
+
+Same conventions as single_prompt_template:
+- XML tags to delimit the rejected output and its diagnostics
+- The "why" (the parser rejects these diagrams mechanically) stated up front
+- Scoped modification guard: fix the listed problems, keep everything else
+- The output format is unchanged, so extraction works as on the first attempt
+"""
+
+
+def build_retry_prompt(prompt: str, previous_mermaid: str, diagnostics: str) -> str:
+    """
+    Append validator feedback on the previous attempt to the original prompt.
+
+    Args:
+        prompt: The original prompt from build_single_prompt.
+        previous_mermaid: The Mermaid code extracted from the rejected answer.
+        diagnostics: The validator report (mermaid_validator.format_diagnostics);
+            line numbers refer to previous_mermaid.
+
+    Returns:
+        str: The retry prompt, ready to be sent as a standalone user message.
+    """
+    return f"""{prompt}
+
+<previous_attempt>
+Your previous answer to this task was rejected by the automated structural \
+validator before it could be rendered: the diagram in <previous_output> \
+breaks the rules in <mermaid_syntax_rules> in the ways listed in \
+<validator_diagnostics> (line numbers refer to <previous_output>). Entries \
+marked "(warning)" are allowed but worth fixing; every other entry makes the \
+parser reject the diagram or misplace states.
+
+<previous_output>
+{previous_mermaid}
+</previous_output>
+
+<validator_diagnostics>
+{diagnostics}
+</validator_diagnostics>
+
+Complete the task again. Start from <previous_output>, fix every listed \
+problem, and keep the states, transitions, guards, and actions that were not \
+flagged. Follow the same <output_instructions> as before.
+</previous_attempt>
+"""
@@ -0,0 +1,215 @@
+"""Content-addressed, disk-backed cache of rendered diagrams.
+
+Entries are keyed by a hash of the normalized Mermaid source plus the
+renderer version, so whitespace-only differences (re-indentation, blank
+lines, CRLF) hit the same entry while any change to the DOT pipeline
+invalidates everything by bumping ``RENDERER_VERSION`` in ``util.py``.
+
+Layout::
+
+    <cache_dir>/<key[:2]>/<key>/diagram.gv
+    <cache_dir>/<key[:2]>/<key>/diagram.svg
+    <cache_dir>/<key[:2]>/<key>/diagram.png   (only once some run drew it)
+
+Entry directories are touched on every hit, and the least recently used
+ones are evicted once the cache grows past its size budget.  The cache's
+size is kept as a running total of what this process stored, so only a
+store that takes it past the budget scans the cache (which also resyncs
+the total with entries other processes stored or removed).
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "SHERPA_RENDER_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_cache"),
+)
+DEFAULT_MAX_BYTES = int(float(os.environ.get("SHERPA_RENDER_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+ENTRY_STEM = "diagram"
+# Eviction frees down to this fraction of the budget, so a full cache is not
+# rescanned on every following store.
+LOW_WATER = 0.9
+
+
+def render_cache_enabled() -> bool:
+    return os.environ.get("SHERPA_RENDER_CACHE", "1").lower() not in {"0", "false", "no"}
+
+
+def normalize_mermaid(mermaid_code: str) -> str:
+    """Whitespace-insensitive canonical form used for cache keys."""
+    lines = (line.strip() for line in mermaid_code.replace("\r\n", "\n").split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def render_cache_key(mermaid_code: str, renderer_version: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(renderer_version.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_mermaid(mermaid_code).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _link_or_copy(src: str, dest: str) -> None:
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+def _entry_bytes(path: str) -> int:
+    try:
+        return sum(f.stat().st_size for f in os.scandir(path) if f.is_file())
+    except OSError:
+        return 0
+
+
+class RenderCache:
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # Bytes cached, as of the last scan plus later stores; None until
+        # the first store scans the cache.
+        self._bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def restore(self, key: str, diagram_file_path: str, required: Iterable[str]) -> bool:
+        """Materialize a cached entry next to ``diagram_file_path``.
+
+        Returns False (a miss) unless every suffix in ``required`` is cached.
+        """
+        entry = self._entry_dir(key)
+        required = list(required)
+        if not all(os.path.isfile(os.path.join(entry, ENTRY_STEM + s)) for s in required):
+            self._count(hit=False)
+            return False
+        try:
+            for name in os.listdir(entry):
+                stem, suffix = os.path.splitext(name)
+                if stem == ENTRY_STEM:
+                    _link_or_copy(os.path.join(entry, name), diagram_file_path + suffix)
+            os.utime(entry)
+        except OSError as exc:
+            logger.warning("Render cache entry %s unusable: %s", key, exc)
+            self._count(hit=False)
+            return False
+        self._count(hit=True)
+        return True
+
+    def _count(self, hit: bool) -> None:
+        # restore() runs on render executor threads.
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def store(self, key: str, diagram_file_path: str, suffixes: Iterable[str]) -> None:
+        """Copy freshly rendered artifacts into the cache (best effort).
+
+        An existing entry only gains the suffixes it is missing, e.g. a PNG
+        drawn by a run that asked for one after the entry was stored as SVG.
+        """
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            added = 0
+            for suffix in suffixes:
+                src = diagram_file_path + suffix
+                dest = os.path.join(entry, ENTRY_STEM + suffix)
+                if os.path.isfile(src) and not os.path.isfile(dest):
+                    try:
+                        _link_or_copy(src, dest)
+                        added += os.path.getsize(dest)
+                    except OSError as exc:
+                        logger.warning("Could not extend render cache entry %s: %s", key, exc)
+            if added:
+                self._grow(added)
+            return
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            staging = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix=".staging_")
+            try:
+                for suffix in suffixes:
+                    src = diagram_file_path + suffix
+                    if os.path.isfile(src):
+                        _link_or_copy(src, os.path.join(staging, ENTRY_STEM + suffix))
+                os.rename(staging, entry)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+        except OSError as exc:
+            # Another render may have stored the same key concurrently.
+            if not os.path.isdir(entry):
+                logger.warning("Could not store render cache entry %s: %s", key, exc)
+            return
+        self._grow(_entry_bytes(entry))
+
+    def _grow(self, added: int) -> None:
+        with self._stats_lock:
+            if self._bytes is not None:
+                self._bytes += added
+            over = self._bytes is None or self._bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self) -> None:
+        """Once over ``max_bytes``, drop least recently used entries until
+        under ``LOW_WATER`` of it.
+
+        Scans every entry; ``store`` only calls it once the running total
+        is over budget.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return
+        with self._evict_lock:
+            entries = []
+            total = 0
+            for shard in os.scandir(self.cache_dir):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if not entry.is_dir() or entry.name.startswith("."):
+                        continue
+                    size = _entry_bytes(entry.path)
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                    total += size
+            if total > self.max_bytes:
+                entries.sort()
+                for _, size, path in entries:
+                    shutil.rmtree(path, ignore_errors=True)
+                    total -= size
+                    if total <= self.max_bytes * LOW_WATER:
+                        break
+            with self._stats_lock:
+                self._bytes = total
+
+
+_cache: Optional[RenderCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> RenderCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RenderCache()
+        return _cache
@@ -0,0 +1,248 @@
+"""Supervised pool of long-lived Sherpa render workers.
+
+Each worker is a ``sherpa_render_worker.py --serve`` child process that
+imports sherpa_ai, transitions, mermaid-py and pythonmonkey once and then
+renders diagrams on request over its stdin/stdout pipes.  Rendering still
+happens out of process, so a native crash only takes down the worker; the
+pool notices the dead pipe, reports the job as failed and starts a
+replacement.  If the replacement cannot be started, its slot stays in the
+pool empty and the next job that takes it tries again.
+"""
+
+from __future__ import annotations
+
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional
+
+try:
+    from .. import telemetry
+except ImportError:
+    import telemetry
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "sherpa_render_worker.py"
+)
+
+# Pool sizing / supervision knobs (override via environment).
+DEFAULT_POOL_SIZE = int(os.environ.get("SHERPA_RENDER_WORKERS", "2"))
+DEFAULT_JOB_TIMEOUT = float(os.environ.get("SHERPA_RENDER_TIMEOUT", "300"))
+DEFAULT_STARTUP_TIMEOUT = float(os.environ.get("SHERPA_RENDER_STARTUP_TIMEOUT", "120"))
+# Recycle a worker after this many jobs to bound leaks in native code.
+DEFAULT_MAX_JOBS_PER_WORKER = int(os.environ.get("SHERPA_RENDER_MAX_JOBS", "200"))
+
+
+def render_pool_enabled() -> bool:
+    """``SHERPA_RENDER_POOL=0`` falls back to one subprocess per diagram."""
+    return os.environ.get("SHERPA_RENDER_POOL", "1").lower() not in {"0", "false", "no"}
+
+
+class RenderWorkerDied(RuntimeError):
+    """The worker process exited (or stopped answering) mid-job."""
+
+
+class _RenderWorker:
+    """One ``--serve`` child process plus a reader thread for its replies."""
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT, "--serve"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.jobs_done = 0
+        self.ready = False
+        self._replies: queue.Queue = queue.Queue()
+        self._reader = threading.Thread(target=self._read_replies, daemon=True)
+        self._reader.start()
+
+    def _read_replies(self) -> None:
+        for line in self.process.stdout:
+            if line.strip():
+                self._replies.put(line)
+        self._replies.put(None)  # EOF: the process is gone
+
+    def _next_reply(self, timeout: float) -> dict:
+        try:
+            line = self._replies.get(timeout=timeout)
+        except queue.Empty:
+            raise RenderWorkerDied(f"no reply within {timeout:.0f}s") from None
+        if line is None:
+            raise RenderWorkerDied(
+                f"worker exited with code {self.process.wait()}"
+            )
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError as exc:
+            # Out of step with the protocol; its later replies can't be trusted.
+            raise RenderWorkerDied(f"malformed reply {line[:200]!r}: {exc}") from exc
+
+    def wait_ready(self, timeout: float) -> None:
+        if self.ready:
+            return
+        reply = self._next_reply(timeout)
+        if not reply.get("ready"):
+            raise RenderWorkerDied(f"unexpected handshake: {reply!r}")
+        self.ready = True
+
+    def run(self, request: dict, timeout: float) -> dict:
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as exc:
+            raise RenderWorkerDied(f"worker pipe closed: {exc}") from exc
+        reply = self._next_reply(timeout)
+        self.jobs_done += 1
+        return reply
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def stop(self) -> None:
+        try:
+            if self.process.stdin:
+                self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class RenderWorkerPool:
+    """Fixed-size pool of pre-warmed render workers.
+
+    ``render()`` blocks until a worker is free, so the pool size also bounds
+    how many diagrams render concurrently.
+    """
+
+    def __init__(
+        self,
+        size: int = DEFAULT_POOL_SIZE,
+        job_timeout: float = DEFAULT_JOB_TIMEOUT,
+        startup_timeout: float = DEFAULT_STARTUP_TIMEOUT,
+        max_jobs_per_worker: int = DEFAULT_MAX_JOBS_PER_WORKER,
+    ):
+        self.size = max(1, size)
+        self.job_timeout = job_timeout
+        self.startup_timeout = startup_timeout
+        self.max_jobs_per_worker = max_jobs_per_worker
+        # None marks a slot whose worker could not be (re)started.
+        self._idle: queue.Queue[Optional[_RenderWorker]] = queue.Queue()
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.restarts = 0
+        self.jobs = 0
+        for _ in range(self.size):
+            self._idle.put(_RenderWorker())
+
+    def render(
+        self, mermaid_code: str, diagram_file_path: str, formats=("svg",)
+    ) -> tuple[bool, str, str]:
+        """Render one diagram. Returns ``(success, stdout, stderr)``."""
+        if self._closed:
+            raise RuntimeError("render pool is shut down")
+
+        queue_started = time.perf_counter()
+        worker = self._idle.get()
+        telemetry.record("render_queue", queue_started)
+        if worker is None:
+            worker = self._spawn()
+            if worker is None:
+                self._return(None)
+                return False, "", "Renderer worker could not be started\n"
+        replace = False
+        try:
+            worker.wait_ready(self.startup_timeout)
+            job_started = time.perf_counter()
+            reply = worker.run(
+                {
+                    "id": next(self._job_ids),
+                    "mermaid_code": mermaid_code,
+                    "diagram_file_path": diagram_file_path,
+                    "formats": list(formats),
+                },
+                self.job_timeout,
+            )
+            with self._lock:
+                self.jobs += 1
+            replace = worker.jobs_done >= self.max_jobs_per_worker
+            # Stage timings measured inside the worker (parse, draw, ...).
+            telemetry.add_spans(reply.get("spans") or [], job_started)
+            return (
+                bool(reply.get("success")),
+                reply.get("stdout", ""),
+                reply.get("stderr", ""),
+            )
+        except RenderWorkerDied as exc:
+            # Crashed or hung: kill whatever is left and replace it.
+            replace = True
+            logger.warning("Render worker %s failed: %s", worker.process.pid, exc)
+            if worker.alive():
+                worker.process.kill()
+            return False, "", f"Renderer worker failed: {exc}\n"
+        finally:
+            if replace or not worker.alive():
+                worker.stop()
+                with self._lock:
+                    self.restarts += 1
+                worker = self._spawn()
+            self._return(worker)
+
+    def _spawn(self) -> Optional[_RenderWorker]:
+        try:
+            return _RenderWorker()
+        except Exception:
+            logger.exception("Could not start a render worker; retrying on next use")
+            return None
+
+    def _return(self, worker: Optional[_RenderWorker]) -> None:
+        if not self._closed:
+            self._idle.put(worker)
+        elif worker is not None:
+            worker.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": self._idle.qsize(),
+                "jobs": self.jobs,
+                "restarts": self.restarts,
+            }
+
+    def shutdown(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is not None:
+                worker.stop()
+
+
+_pool: Optional[RenderWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool() -> RenderWorkerPool:
+    """Return the process-wide pool, starting its workers on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = RenderWorkerPool()
+            atexit.register(_pool.shutdown)
+        return _pool
@@ -1,6 +1,9 @@
+import contextlib
+import io
 import json
 import os
 import sys
+import traceback
 
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -8,24 +11,88 @@ PARENT_DIR = os.path.dirname(CURRENT_DIR)
 if PARENT_DIR not in sys.path:
     sys.path.insert(0, PARENT_DIR)
 
+import telemetry
 from resources.util import _create_single_prompt_gsm_diagram_with_sherpa_in_process
 
 
-def main() -> int:
-    if len(sys.argv) != 2:
-        print("Usage: sherpa_render_worker.py <request-json>", file=sys.stderr)
-        return 2
-
-    request_path = sys.argv[1]
+def render_once(request_path: str) -> int:
+    """Render a single request file and exit (one process per diagram)."""
     with open(request_path, "r") as f:
         payload = json.load(f)
 
     success = _create_single_prompt_gsm_diagram_with_sherpa_in_process(
         payload["mermaid_code"],
         payload["diagram_file_path"],
+        payload.get("formats", ("png",)),
     )
     return 0 if success else 1
 
 
+def serve() -> int:
+    """
+    Long-lived worker used by ``render_pool.RenderWorkerPool``.
+
+    Protocol: one JSON object per line.  The worker announces
+    ``{"ready": true}`` once the heavy imports are done, then answers each
+    ``{"id", "mermaid_code", "diagram_file_path", "formats"}`` request on stdin with
+    ``{"id", "success", "stdout", "stderr", "spans"}``, where ``spans`` are
+    the job's stage timings (see ``telemetry``).  EOF on stdin shuts it down.
+    """
+    # Keep the reply channel private.  Anything written to fd 1 afterwards
+    # (stray prints, native libraries) ends up on stderr instead of
+    # corrupting the protocol stream.
+    protocol = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+
+    # Pay the pythonmonkey / SpiderMonkey start-up cost once, up front.
+    import resources.mermaid_to_sherpa_parser  # noqa: F401
+
+    protocol.write(json.dumps({"ready": True, "pid": os.getpid()}) + "\n")
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        stdout_buf = io.StringIO()
+        stderr_buf = io.StringIO()
+        with contextlib.redirect_stdout(stdout_buf), contextlib.redirect_stderr(
+            stderr_buf
+        ), telemetry.run_trace() as trace:
+            try:
+                success = _create_single_prompt_gsm_diagram_with_sherpa_in_process(
+                    request["mermaid_code"],
+                    request["diagram_file_path"],
+                    request.get("formats", ("png",)),
+                )
+            except Exception:
+                traceback.print_exc()
+                success = False
+        protocol.write(
+            json.dumps(
+                {
+                    "id": request.get("id"),
+                    "success": bool(success),
+                    "stdout": stdout_buf.getvalue(),
+                    "stderr": stderr_buf.getvalue(),
+                    "spans": trace.snapshot(),
+                }
+            )
+            + "\n"
+        )
+    return 0
+
+
+def main() -> int:
+    if len(sys.argv) == 2 and sys.argv[1] == "--serve":
+        return serve()
+    if len(sys.argv) != 2:
+        print(
+            "Usage: sherpa_render_worker.py <request-json> | --serve",
+            file=sys.stderr,
+        )
+        return 2
+    return render_once(sys.argv[1])
+
+
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -1,4 +1,6 @@
+import asyncio
 import contextlib
+import contextvars
 import os
 import json
 import re
@@ -7,34 +9,122 @@ import sys
 import threading
 import time
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from transitions.extensions import HierarchicalGraphMachine
 import mermaid as md
 from mermaid.graph import Graph
 from sherpa_ai.memory.state_machine import SherpaStateMachine
 
+from .dot_emitter import build_state_graph, dot_backend
+from .dot_transform import DotBody
+from .llm_client import (
+    REQUEST_TIMEOUT,
+    apost,
+    astream,
+    close_async_http_client,
+    get_http_session,
+)
+from .mermaid_to_sherpa_parser import mermaid_parser_backend, parse_mermaid_with_library
+from .render_cache import get_render_cache, render_cache_enabled, render_cache_key
+from .render_pool import get_render_pool, render_pool_enabled
+
+try:
+    from .. import progress, run_index, telemetry
+except ImportError:
+    import progress
+    import run_index
+    import telemetry
+
 # DO NOT import pythonmonkey-dependent modules at module level
 # This causes segmentation faults in Chainlit's async context.
 # Instead, use lazy imports inside functions that are called via asyncio.to_thread()
+# (mermaid_to_sherpa_parser only loads mermaid-parser-py when that backend is selected).
 
 # OpenRouter API key for single prompt
 openrouter_api_key = os.environ.get("OPENROUTER_API_KEY")
 
 # pythonmonkey / SpiderMonkey is unstable under overlapping threaded access in this app.
 # Serialize Mermaid parser/render usage to avoid native crashes when requests overlap.
+# Only needed with SHERPA_MERMAID_PARSER=converter; the native parser is thread-safe.
 MERMAID_RENDER_LOCK = threading.Lock()
 
+# Part of every render cache key.  Bump whenever parsing or DOT generation
+# changes the rendered output so stale cached diagrams are not reused.
+RENDERER_VERSION = "1"
 
-def call_openrouter_llm(
-    prompt, max_tokens=15000, temperature=0.7, model="anthropic/claude-3.5-sonnet"
-):
-    """
-    Call OpenRouter API for LLM requests specifically for single prompt technique
+# Artifacts written next to ``diagram_file_path`` by a render: the ``.gv``
+# source always, plus one image per requested format.
+RENDER_FORMATS = ("svg", "png")
+RENDER_ARTIFACT_SUFFIXES = (".gv",) + tuple(f".{fmt}" for fmt in RENDER_FORMATS)
+
+_render_formats = contextvars.ContextVar("render_formats", default=None)
+
+# Blocking render calls made from async pipelines run on this bounded pool,
+# so concurrent generations never need more than a fixed number of threads.
+RENDER_THREADS = int(os.environ.get("SHERPA_RENDER_THREADS", "4"))
+_render_executor = ThreadPoolExecutor(
+    max_workers=RENDER_THREADS, thread_name_prefix="sherpa-render"
+)
+
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+MERMAID_SOLUTION_OPEN = "<mermaid_code_solution>"
+MERMAID_SOLUTION_CLOSE = "</mermaid_code_solution>"
+_CLOSED_MERMAID_FENCE = re.compile(r"```mermaid\s.*?```", re.DOTALL)
+
+
+def openrouter_streaming_enabled() -> bool:
+    return os.environ.get("OPENROUTER_STREAMING", "1").lower() not in {
+        "0",
+        "false",
+        "no",
+    }
+
+
+def mermaid_response_complete(llm_response: str, solution_tags: bool = False) -> bool:
+    """True once the response holds a closed Mermaid solution.
+
+    With ``solution_tags`` (the prompt asks for the answer inside
+    ``<mermaid_code_solution>``) only the closing tag counts, so a draft
+    ```mermaid block written before the tagged answer does not end the
+    response.  Otherwise this mirrors the precedence of
+    ``mermaidCodeSearch``: an opened tag needs its closing tag, and without
+    one a closed ```mermaid fence counts.
     """
-    import requests
+    if solution_tags or MERMAID_SOLUTION_OPEN in llm_response:
+        return MERMAID_SOLUTION_CLOSE in llm_response
+    return _CLOSED_MERMAID_FENCE.search(llm_response) is not None
+
+
+# Providers that only cache prompt prefixes marked with ``cache_control``;
+# OpenAI and DeepSeek cache any long repeated prefix on their own.
+EXPLICIT_PROMPT_CACHE_PROVIDERS = ("anthropic/", "google/")
 
-    url = "https://openrouter.ai/api/v1/chat/completions"
 
+def _user_content(prompt, cache_prefix, model):
+    """User message content, with ``cache_prefix`` marked cacheable where needed."""
+    if (
+        not cache_prefix
+        or len(prompt) <= len(cache_prefix)
+        or not prompt.startswith(cache_prefix)
+        or not model.lower().startswith(EXPLICIT_PROMPT_CACHE_PROVIDERS)
+    ):
+        return prompt
+    return [
+        {"type": "text", "text": cache_prefix, "cache_control": {"type": "ephemeral"}},
+        {"type": "text", "text": prompt[len(cache_prefix) :]},
+    ]
+
+
+def _build_openrouter_request(prompt, max_tokens, temperature, model, cache_prefix=""):
+    """Headers and JSON body shared by the sync and async OpenRouter calls.
+
+    ``cache_prefix`` is a leading part of ``prompt`` that repeats across
+    calls (e.g. the per-example grading instructions) and is worth caching
+    provider-side.
+    """
     headers = {
         "Authorization": f"Bearer {openrouter_api_key}",
         "Content-Type": "application/json",
@@ -63,17 +153,19 @@ def call_openrouter_llm(
         "model": model,
         "messages": [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
+            {"role": "user", "content": _user_content(prompt, cache_prefix, model)},
         ],
         "temperature": temperature,
         "max_tokens": max_tokens,
     }
+    return headers, data
 
-    # Hard timeout so a slow model can't hang the server indefinitely.
-    response = requests.post(url, headers=headers, json=data, timeout=300)
 
-    if response.status_code == 200:
-        result = response.json()
+def _parse_openrouter_response(status_code, text, model):
+    """Return the completion text from an OpenRouter response or raise."""
+    if status_code == 200:
+        result = json.loads(text)
+        _annotate_usage(result.get("usage"))
         message = result["choices"][0]["message"]
         content = message.get("content")
         if content is None:
@@ -85,13 +177,173 @@ def call_openrouter_llm(
             # Surface the raw response so it is easy to diagnose in LLM_log.txt.
             raise Exception(
                 f"OpenRouter returned null/empty content for model '{model}'. "
-                f"Full response: {response.text[:500]}"
+                f"Full response: {text[:500]}"
             )
         return content
     else:
         raise Exception(
-            f"OpenRouter API call failed with status {response.status_code}: {response.text}"
+            f"OpenRouter API call failed with status {status_code}: {text}"
+        )
+
+
+def _annotate_usage(usage):
+    """Copy OpenRouter token usage onto the current ``llm_call`` span."""
+    if not usage:
+        return
+    telemetry.annotate(
+        prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens"),
+    )
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached:
+        telemetry.annotate(cached_prompt_tokens=cached)
+        telemetry.inc(
+            "sherpa_llm_cached_prompt_tokens_total",
+            "Prompt tokens served from the provider's prompt cache.",
+            cached,
+        )
+    for kind in ("prompt", "completion"):
+        count = usage.get(f"{kind}_tokens")
+        if count:
+            telemetry.inc(
+                "sherpa_llm_tokens_total", "LLM tokens used.", count, kind=kind
+            )
+
+
+def call_openrouter_llm(
+    prompt,
+    max_tokens=15000,
+    temperature=0.7,
+    model="anthropic/claude-3.5-sonnet",
+    cache_prefix="",
+):
+    """
+    Call OpenRouter API for LLM requests specifically for single prompt technique
+    """
+    headers, data = _build_openrouter_request(
+        prompt, max_tokens, temperature, model, cache_prefix
+    )
+
+    with telemetry.span("llm_call", model=model, streamed=False) as span:
+        # Pooled session: reuses keep-alive connections across calls and threads.
+        response = get_http_session().post(
+            OPENROUTER_URL, headers=headers, json=data, timeout=REQUEST_TIMEOUT
+        )
+        span["request_bytes"] = len(response.request.body or b"")
+        span["response_bytes"] = len(response.content)
+        return _parse_openrouter_response(response.status_code, response.text, model)
+
+
+async def acall_openrouter_llm(
+    prompt,
+    max_tokens=15000,
+    temperature=0.7,
+    model="anthropic/claude-3.5-sonnet",
+    stream_mermaid=False,
+    cache_prefix="",
+):
+    """
+    Async variant of ``call_openrouter_llm``: awaits the completion on the
+    event loop's pooled client instead of parking a thread on it.
+
+    With ``stream_mermaid`` (and ``OPENROUTER_STREAMING`` not disabled) the
+    completion is streamed: tokens are forwarded to the run's progress scope
+    as they arrive, and the stream is cancelled as soon as the Mermaid
+    solution is closed, so the model does not keep generating.  When the
+    prompt asks for ``<mermaid_code_solution>`` tags, only the closing tag
+    ends the stream (see ``mermaid_response_complete``).
+    """
+    headers, data = _build_openrouter_request(
+        prompt, max_tokens, temperature, model, cache_prefix
+    )
+    streamed = bool(stream_mermaid and openrouter_streaming_enabled())
+    with telemetry.span(
+        "llm_call", model=model, streamed=streamed, prompt_chars=len(prompt)
+    ) as span:
+        if streamed:
+            return await _astream_openrouter_mermaid(
+                headers, data, model, MERMAID_SOLUTION_CLOSE in prompt
+            )
+        response = await apost(OPENROUTER_URL, headers=headers, json=data)
+        span["request_bytes"] = len(response.request.content)
+        span["response_bytes"] = len(response.content)
+        return _parse_openrouter_response(response.status_code, response.text, model)
+
+
+async def _astream_openrouter_mermaid(headers, data, model, solution_tags=False):
+    content = ""
+    reasoning_parts = []
+    stopped_early = False
+    response_bytes = 0
+    progress.emit_token("", reset=True)
+
+    # Ask for token usage in the final chunk (only seen if the stream runs
+    # to completion).
+    payload_data = {**data, "stream": True, "usage": {"include": True}}
+    try:
+        async with astream(
+            "POST", OPENROUTER_URL, headers=headers, json=payload_data
+        ) as response:
+            telemetry.annotate(request_bytes=len(response.request.content))
+            if response.status_code != 200:
+                body = (await response.aread()).decode("utf-8", errors="replace")
+                raise Exception(
+                    f"OpenRouter API call failed with status {response.status_code}: {body}"
+                )
+            async for line in response.aiter_lines():
+                response_bytes += len(line) + 1
+                # Skip blank separators and ": OPENROUTER PROCESSING" keep-alives.
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:") :].strip()
+                if payload == "[DONE]":
+                    break
+                chunk = json.loads(payload)
+                if chunk.get("error"):
+                    raise Exception(
+                        f"OpenRouter stream failed for model '{model}': {chunk['error']}"
+                    )
+                _annotate_usage(chunk.get("usage"))
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                delta = choices[0].get("delta") or {}
+                text = delta.get("content")
+                if not text:
+                    reasoning = delta.get("reasoning_content") or delta.get("reasoning")
+                    if reasoning:
+                        reasoning_parts.append(reasoning)
+                    continue
+                content += text
+                progress.emit_token(text)
+                # A solution can only close on a chunk carrying '>' or '`'.
+                if (">" in text or "`" in text) and mermaid_response_complete(
+                    content, solution_tags
+                ):
+                    stopped_early = True
+                    break
+            # Leaving the block closes the connection, which cancels the
+            # completion upstream when we stopped early.
+    finally:
+        # Also recorded for cancelled streams (e.g. losing speculative
+        # attempts), whose usage chunk never arrives.
+        telemetry.annotate(
+            response_bytes=response_bytes,
+            completion_chars=len(content),
+            reasoning_chars=sum(map(len, reasoning_parts)),
+            stopped_early=stopped_early,
+        )
+    if stopped_early:
+        print("Mermaid solution complete; stopped the LLM stream early")
+    if not content:
+        # Same fallback as the non-streaming path for reasoning-only output.
+        content = "".join(reasoning_parts)
+    if not content:
+        raise Exception(
+            f"OpenRouter returned null/empty content for model '{model}' "
+            "(streamed response)."
         )
+    return content
 
 
 def mermaidCodeSearch(
@@ -237,7 +489,18 @@ def setup_file_paths(
                 safe_model_name,
                 time_folder,
             )
-        os.makedirs(output_base_dir, exist_ok=True)
+        # Concurrent runs (batches, several users) can start the same system
+        # on the same model within one second; each gets its own folder.
+        run_dir, suffix = output_base_dir, 1
+        os.makedirs(os.path.dirname(run_dir), exist_ok=True)
+        while True:
+            try:
+                os.mkdir(output_base_dir)
+                break
+            except FileExistsError:
+                suffix += 1
+                output_base_dir = f"{run_dir}_{suffix}"
+        run_index.record_run(output_base_dir)
 
         # Generate file names (simpler since they're in a timestamped folder)
         file_prefix = (
@@ -260,324 +523,32 @@ def setup_file_paths(
             "grading_output_path": os.path.join(output_base_dir, "grading_output.txt"),
             "grading_csv_path": os.path.join(output_base_dir, "grading_results.csv"),
             "grading_tsv_path": os.path.join(output_base_dir, "grading_results.tsv"),
+            "grading_samples_csv_path": os.path.join(
+                output_base_dir, "grading_samples.csv"
+            ),
+            "grading_agreement_path": os.path.join(
+                output_base_dir, "grading_agreement.json"
+            ),
         }
 
 
-def fix_hierarchical_state_transitions(graph):
+def fix_hierarchical_state_transitions(graph, body=None):
     """
-    Fix GraphViz edges for two cases pytransitions doesn't handle:
-
-    1. Composite state self-loop (e.g. Active -> Active):
-       GraphViz cannot render ltail=X lhead=X on the same cluster.
-       Solution: Replace with an intermediate dot node placed in the parent
-       cluster so the arrows visually loop around the cluster boundary.
-
-    2. Composite state -> own child (e.g. Cleaning -> Cleaning_HistoryPoint):
-       ltail alone is ignored by GraphViz when the destination is inside the
-       same cluster.  Solution: route through an intermediate dot node placed
-       in the parent cluster — one arrow exits the cluster to the dot, a
-       second arrow re-enters the cluster to the specific child node.
-
-    Note: pytransitions already handles lhead (external -> composite) and
-    ltail (composite -> external), so those cases are left untouched.
+    Fix GraphViz edges for composite-state transitions pytransitions doesn't
+    handle (self-loops, composite -> own child, state -> composite ancestor);
+    see ``DotBody.fix_hierarchical_transitions`` for the cases.
 
     Args:
         graph: GraphViz Digraph object from pytransitions
+        body: Already-parsed ``DotBody`` of ``graph.body`` to edit in place
 
     Returns:
         Modified graph with fixes applied to hierarchical transitions
     """
-    import re
-    from collections import defaultdict
-
+    body = body if body is not None else DotBody(graph.body)
     try:
-        # ── Pass 1: build cluster hierarchy ───────────────────────────────────
-        # Real composite clusters (skip internal _root clusters).
-        # pytransitions names the initial-point node of cluster_X as X.
-        composite_clusters = set()
-        cluster_parent = {}  # cluster_name -> parent cluster name (or None)
-        cluster_stack = []  # all clusters incl. _root for correct brace matching
-
-        for item in graph.body:
-            m = re.search(r"subgraph\s+(cluster_\w+)", item)
-            if m:
-                cname = m.group(1)
-                parent = cluster_stack[-1] if cluster_stack else None
-                if not cname.endswith("_root"):
-                    composite_clusters.add(cname)
-                    cluster_parent[cname] = parent
-                cluster_stack.append(cname)
-            elif item.strip() == "}" and cluster_stack:
-                cluster_stack.pop()
-
-        # initial-point name -> cluster  e.g. 'Active' -> 'cluster_Active'
-        initial_to_cluster = {c[len("cluster_") :]: c for c in composite_clusters}
-
-        # ── Pass 2: identify edges to fix ─────────────────────────────────────
-        # Regex handles both quoted ("_initial") and unquoted (Active) node names.
-        edge_re = re.compile(
-            r'(\s*)("(?:[^"]+)"|[A-Za-z_]\w*)\s*->\s*("(?:[^"]+)"|[A-Za-z_][^\s\[]*)(.*)',
-            re.DOTALL,
-        )
-
-        lines_to_skip = set()  # indices of body items to drop
-        residuals = {}  # index -> trailing content to preserve
-        deferred_nodes = defaultdict(
-            list
-        )  # parent_cluster (or None) -> [node_def, ...]
-        extra_edges = []  # replacement edge strings (top-level)
-        counter = 0
-
-        for i, item in enumerate(graph.body):
-            m = edge_re.match(item)
-            if not m:
-                continue
-
-            indent = m.group(1)
-            source_raw = m.group(2)
-            target_raw = m.group(3).rstrip()
-            rest = m.group(4)
-
-            source = source_raw.strip('"')
-            target = target_raw.strip('"')
-
-            source_cluster = initial_to_cluster.get(source)
-            target_cluster = initial_to_cluster.get(target)
-            if not source_cluster and not target_cluster:
-                continue
-
-            # Skip auto-generated pytransitions initial-state edges.
-            # Inner composite initial edges use headlabel=""; the outermost composite's
-            # initial edge (e.g. Active -> Active_WashCycle produced by pytransitions
-            # when initial='WashCycle' is set) uses label="" instead.  Both must be
-            # left untouched so the [*]->Child arrow stays in the diagram.
-            if re.search(r'headlabel=""', rest) or re.search(
-                r'(?<![a-z])label=""', rest
-            ):
-                continue
-
-            # Extract just this edge's attribute block; anything after belongs to
-            # a second statement packed in the same body item by pytransitions.
-            edge_attrs, after_edge = rest, ""
-            bracket_depth = 0
-            for idx, ch in enumerate(rest):
-                if ch == "[":
-                    bracket_depth += 1
-                elif ch == "]":
-                    bracket_depth -= 1
-                    if bracket_depth == 0:
-                        edge_attrs = rest[: idx + 1]
-                        after_edge = rest[idx + 1 :]
-                        break
-
-            if not source_cluster:
-                # ── Case 3b: non-composite → composite ancestor ────────────────
-                # pytransitions emits no lhead when the source lives inside the
-                # destination cluster (e.g. Printing → LoggedIn).  Adding lhead
-                # alone doesn't work because GraphViz ignores lhead when the tail
-                # is also inside the same cluster.  Use an intermediate dot placed
-                # outside the target cluster so the arrow forms a clean self-loop
-                # on the target cluster's outer boundary (same trick as Case 1).
-                if target_cluster and source.startswith(target + "_"):
-                    node_name = f"_escape_{target}_{counter}"
-                    counter += 1
-                    target_parent_cluster = cluster_parent.get(target_cluster)
-                    deferred_nodes[target_parent_cluster].append(
-                        f'\t"{node_name}" '
-                        f'[shape=point width=0 height=0 style=invis label=""]'
-                    )
-                    clean = re.sub(r"\bltail=[^\s\]]+\s*", "", edge_attrs).strip()
-                    clean = re.sub(r"\blhead=[^\s\]]+\s*", "", clean).strip()
-                    # Clean merged labels from pytransitions (e.g. "reset | " → "reset")
-                    clean = re.sub(r'\s*\|\s*"', '"', clean)
-                    clean = re.sub(r'="\s*\|\s*', '="', clean)
-                    # No ltail needed: source is a leaf node (non-composite),
-                    # so the edge should start directly from the source node
-                    # rather than being clipped at a cluster boundary.
-                    if clean.startswith("["):
-                        out_attrs = clean[:-1] + " dir=none]"
-                    elif clean:
-                        out_attrs = "[" + clean.strip("[]") + " dir=none]"
-                    else:
-                        out_attrs = "[dir=none]"
-                    # Edge 1: source node → dot (no arrowhead)
-                    extra_edges.append(
-                        f'{indent}{source_raw} -> "{node_name}" {out_attrs}'
-                    )
-                    # Edge 2: dot → arrowhead re-enters target cluster boundary
-                    extra_edges.append(
-                        f'{indent}"{node_name}" -> {target_raw} '
-                        f"[lhead={target_cluster} constraint=false]"
-                    )
-                    lines_to_skip.add(i)
-                    if after_edge.strip():
-                        residuals[i] = "\t" + after_edge.lstrip("\t ")
-                continue
-
-            cluster_prefix = source
-            parent_cluster = cluster_parent.get(source_cluster)  # None = top level
-
-            # Strip any previously-added ltail/lhead from edge_attrs (clean slate).
-            # lhead belongs only on Edge 2 (dot → target); keeping it on Edge 1
-            # (source → dot) clips the edge at a cluster boundary the dot is
-            # outside of, causing GraphViz to mis-route the arrow.
-            clean_attrs = re.sub(r"\bltail=[^\s\]]+\s*", "", edge_attrs).strip()
-            clean_attrs = re.sub(r"\blhead=[^\s\]]+\s*", "", clean_attrs).strip()
-            # Clean merged labels from pytransitions (e.g. "reset | " → "reset")
-            clean_attrs = re.sub(r'\s*\|\s*"', '"', clean_attrs)
-            clean_attrs = re.sub(r'="\s*\|\s*', '="', clean_attrs)
-
-            if source == target:
-                # ── Case 1: self-loop on composite ────────────────────────────
-                node_name = f"_selfloop_{source}_{counter}"
-                counter += 1
-
-                # Dot node goes in the parent cluster (inside Active for Cleaning,
-                # at top level for Active itself).
-                deferred_nodes[parent_cluster].append(
-                    f'\t"{node_name}" '
-                    f'[shape=point width=0 height=0 style=invis label=""]'
-                )
-
-                if clean_attrs.startswith("["):
-                    out_attrs = "[ltail=" + source_cluster + " " + clean_attrs[1:]
-                elif clean_attrs:
-                    out_attrs = (
-                        "[ltail=" + source_cluster + " " + clean_attrs.strip("[]") + "]"
-                    )
-                else:
-                    out_attrs = f"[ltail={source_cluster}]"
-
-                # Edge 1: cluster boundary ──(label)──> dot  (no arrowhead)
-                extra_edges.append(
-                    f'{indent}{source_raw} -> "{node_name}" {out_attrs[:-1]} dir=none]'
-                    if out_attrs.endswith("]")
-                    else f'{indent}{source_raw} -> "{node_name}" {out_attrs} [dir=none]'
-                )
-                # Edge 2: dot ──> cluster boundary (constraint=false avoids
-                # pushing the dot node out of the parent cluster rank)
-                extra_edges.append(
-                    f'{indent}"{node_name}" -> {target_raw} '
-                    f"[lhead={source_cluster} constraint=false]"
-                )
-
-                lines_to_skip.add(i)
-                if after_edge.strip():
-                    residuals[i] = "\t" + after_edge.lstrip("\t ")
-
-            elif target.startswith(cluster_prefix + "_"):
-                # ── Case 2: composite -> own child ────────────────────────────
-                # ltail is silently ignored by GraphViz when the destination is
-                # inside the ltail cluster.  Route through an intermediate dot.
-                node_name = f"_entry_{source}_{counter}"
-                counter += 1
-
-                deferred_nodes[parent_cluster].append(
-                    f'\t"{node_name}" '
-                    f'[shape=point width=0 height=0 style=invis label=""]'
-                )
-
-                if clean_attrs.startswith("["):
-                    out_attrs = "[ltail=" + source_cluster + " " + clean_attrs[1:]
-                elif clean_attrs:
-                    out_attrs = (
-                        "[ltail=" + source_cluster + " " + clean_attrs.strip("[]") + "]"
-                    )
-                else:
-                    out_attrs = f"[ltail={source_cluster}]"
-
-                # Edge 1: cluster boundary ──(label)──> dot  (no arrowhead)
-                extra_edges.append(
-                    f'{indent}{source_raw} -> "{node_name}" {out_attrs[:-1]} dir=none]'
-                    if out_attrs.endswith("]")
-                    else f'{indent}{source_raw} -> "{node_name}" {out_attrs} [dir=none]'
-                )
-                # Edge 2: dot ──> target child (enters the cluster).
-                # If the child is itself composite, add lhead so the arrowhead
-                # stops at the cluster border rather than the inner black dot.
-                target_child_cluster = initial_to_cluster.get(target)
-                if target_child_cluster:
-                    extra_edges.append(
-                        f'{indent}"{node_name}" -> {target_raw} '
-                        f"[lhead={target_child_cluster} constraint=false]"
-                    )
-                else:
-                    extra_edges.append(f'{indent}"{node_name}" -> {target_raw}')
-
-                lines_to_skip.add(i)
-                if after_edge.strip():
-                    residuals[i] = "\t" + after_edge.lstrip("\t ")
-
-            elif target_cluster and source.startswith(target + "_"):
-                # ── Case 3a: composite → composite ancestor ────────────────────
-                # e.g. LoggedIn → On.  pytransitions adds ltail but not lhead
-                # when dest is an ancestor of source.  lhead alone also fails
-                # because the source is inside the lhead cluster.  Use the same
-                # intermediate-dot self-loop approach as Case 1.
-                node_name = f"_escape_{target}_{counter}"
-                counter += 1
-                target_parent_cluster = cluster_parent.get(target_cluster)
-                deferred_nodes[target_parent_cluster].append(
-                    f'\t"{node_name}" '
-                    f'[shape=point width=0 height=0 style=invis label=""]'
-                )
-                if clean_attrs.startswith("["):
-                    out_attrs = "[ltail=" + source_cluster + " " + clean_attrs[1:]
-                elif clean_attrs:
-                    out_attrs = (
-                        "[ltail=" + source_cluster + " " + clean_attrs.strip("[]") + "]"
-                    )
-                else:
-                    out_attrs = f"[ltail={source_cluster}]"
-                # Edge 1: tail exits source cluster boundary (no arrowhead)
-                extra_edges.append(
-                    f'{indent}{source_raw} -> "{node_name}" {out_attrs[:-1]} dir=none]'
-                    if out_attrs.endswith("]")
-                    else f'{indent}{source_raw} -> "{node_name}" {out_attrs} [dir=none]'
-                )
-                # Edge 2: dot → arrowhead re-enters target cluster boundary
-                extra_edges.append(
-                    f'{indent}"{node_name}" -> {target_raw} '
-                    f"[lhead={target_cluster} constraint=false]"
-                )
-                lines_to_skip.add(i)
-                if after_edge.strip():
-                    residuals[i] = "\t" + after_edge.lstrip("\t ")
-
-        # ── Pass 3: rebuild body, inject dot nodes at correct cluster boundaries ─
-        fixed_body = []
-        cluster_stack_build = []
-
-        for i, item in enumerate(graph.body):
-            if i in lines_to_skip:
-                # Preserve any secondary statement packed in the same body item.
-                if i in residuals:
-                    fixed_body.append(residuals[i])
-                continue
-
-            m = re.search(r"subgraph\s+(cluster_\w+)", item)
-            if m:
-                cluster_stack_build.append(m.group(1))
-                fixed_body.append(item)
-                continue
-
-            if item.strip() == "}" and cluster_stack_build:
-                closing = cluster_stack_build[-1]
-                cluster_stack_build.pop()
-                # Inject dot nodes deferred to this cluster before its closing brace.
-                if closing in deferred_nodes:
-                    fixed_body.extend(deferred_nodes[closing])
-                fixed_body.append(item)
-                continue
-
-            fixed_body.append(item)
-
-        # Top-level dot nodes (for root-level composite self-loops / own-child).
-        fixed_body.extend(deferred_nodes.get(None, []))
-        # All replacement edges go at the top level.
-        fixed_body.extend(extra_edges)
-
-        graph.body = fixed_body
+        body.fix_hierarchical_transitions()
+        graph.body = body.render()
 
         # compound=true is required for lhead/ltail to take effect.
         graph.graph_attr["compound"] = "true"
@@ -593,25 +564,198 @@ def fix_hierarchical_state_transitions(graph):
     return graph
 
 
+def _collect_parallel_composite_paths(states, prefix=""):
+    """Full paths of the composites in ``states`` that are split into regions."""
+    paths = set()
+    for st in states:
+        if not isinstance(st, dict):
+            continue
+        name = st.get("name")
+        if not name:
+            continue
+        full_name = f"{prefix}_{name}" if prefix else name
+        if isinstance(st.get("initial"), list):
+            paths.add(full_name)
+        paths.update(_collect_parallel_composite_paths(st.get("children", []), full_name))
+    return paths
+
+
+def _build_diagram_graph(
+    states_list,
+    transitions_list,
+    initial_state,
+    root_initial_state,
+    nested_initial_states,
+    parallel_composite_paths,
+):
+    """GraphViz graph for a parsed diagram, built by the configured ``dot_backend``."""
+    if dot_backend() == "direct":
+        build_started = time.perf_counter()
+        graph = build_state_graph(
+            states_list,
+            transitions_list,
+            initial_state,
+            root_initial_state,
+            nested_initial_states,
+            parallel_composite_paths,
+        )
+        telemetry.record("build_graph", build_started, dot_backend="direct")
+        return graph
+    return _build_sherpa_graph(
+        states_list,
+        transitions_list,
+        initial_state,
+        root_initial_state,
+        nested_initial_states,
+        parallel_composite_paths,
+    )
+
+
+def _build_sherpa_graph(
+    states_list,
+    transitions_list,
+    initial_state,
+    root_initial_state,
+    nested_initial_states,
+    parallel_composite_paths,
+):
+    """pytransitions graph for a parsed diagram, with the DOT fixes applied."""
+    build_started = time.perf_counter()
+    gsm = SherpaStateMachine(
+        states=states_list,
+        transitions=transitions_list,
+        initial=initial_state,
+        sm_cls=HierarchicalGraphMachine,
+    )
+
+    try:
+        node_defaults = gsm.sm.style_attributes.get("node", {}).get("default", {}).copy()
+        graph_defaults = (
+            gsm.sm.style_attributes.get("graph", {}).get("default", {}).copy()
+        )
+        gsm.sm.style_attributes.setdefault("node", {})["active"] = node_defaults
+        gsm.sm.style_attributes.setdefault("graph", {})["active"] = graph_defaults
+    except Exception:
+        pass
+
+    graph = gsm.sm.get_graph()
+    telemetry.record("build_graph", build_started)
+    transform_started = time.perf_counter()
+    body = DotBody(graph.body)
+    graph = fix_hierarchical_state_transitions(graph, body)
+
+    try:
+        body.add_initial_state_markers(
+            root_initial_state, nested_initial_states, parallel_composite_paths
+        )
+        graph.body = body.render()
+    except Exception as e:
+        print(f"Warning: Could not add initial state markers: {e}")
+        import traceback
+
+        traceback.print_exc()
+    telemetry.record("dot_transform", transform_started)
+    return graph
+
+
+def _validate_render_formats(formats, source):
+    formats = tuple(dict.fromkeys(f.strip().lower() for f in formats if f.strip()))
+    if formats == ("none",):
+        return ()
+    unknown = [f for f in formats if f not in RENDER_FORMATS]
+    if unknown:
+        raise ValueError(
+            f"{source} must be a subset of {RENDER_FORMATS} (or 'none'), got {unknown!r}"
+        )
+    return formats
+
+
+def default_render_formats():
+    """Image formats drawn next to each ``.gv`` unless a run overrides them.
+
+    ``SHERPA_RENDER_FORMATS`` is a comma-separated list; the default ``svg``
+    leaves PNGs to ``rasterize_png``, and ``none`` writes only the DOT source.
+    """
+    return _validate_render_formats(
+        os.environ.get("SHERPA_RENDER_FORMATS", "svg").split(","),
+        "SHERPA_RENDER_FORMATS",
+    )
+
+
+def current_render_formats():
+    formats = _render_formats.get()
+    return default_render_formats() if formats is None else formats
+
+
+def rendered_diagram_path(diagram_file_path):
+    """Main artifact a render in this context leaves at ``diagram_file_path``."""
+    formats = current_render_formats()
+    return f"{diagram_file_path}.{formats[0] if formats else 'gv'}"
+
+
+@contextlib.contextmanager
+def render_formats_scope(formats):
+    """Draw ``formats`` for every render started in this context.
+
+    ``None`` keeps the default; ``()`` skips drawing (batch / grading-only
+    runs that only need the ``.gv``).
+    """
+    if formats is None:
+        yield
+        return
+    token = _render_formats.set(_validate_render_formats(formats, "render_formats"))
+    try:
+        yield
+    finally:
+        _render_formats.reset(token)
+
+
+def rasterize_png(gv_path):
+    """Return the PNG for a rendered ``.gv``, drawing it on first request.
+
+    The PNG is written next to the ``.gv`` (atomically, so concurrent
+    requests never serve a partial file) and reused from then on.
+    """
+    import graphviz
+
+    png_path = os.path.splitext(gv_path)[0] + ".png"
+    if os.path.isfile(png_path):
+        return png_path
+    draw_started = time.perf_counter()
+    data = graphviz.Source.from_file(gv_path).pipe(format="png")
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(png_path), suffix=".png.tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, png_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        raise
+    telemetry.record("draw", draw_started, format="png", lazy=True, bytes=len(data))
+    return png_path
+
+
 def _create_single_prompt_gsm_diagram_with_sherpa_in_process(
-    mermaid_code: str, diagram_file_path: str
+    mermaid_code: str, diagram_file_path: str, formats=("svg",)
 ):
     """
     Create a state machine diagram from Mermaid code using Sherpa
 
     params:
     mermaid_code: The Mermaid stateDiagram-v2 code as a string
-    diagram_file_path: Path where to save the PNG diagram
+    diagram_file_path: Path stem for the ``.gv`` source and drawn images
+    formats: Image formats to draw (subset of ``RENDER_FORMATS``)
     """
-    with MERMAID_RENDER_LOCK:
-        try:
-            from .mermaid_to_sherpa_parser import parse_mermaid_with_library
-        except (ImportError, KeyError):
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            if current_dir not in sys.path:
-                sys.path.insert(0, current_dir)
-            from mermaid_to_sherpa_parser import parse_mermaid_with_library
-
+    parser_lock = (
+        MERMAID_RENDER_LOCK
+        if mermaid_parser_backend() == "converter"
+        else contextlib.nullcontext()
+    )
+    lock_wait_started = time.perf_counter()
+    with parser_lock:
+        telemetry.record("render_lock_wait", lock_wait_started)
+        parse_started = time.perf_counter()
         (
             states_list,
             transitions_list,
@@ -623,22 +767,7 @@ def _create_single_prompt_gsm_diagram_with_sherpa_in_process(
             nested_initial_states,
             state_declarations_map,
         ) = parse_mermaid_with_library(mermaid_code)
-
-        def _collect_parallel_composite_paths(states, prefix=""):
-            paths = set()
-            for st in states:
-                if not isinstance(st, dict):
-                    continue
-                name = st.get("name")
-                if not name:
-                    continue
-                full_name = f"{prefix}_{name}" if prefix else name
-                if isinstance(st.get("initial"), list):
-                    paths.add(full_name)
-                paths.update(
-                    _collect_parallel_composite_paths(st.get("children", []), full_name)
-                )
-            return paths
+        telemetry.record("parse", parse_started, transitions=len(transitions_list))
 
         parallel_composite_paths = _collect_parallel_composite_paths(states_list)
 
@@ -677,238 +806,18 @@ def _create_single_prompt_gsm_diagram_with_sherpa_in_process(
                 raise ValueError("No states found in Mermaid diagram")
 
         try:
-            gsm = SherpaStateMachine(
-                states=states_list,
-                transitions=transitions_list,
-                initial=initial_state,
-                sm_cls=HierarchicalGraphMachine,
-            )
-
-            try:
-                node_defaults = (
-                    gsm.sm.style_attributes.get("node", {}).get("default", {}).copy()
-                )
-                graph_defaults = (
-                    gsm.sm.style_attributes.get("graph", {}).get("default", {}).copy()
-                )
-                gsm.sm.style_attributes.setdefault("node", {})["active"] = node_defaults
-                gsm.sm.style_attributes.setdefault("graph", {})[
-                    "active"
-                ] = graph_defaults
-            except Exception:
-                pass
-
-            png_file_path = (
-                f"{diagram_file_path}.png"
-                if not diagram_file_path.endswith(".png")
-                else diagram_file_path
+            if diagram_file_path.endswith(".png"):
+                diagram_file_path = diagram_file_path[: -len(".png")]
+
+            graph = _build_diagram_graph(
+                states_list,
+                transitions_list,
+                initial_state,
+                root_initial_state,
+                nested_initial_states,
+                parallel_composite_paths,
             )
 
-            graph = gsm.sm.get_graph()
-            graph = fix_hierarchical_state_transitions(graph)
-
-            try:
-                new_body = []
-                current_subgraphs = []
-                i = 0
-                while i < len(graph.body):
-                    line = graph.body[i]
-                    if "subgraph" in line:
-                        match = re.search(r"subgraph\s+(\S+)", line)
-                        if match:
-                            subgraph_name = match.group(1)
-                            indent_match = re.match(r"(\s*)", line)
-                            indent_level = (
-                                len(indent_match.group(1)) if indent_match else 0
-                            )
-                            current_subgraphs.append((subgraph_name, indent_level))
-                            new_body.append(line)
-                            i += 1
-                            continue
-
-                    if line.strip() == "}":
-                        if current_subgraphs:
-                            indent_match = re.match(r"(\s*)", line)
-                            current_indent = (
-                                len(indent_match.group(1)) if indent_match else 0
-                            )
-                            while (
-                                current_subgraphs
-                                and current_subgraphs[-1][1] >= current_indent
-                            ):
-                                current_subgraphs.pop()
-
-                    new_body.append(line)
-                    i += 1
-
-                if root_initial_state:
-                    insert_index = 0
-                    for idx, line in enumerate(new_body):
-                        if (
-                            "digraph" in line
-                            or "graph [" in line
-                            or "node [" in line
-                            or "edge [" in line
-                        ):
-                            insert_index = idx + 1
-                        elif "subgraph" in line:
-                            break
-
-                    root_marker = "_initial"
-                    new_body.insert(
-                        insert_index,
-                        f'\t"{root_marker}" [fillcolor=black color=black height=0.15 label="" shape=point width=0.15]',
-                    )
-
-                    root_cluster = f"cluster_{root_initial_state}"
-                    cluster_names_in_graph = [
-                        re.search(r"subgraph\s+(\S+)", l).group(1)
-                        for l in new_body
-                        if "subgraph" in l and re.search(r"subgraph\s+(\S+)", l)
-                    ]
-                    if root_cluster in cluster_names_in_graph:
-                        new_body.insert(
-                            insert_index + 1,
-                            f'\t"{root_marker}" -> "{root_initial_state}" [lhead={root_cluster}]',
-                        )
-                    else:
-                        new_body.insert(
-                            insert_index + 1,
-                            f'\t"{root_marker}" -> "{root_initial_state}"',
-                        )
-
-                # Inject [*]→Child initial-state edges for nested composites.
-                # pytransitions merges [*]→Child with regular transitions that
-                # target the same child (e.g. "reset | ").  When Case 2 of
-                # fix_hierarchical_state_transitions replaces that merged edge
-                # with an intermediate-dot pair, the composite's entry black dot
-                # loses its outgoing edge.  Re-inject it here using
-                # nested_initial_states from the parser.
-                if nested_initial_states:
-                    _cluster_names_set = {
-                        m.group(1)
-                        for l in new_body
-                        for m in [re.search(r"subgraph\s+(\S+)", l)]
-                        if m
-                    }
-                    for _parent_id, _child_bare in nested_initial_states.items():
-                        _child_full = f"{_parent_id}_{_child_bare}"
-
-                        # For parallel composites, pytransitions does not
-                        # create an initial point node inside the cluster.
-                        # We must create one explicitly so the black dot
-                        # is visible.
-                        if _parent_id in parallel_composite_paths:
-                            _init_node = f"_initial_{_parent_id}"
-                            _parent_cluster = f"cluster_{_parent_id}"
-                            # Insert the point node inside the parent's
-                            # cluster subgraph (right after the subgraph
-                            # opening line).
-                            for _idx, _line in enumerate(new_body):
-                                if "subgraph" in _line and re.search(
-                                    rf"subgraph\s+{re.escape(_parent_cluster)}\b",
-                                    _line,
-                                ):
-                                    new_body.insert(
-                                        _idx + 1,
-                                        f'\t\t"{_init_node}" [fillcolor=black color=black height=0.15 label="" shape=point width=0.15]',
-                                    )
-                                    break
-                            _child_cluster = f"cluster_{_child_full}"
-                            if _child_cluster in _cluster_names_set:
-                                new_body.append(
-                                    f'\t"{_init_node}" -> "{_child_full}" '
-                                    f'[headlabel="" lhead={_child_cluster}]'
-                                )
-                            else:
-                                new_body.append(
-                                    f'\t"{_init_node}" -> "{_child_full}" [headlabel=""]'
-                                )
-                            continue
-
-                        _pat = re.compile(
-                            rf'"?{re.escape(_parent_id)}"?\s*->\s*"?{re.escape(_child_full)}"?'
-                        )
-                        if not any(_pat.search(l) for l in new_body):
-                            _child_cluster = f"cluster_{_child_full}"
-                            if _child_cluster in _cluster_names_set:
-                                new_body.append(
-                                    f'\t"{_parent_id}" -> "{_child_full}" '
-                                    f'[headlabel="" lhead={_child_cluster}]'
-                                )
-                            else:
-                                new_body.append(
-                                    f'\t"{_parent_id}" -> "{_child_full}" [headlabel=""]'
-                                )
-
-                point_node_re = re.compile(
-                    r'^\s*"?([A-Za-z_][A-Za-z0-9_]*)"?\s*\[.*\bshape=point\b.*\]'
-                )
-                edge_re = re.compile(
-                    r'^\s*("?[A-Za-z_][A-Za-z0-9_]*"?)\s*->\s*("?[A-Za-z_][^\s\[]*"?)'
-                )
-                point_nodes = set()
-                nodes_with_edges = set()
-
-                for body_line in new_body:
-                    m_node = point_node_re.match(body_line)
-                    if m_node:
-                        point_nodes.add(m_node.group(1))
-
-                    m_edge = edge_re.match(body_line)
-                    if m_edge:
-                        src = m_edge.group(1).strip('"')
-                        dst = m_edge.group(2).strip('"')
-                        nodes_with_edges.add(src)
-                        nodes_with_edges.add(dst)
-
-                for node_name in sorted(point_nodes - nodes_with_edges):
-                    new_body.append(
-                        f'\t"{node_name}" [style=invis width=0 height=0 label=""]'
-                    )
-
-                for node_name in sorted(parallel_composite_paths):
-                    new_body.append(
-                        f'\t"{node_name}" [style=invis width=0 height=0 label=""]'
-                    )
-
-                # Hide initial point nodes for composite states that have no
-                # [*] --> child in the mermaid source.  pytransitions always
-                # creates a visible black-dot point node inside cluster_X_root
-                # for every composite X, even when no initial state was declared.
-                # We keep the node (it serves as an edge anchor for ltail) but
-                # make it invisible.
-                _composites_with_initial = set(nested_initial_states.keys())
-                _in_root_sg = False
-                _hide_current = False
-                for _bi in range(len(new_body)):
-                    _line = new_body[_bi]
-                    _root_match = re.search(r"subgraph\s+cluster_(\S+)_root\b", _line)
-                    if _root_match:
-                        _composite_name = _root_match.group(1)
-                        _in_root_sg = True
-                        _hide_current = _composite_name not in _composites_with_initial
-                        continue
-                    if _in_root_sg and _line.strip() == "}":
-                        _in_root_sg = False
-                        _hide_current = False
-                        continue
-                    if _in_root_sg and _hide_current and "shape=point" in _line:
-                        _node_match = re.match(r"(\s*)(\S+)\s*\[", _line)
-                        if _node_match:
-                            _indent = _node_match.group(1)
-                            _nname = _node_match.group(2)
-                            new_body[_bi] = (
-                                f'{_indent}{_nname} [style=invis width=0 height=0 label=""]'
-                            )
-
-                graph.body = new_body
-            except Exception as e:
-                print(f"Warning: Could not add initial state markers: {e}")
-                import traceback
-
-                traceback.print_exc()
-
             if state_annotations:
                 annotation_text = "\\l".join(state_annotations) + "\\l"
                 graph.graph_attr["label"] = annotation_text
@@ -916,13 +825,20 @@ def _create_single_prompt_gsm_diagram_with_sherpa_in_process(
                 graph.graph_attr["labeljust"] = "l"
                 graph.graph_attr["fontsize"] = "10"
 
-            gv_debug_path = png_file_path.replace(".png", ".gv")
+            gv_debug_path = f"{diagram_file_path}.gv"
             with open(gv_debug_path, "w") as f:
                 f.write(graph.source)
             print(f"GraphViz source saved to: {gv_debug_path}")
 
-            graph.draw(png_file_path, prog="dot", format="png")
-            print(f"Sherpa diagram saved to: {png_file_path}")
+            for fmt in formats:
+                draw_started = time.perf_counter()
+                output_path = f"{diagram_file_path}.{fmt}"
+                with open(output_path, "wb") as f:
+                    f.write(graph.pipe(format=fmt))
+                telemetry.record(
+                    "draw", draw_started, format=fmt, bytes=os.path.getsize(output_path)
+                )
+                print(f"Sherpa diagram saved to: {output_path}")
             return True
         except Exception as e:
             print(f"Error creating Sherpa state machine: {str(e)}")
@@ -933,12 +849,122 @@ def _create_single_prompt_gsm_diagram_with_sherpa_in_process(
 
 
 def create_single_prompt_gsm_diagram_with_sherpa(
-    mermaid_code: str, diagram_file_path: str
+    mermaid_code: str, diagram_file_path: str, formats=None
 ):
     """
-    Run Mermaid parsing/rendering in a child process so native parser crashes
+    Run Mermaid parsing/rendering out of process so native parser crashes
     do not take down the main backend process.
+
+    Jobs go to the pre-warmed render worker pool; set ``SHERPA_RENDER_POOL=0``
+    to spawn a fresh worker per diagram instead.  Diagrams whose normalized
+    Mermaid source was rendered before are served from the render cache.
+
+    Always writes ``<diagram_file_path>.gv``; ``formats`` (default: the
+    ``render_formats_scope`` in effect) picks the images drawn next to it.
     """
+    diagram_file_path = (
+        diagram_file_path[: -len(".png")]
+        if diagram_file_path.endswith(".png")
+        else diagram_file_path
+    )
+    formats = (
+        current_render_formats()
+        if formats is None
+        else _validate_render_formats(formats, "formats")
+    )
+    with telemetry.span(
+        "render", mermaid_bytes=len(mermaid_code), formats=",".join(formats)
+    ) as span:
+        success = _render_diagram(mermaid_code, diagram_file_path, formats)
+        span["success"] = bool(success)
+        return success
+
+
+def _render_diagram(mermaid_code, diagram_file_path, formats):
+    cache = get_render_cache() if render_cache_enabled() else None
+    cache_key = (
+        render_cache_key(
+            mermaid_code,
+            f"{RENDERER_VERSION}-{mermaid_parser_backend()}-{dot_backend()}",
+        )
+        if cache
+        else None
+    )
+    required = (".gv",) + tuple(f".{fmt}" for fmt in formats)
+    if cache and cache.restore(cache_key, diagram_file_path, required):
+        telemetry.annotate(cache_hit=True)
+        print(f"Render cache hit ({cache_key[:12]}): reused cached diagram")
+        for suffix in required[1:]:
+            print(f"Sherpa diagram saved to: {diagram_file_path}{suffix}")
+        return True
+    telemetry.annotate(cache_hit=False)
+
+    if not render_pool_enabled():
+        success = _create_single_prompt_gsm_diagram_in_subprocess(
+            mermaid_code, diagram_file_path, formats
+        )
+    else:
+        success, stdout, stderr = get_render_pool().render(
+            mermaid_code, diagram_file_path, formats
+        )
+        if stdout:
+            print(stdout, end="" if stdout.endswith("\n") else "\n")
+        if stderr:
+            print(
+                stderr,
+                file=sys.stderr,
+                end="" if stderr.endswith("\n") else "\n",
+            )
+
+    if success and cache:
+        cache.store(cache_key, diagram_file_path, RENDER_ARTIFACT_SUFFIXES)
+    return success
+
+
+async def acreate_single_prompt_gsm_diagram_with_sherpa(
+    mermaid_code: str, diagram_file_path: str, formats=None
+):
+    """Await ``create_single_prompt_gsm_diagram_with_sherpa`` on the render executor.
+
+    The caller's context is copied so progress output and its
+    ``render_formats_scope`` still apply.
+    """
+    return await run_blocking(
+        create_single_prompt_gsm_diagram_with_sherpa,
+        mermaid_code,
+        diagram_file_path,
+        formats,
+    )
+
+
+async def run_blocking(func, *args):
+    """Run a blocking call on the bounded render executor in the caller's context."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _render_executor, context.run, func, *args
+    )
+
+
+def run_sync(coro):
+    """Run an async pipeline to completion from synchronous code.
+
+    Each call gets its own event loop, so its pooled HTTP client is closed
+    before the loop goes away.
+    """
+
+    async def _main():
+        try:
+            return await coro
+        finally:
+            await close_async_http_client()
+
+    return asyncio.run(_main())
+
+
+def _create_single_prompt_gsm_diagram_in_subprocess(
+    mermaid_code: str, diagram_file_path: str, formats
+):
+    """Render in a one-shot ``sherpa_render_worker.py`` child process."""
     worker_script = os.path.join(
         os.path.dirname(os.path.abspath(__file__)), "sherpa_render_worker.py"
     )
@@ -949,6 +975,7 @@ def create_single_prompt_gsm_diagram_with_sherpa(
             {
                 "mermaid_code": mermaid_code,
                 "diagram_file_path": diagram_file_path,
+                "formats": list(formats),
             },
             request_file,
         )
@@ -0,0 +1,117 @@
+"""In-memory registry of the ground-truth grading rubrics.
+
+Every grading call needs the example's rubric CSV (parsed into rows) and
+the static head of the grading prompt (instructions, system description
+and reference solution).  Neither changes between runs, so the registry
+loads and parses each ``ground_truth_grading/*.csv`` once and builds the
+prompt prefix alongside it.
+
+Edits are still picked up without a restart: every lookup compares the
+file's mtime and size with the loaded copy and reloads it when they
+differ.  A ``stat`` is all a cached lookup costs.
+"""
+
+from __future__ import annotations
+
+import glob
+import os
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from resources import state_machine_descriptions as sm_descriptions
+from resources.n_shot_examples_single_prompt_mermaid import get_example_mermaid_code
+from resources.prompts.single_prompt.grading_prompt_template import (
+    build_grading_prompt_prefix,
+)
+
+ParseRows = Callable[[str], tuple[list[str], list[dict[str, str]]]]
+
+
+@dataclass(frozen=True)
+class Rubric:
+    example_key: str
+    path: str
+    csv_text: str
+    fieldnames: tuple[str, ...]
+    rows: tuple[tuple[tuple[str, str], ...], ...]
+    reference_mermaid: str
+    system_description: Optional[str]
+    stamp: tuple[int, int]
+    _prefix: str
+
+    def copy_rows(self) -> list[dict[str, str]]:
+        """Fresh row dicts; callers may mutate them."""
+        return [dict(row) for row in self.rows]
+
+    def prompt_prefix(self, system_description: str) -> str:
+        """Grading prompt prefix for ``system_description``.
+
+        The example's own description is prebuilt; any other (edited)
+        description gets a prefix built on the spot.
+        """
+        if system_description == self.system_description:
+            return self._prefix
+        return build_grading_prompt_prefix(self.reference_mermaid, system_description)
+
+
+class RubricRegistry:
+    def __init__(self, directory: str, parse_rows: ParseRows):
+        self.directory = directory
+        self._parse_rows = parse_rows
+        self._rubrics: dict[str, Rubric] = {}
+        self._lock = threading.Lock()
+
+    def path_for(self, example_key: str) -> str:
+        return os.path.join(self.directory, f"{example_key}.csv")
+
+    def get(self, example_key: str) -> Optional[Rubric]:
+        """The rubric for ``example_key``, or None when it has no CSV."""
+        path = self.path_for(example_key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._rubrics.pop(example_key, None)
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            rubric = self._rubrics.get(example_key)
+            if rubric is not None and rubric.stamp == stamp:
+                return rubric
+        rubric = self._load(example_key, path, stamp)
+        with self._lock:
+            self._rubrics[example_key] = rubric
+        return rubric
+
+    def preload(self) -> list[str]:
+        """Load every rubric in the directory; returns their example keys."""
+        keys = sorted(
+            os.path.splitext(os.path.basename(path))[0]
+            for path in glob.glob(os.path.join(self.directory, "*.csv"))
+        )
+        return [key for key in keys if self.get(key) is not None]
+
+    def _load(self, example_key: str, path: str, stamp: tuple[int, int]) -> Rubric:
+        with open(path, "r") as f:
+            csv_text = f.read()
+        fieldnames, rows = self._parse_rows(csv_text)
+        reference_mermaid = get_example_mermaid_code(example_key) or ""
+        system_description = getattr(sm_descriptions, example_key, None)
+        if not isinstance(system_description, str):
+            system_description = None
+        return Rubric(
+            example_key=example_key,
+            path=path,
+            csv_text=csv_text,
+            fieldnames=tuple(fieldnames),
+            rows=tuple(tuple(row.items()) for row in rows),
+            reference_mermaid=reference_mermaid,
+            system_description=system_description,
+            stamp=stamp,
+            _prefix=(
+                build_grading_prompt_prefix(reference_mermaid, system_description)
+                if system_description is not None
+                else ""
+            ),
+        )
@@ -0,0 +1,281 @@
+"""SQLite index of run folders backing ``/api/history``.
+
+Every run folder lives at
+``resources/<strategy>_outputs/<date>/<model>/<system>/<time>``.  Instead
+of walking that tree on every history poll, ``setup_file_paths`` records
+each new folder here and ``errors.write_status`` keeps its status current,
+so history queries are a single indexed ``SELECT``.  Rows whose folder has
+been deleted are dropped when a query returns them.
+
+Existing output trees can be (re)indexed with::
+
+    python backend/run_index.py reindex
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
+
+STRATEGIES = (
+    "single_prompt",
+    "two_stage_prompt",
+    "mermaid_compiler",
+    "automatic_grader",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    folder      TEXT PRIMARY KEY,
+    strategy    TEXT NOT NULL,
+    date        TEXT NOT NULL,
+    time        TEXT NOT NULL,
+    model       TEXT NOT NULL,
+    system      TEXT NOT NULL,
+    run_status  TEXT,
+    has_png     INTEGER NOT NULL DEFAULT 0,
+    sort_key    TEXT NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_sort_key ON runs (sort_key DESC);
+CREATE INDEX IF NOT EXISTS runs_by_strategy ON runs (strategy, sort_key DESC);
+CREATE INDEX IF NOT EXISTS runs_by_model ON runs (model, sort_key DESC);
+CREATE INDEX IF NOT EXISTS runs_by_system ON runs (system, sort_key DESC);
+CREATE INDEX IF NOT EXISTS runs_by_status ON runs (run_status, sort_key DESC);
+"""
+
+# Folders upserted per reindex transaction, so concurrent ``record_run``
+# calls wait for one batch rather than the whole tree.
+REINDEX_BATCH = 200
+
+_initialized: set[str] = set()
+_init_lock = threading.Lock()
+
+
+def index_path() -> str:
+    return os.environ.get(
+        "SHERPA_RUN_INDEX", os.path.join(RESOURCES_DIR, "run_index.sqlite3")
+    )
+
+
+@contextlib.contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    path = index_path()
+    conn = sqlite3.connect(path, timeout=30)
+    try:
+        with _init_lock:
+            if path not in _initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                _initialized.add(path)
+        conn.row_factory = sqlite3.Row
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def describe_run_folder(folder: str) -> Optional[dict[str, str]]:
+    """Split a run folder path into its strategy/date/model/system/time parts."""
+    parts = os.path.abspath(folder).split(os.sep)
+    for idx, part in enumerate(parts):
+        strategy = part[: -len("_outputs")] if part.endswith("_outputs") else None
+        if strategy in STRATEGIES and len(parts) - idx == 5:
+            date_dir, model, system, time_dir = parts[idx + 1 :]
+            return {
+                "strategy": strategy,
+                "date": date_dir.replace("_", "-"),
+                "time": time_dir.replace("_", ":"),
+                "model": model,
+                "system": system,
+                "sort_key": f"{date_dir}_{time_dir}",
+            }
+    return None
+
+
+def _has_png(folder: str) -> bool:
+    # A ``.gv`` counts: /api/image rasterizes the PNG from it on demand.
+    try:
+        return any(
+            entry.name.endswith((".png", ".svg", ".gv")) and entry.is_file()
+            for entry in os.scandir(folder)
+        )
+    except OSError:
+        return False
+
+
+def _upsert(conn: sqlite3.Connection, folder: str, run_status: Optional[str]) -> bool:
+    folder = os.path.abspath(folder)
+    meta = describe_run_folder(folder)
+    if meta is None:
+        return False
+    conn.execute(
+        """
+        INSERT INTO runs (folder, strategy, date, time, model, system,
+                          run_status, has_png, sort_key, updated_at)
+        VALUES (:folder, :strategy, :date, :time, :model, :system,
+                :run_status, :has_png, :sort_key, :updated_at)
+        ON CONFLICT(folder) DO UPDATE SET
+            run_status = COALESCE(excluded.run_status, runs.run_status),
+            has_png = excluded.has_png,
+            updated_at = excluded.updated_at
+        """,
+        {
+            **meta,
+            "folder": folder,
+            "run_status": run_status,
+            "has_png": int(_has_png(folder)),
+            "updated_at": time.time(),
+        },
+    )
+    return True
+
+
+def record_run(folder: str, run_status: Optional[str] = None) -> None:
+    """Add (or refresh) a run folder in the index. Never raises."""
+    try:
+        with _connect() as conn:
+            _upsert(conn, folder, run_status)
+    except sqlite3.Error as exc:
+        logger.warning("Could not index run folder %s: %s", folder, exc)
+
+
+def update_run_status(folder: str, run_status: str) -> None:
+    record_run(folder, run_status)
+
+
+def query_runs(
+    *,
+    strategy: Optional[str] = None,
+    model: Optional[str] = None,
+    system: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> list[dict[str, Any]]:
+    """Return run metadata dicts, newest first.
+
+    ``date_from`` / ``date_to`` are inclusive ``YYYY-MM-DD`` bounds.
+    """
+    clauses = []
+    params: dict[str, Any] = {}
+    for column, value in (
+        ("strategy", strategy),
+        ("model", model),
+        ("system", system),
+        ("run_status", status),
+    ):
+        if value is not None:
+            clauses.append(f"{column} = :{column}")
+            params[column] = value
+    if date_from:
+        clauses.append("date >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        clauses.append("date <= :date_to")
+        params["date_to"] = date_to
+
+    sql = (
+        "SELECT strategy, date, time, model, system, folder, has_png, run_status "
+        "FROM runs"
+    )
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY sort_key DESC, folder DESC"
+    if limit is not None:
+        sql += " LIMIT :limit OFFSET :offset"
+        params["limit"] = limit
+        params["offset"] = offset
+
+    while True:
+        with _connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+            missing = [(row["folder"],) for row in rows if not os.path.isdir(row["folder"])]
+            if missing:
+                conn.executemany("DELETE FROM runs WHERE folder = ?", missing)
+        if not missing:
+            return [{**dict(row), "has_png": bool(row["has_png"])} for row in rows]
+
+
+def _iter_run_folders(resources_dir: str) -> Iterator[str]:
+    for strategy in STRATEGIES:
+        outputs_dir = os.path.join(resources_dir, f"{strategy}_outputs")
+        if not os.path.isdir(outputs_dir):
+            continue
+        for date_dir in os.scandir(outputs_dir):
+            if not date_dir.is_dir():
+                continue
+            for model_dir in os.scandir(date_dir.path):
+                if not model_dir.is_dir():
+                    continue
+                for system_dir in os.scandir(model_dir.path):
+                    if not system_dir.is_dir():
+                        continue
+                    for time_dir in os.scandir(system_dir.path):
+                        if time_dir.is_dir():
+                            yield time_dir.path
+
+
+def reindex(resources_dir: str = RESOURCES_DIR) -> int:
+    """Rebuild the index from the output tree. Returns the number of runs."""
+    # Imported lazily: errors.py imports this module.
+    try:
+        from .errors import read_status
+    except ImportError:
+        from errors import read_status
+
+    def upsert_batch(folders: list[str]) -> None:
+        statuses = [read_status(folder) for folder in folders]
+        with _connect() as conn:
+            for folder, status in zip(folders, statuses):
+                if _upsert(conn, folder, status.get("status") if status else None):
+                    seen.add(os.path.abspath(folder))
+
+    seen = set()
+    batch = []
+    for folder in _iter_run_folders(resources_dir):
+        batch.append(folder)
+        if len(batch) == REINDEX_BATCH:
+            upsert_batch(batch)
+            batch = []
+    upsert_batch(batch)
+
+    with _connect() as conn:
+        stale = [
+            (row["folder"],)
+            for row in conn.execute("SELECT folder FROM runs")
+            if row["folder"] not in seen
+        ]
+    for start in range(0, len(stale), REINDEX_BATCH):
+        with _connect() as conn:
+            conn.executemany(
+                "DELETE FROM runs WHERE folder = ?", stale[start : start + REINDEX_BATCH]
+            )
+    return len(seen)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Maintain the run history index.")
+    parser.add_argument("command", choices=["reindex"])
+    parser.add_argument("--resources-dir", default=RESOURCES_DIR)
+    args = parser.parse_args()
+
+    count = reindex(args.resources_dir)
+    print(f"Indexed {count} run folder(s) into {index_path()}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,248 @@
+"""Admission control and queueing for LLM pipeline runs.
+
+Routes never start a pipeline directly.  They ``submit`` a ticket, which
+either gets a slot right away, waits in a bounded priority queue, or is
+refused with ``QueueFullError`` when the queue is full.  A slot is held for
+the whole run:
+
+    ticket = get_scheduler().submit(model, priority=req.priority)
+    async with ticket:               # waits for a slot
+        await arun_single_prompt(...)
+
+Limits (environment):
+
+- ``SHERPA_MAX_CONCURRENT_GENERATIONS``: runs in flight at once (default 4).
+- ``SHERPA_MAX_PER_MODEL``: runs in flight per model (default 2), which keeps
+  one slow or rate-limited model from occupying every slot.
+- ``SHERPA_MAX_QUEUE``: waiting runs before new ones are refused (default 32).
+
+Higher ``priority`` values start first, and waiting ages a run: it is
+queued as if submitted ``SHERPA_QUEUE_AGING_SECONDS`` (default 30) earlier
+per priority level, so a low-priority run overtakes higher-priority runs
+that arrive long enough after it and cannot starve.  A waiting run whose
+model is at its limit does not block runs for other models queued behind it;
+one that only lacks free slots in total does, so runs needing one slot
+cannot keep a run needing several from ever starting.
+
+A run that calls several models at once (consensus grading) passes them as
+``extra_models`` and holds a slot for each distinct model; one that issues
+several concurrent calls to its model (speculative attempts) passes
+``slots`` and holds that many for it.  The slots are taken together, never
+one by one, so runs cannot deadlock holding some and waiting for the rest.
+
+The scheduler is driven from a single event loop and is not thread-safe.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT = int(os.environ.get("SHERPA_MAX_CONCURRENT_GENERATIONS", "4"))
+MAX_PER_MODEL = int(os.environ.get("SHERPA_MAX_PER_MODEL", "2"))
+MAX_QUEUE = int(os.environ.get("SHERPA_MAX_QUEUE", "32"))
+AGING_SECONDS = float(os.environ.get("SHERPA_QUEUE_AGING_SECONDS", "30"))
+
+PositionCallback = Callable[[int], None]
+
+
+class QueueFullError(RuntimeError):
+    """Raised by ``submit`` when the wait queue is at capacity."""
+
+
+class Ticket:
+    """A run's claim on a scheduler slot; use as an async context manager."""
+
+    def __init__(
+        self,
+        scheduler: "GenerationScheduler",
+        slots: dict[str, int],
+        priority: int,
+        seq: int,
+        on_position: Optional[PositionCallback],
+    ):
+        self.scheduler = scheduler
+        self.slots = slots
+        self.models = tuple(slots)
+        self.model = self.models[0]
+        self.priority = priority
+        self.seq = seq
+        self.submitted_at = time.monotonic()
+        self.on_position = on_position
+        self.started = asyncio.get_running_loop().create_future()
+        self.released = False
+        self.position: Optional[int] = None
+
+    @property
+    def sort_key(self) -> tuple[float, int]:
+        # Each priority level is worth AGING_SECONDS of waiting.
+        return (self.submitted_at - self.priority * AGING_SECONDS, self.seq)
+
+    async def __aenter__(self) -> "Ticket":
+        try:
+            await asyncio.shield(self.started)
+        except asyncio.CancelledError:
+            # Client went away while queued (or the task was cancelled).
+            self.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.release()
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+
+class GenerationScheduler:
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT,
+        max_per_model: int = MAX_PER_MODEL,
+        max_queue: int = MAX_QUEUE,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_model = max_per_model
+        self.max_queue = max_queue
+        self._waiting: list[Ticket] = []
+        self._running: dict[str, int] = {}
+        self._seq = itertools.count()
+        self.completed = 0
+        self.rejected = 0
+
+    @property
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    def _models_free(self, slots: dict[str, int]) -> bool:
+        # More slots than the limits allow would never fit; such a run waits
+        # until it can start with every other slot (for its models) free.
+        return all(
+            self._running.get(model, 0) + min(count, self.max_per_model) <= self.max_per_model
+            for model, count in slots.items()
+        )
+
+    def _total_free(self, slots: dict[str, int]) -> bool:
+        needed = min(sum(slots.values()), self.max_concurrent)
+        return self.running + needed <= self.max_concurrent
+
+    def _has_capacity(self, slots: dict[str, int]) -> bool:
+        return self._models_free(slots) and self._total_free(slots)
+
+    def submit(
+        self,
+        model: str,
+        priority: int = 0,
+        on_position: Optional[PositionCallback] = None,
+        extra_models: tuple[str, ...] = (),
+        slots: int = 1,
+    ) -> Ticket:
+        """Admit a run, or raise ``QueueFullError`` if it would have to wait
+        behind a full queue.
+
+        ``slots`` is how many calls to ``model`` the run makes at once;
+        ``extra_models`` are further models it calls, one slot per distinct
+        model.
+        """
+        counts = dict.fromkeys((model, *extra_models), 1)
+        counts[model] = max(1, slots)
+        ticket = Ticket(self, counts, priority, next(self._seq), on_position)
+        # Runs queued for other (saturated) models do not hold this one back,
+        # and a full queue only refuses runs that would have to join it.
+        if self._has_capacity(counts) and not any(
+            waiting.sort_key < ticket.sort_key
+            and (set(waiting.models) & set(counts) or self._models_free(waiting.slots))
+            for waiting in self._waiting
+        ):
+            self._start(ticket)
+            return ticket
+        if len(self._waiting) >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(
+                f"Generation queue is full ({self.max_queue} waiting); try again later."
+            )
+        self._waiting.append(ticket)
+        self._waiting.sort(key=lambda t: t.sort_key)
+        self._dispatch()
+        return ticket
+
+    def _start(self, ticket: Ticket) -> None:
+        for model, count in self._held(ticket).items():
+            self._running[model] = self._running.get(model, 0) + count
+        ticket.started.set_result(None)
+
+    def _held(self, ticket: Ticket) -> dict[str, int]:
+        """Slots ``ticket`` holds per model, capped at the per-model limit."""
+        return {
+            model: min(count, self.max_per_model) for model, count in ticket.slots.items()
+        }
+
+    def _release(self, ticket: Ticket) -> None:
+        if ticket in self._waiting:
+            self._waiting.remove(ticket)
+        elif ticket.started.done():
+            for model, count in self._held(ticket).items():
+                self._running[model] -= count
+                if not self._running[model]:
+                    del self._running[model]
+            self.completed += 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Start waiting runs in order, then report queue positions.
+
+        A run that cannot start reserves its models for itself, and if only
+        the total is short, every free slot: nothing behind it starts first.
+        """
+        still_waiting = []
+        reserved: set[str] = set()
+        total_reserved = False
+        for ticket in self._waiting:
+            models_free = self._models_free(ticket.slots) and not reserved & set(ticket.models)
+            if models_free and not total_reserved and self._total_free(ticket.slots):
+                self._start(ticket)
+                continue
+            if models_free:
+                total_reserved = True
+            reserved.update(ticket.models)
+            still_waiting.append(ticket)
+        self._waiting = still_waiting
+        for position, ticket in enumerate(self._waiting, start=1):
+            if ticket.position == position:
+                continue
+            ticket.position = position
+            if ticket.on_position is not None:
+                try:
+                    ticket.on_position(position)
+                except Exception:
+                    logger.exception("Queue position callback failed")
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_per_model": self.max_per_model,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "running_by_model": dict(self._running),
+            "queued": len(self._waiting),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+_scheduler: Optional[GenerationScheduler] = None
+
+
+def get_scheduler() -> GenerationScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = GenerationScheduler()
+    return _scheduler
@@ -8,9 +8,13 @@ sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.join(os.path.dirname(__file__), "resources"))
 
 from resources.util import (
-    call_openrouter_llm,
+    acall_openrouter_llm,
+    acreate_single_prompt_gsm_diagram_with_sherpa,
+    run_sync,
     setup_file_paths,
     mermaidCodeSearch,
+    render_formats_scope,
+    rendered_diagram_path,
     create_single_prompt_gsm_diagram_with_sherpa,
 )
 from resources.prompts.single_prompt.custom_mermaid_syntax import mermaid_syntax
@@ -20,10 +24,23 @@ from resources.n_shot_examples_single_prompt_mermaid import (
     n_shot_examples,
 )
 from resources.prompts.single_prompt.single_prompt_template import build_single_prompt
-from grading import run_automatic_grading
+from resources.prompts.single_prompt.retry_prompt_template import build_retry_prompt
+from resources.mermaid_validator import (
+    ERROR,
+    Diagnostic,
+    format_diagnostics,
+    has_errors,
+    mermaid_validation_enabled,
+    validate_mermaid,
+)
+from grading import arun_automatic_grading
+import telemetry
+from speculative import attempts_per_round, race_attempts
 from errors import (
     ErrorType,
     RunError,
+    RunResult,
+    record_spans,
     write_success,
     write_failure,
     write_partial,
@@ -99,6 +116,32 @@ def run_single_prompt(
     system_name=None,
     enable_auto_grading=True,
     example_key=None,
+    render_formats=None,
+    speculative_attempts=None,
+):
+    """Blocking wrapper around ``arun_single_prompt`` for synchronous callers."""
+    return run_sync(
+        arun_single_prompt(
+            system_prompt,
+            model,
+            system_name,
+            enable_auto_grading,
+            example_key,
+            render_formats,
+            speculative_attempts,
+        )
+    )
+
+
+async def arun_single_prompt(
+    system_prompt,
+    model="anthropic/claude-3.5-sonnet",
+    system_name=None,
+    enable_auto_grading=True,
+    example_key=None,
+    render_formats=None,
+    speculative_attempts=None,
+    on_folder=None,
 ):
     """
     the run_single_prompt initiates the Single Prompt State Machine Framework
@@ -108,12 +151,19 @@ def run_single_prompt(
         system_name: Optional name for the system (used for organizing output folders)
         enable_auto_grading: Whether automatic grading is executed after a successful run
         example_key: Optional key identifying which preset example is being used (e.g., 'printer_winter_2017')
+        render_formats: Image formats drawn next to the ``.gv`` (default
+            ``SHERPA_RENDER_FORMATS``); ``()`` skips drawing entirely
+        speculative_attempts: Attempts issued concurrently per round, first
+            success wins (default ``SHERPA_SPECULATIVE_ATTEMPTS``, 1 = sequential)
+        on_folder: Called with the run folder as soon as it is created
     Returns:
-        bool: True if generation succeeded, False if all attempts failed
+        RunResult: run folder, final status and timings; truthy if generation succeeded
     """
     if enable_auto_grading and not example_key:
         raise ValueError("example_key is required when automatic grading is enabled")
 
+    started_at = time.time()
+
     # Extract short model name for folder (e.g., "anthropic/claude-3.5-sonnet" -> "claude-3.5-sonnet")
     model_short_name = model.split("/")[-1] if "/" in model else model
 
@@ -121,7 +171,55 @@ def run_single_prompt(
     paths = setup_file_paths(
         os.path.dirname(__file__), system_name=system_name, model_name=model_short_name
     )
+    if on_folder is not None:
+        on_folder(paths["log_base_dir"])
+
+    with telemetry.run_trace(
+        on_close=lambda spans: record_spans(paths, spans)
+    ), render_formats_scope(render_formats):
+        diagram_path = rendered_diagram_path(paths["diagram_file_path"])
+        try:
+            success = await _run_single_prompt_attempts(
+                system_prompt,
+                model,
+                system_name,
+                enable_auto_grading,
+                example_key,
+                paths,
+                speculative_attempts,
+            )
+        except Exception as e:
+            # Keep the folder's status.json truthful even if something outside the
+            # per-attempt error handling blows up.
+            print(f"Unexpected error during single prompt generation: {str(e)}")
+            write_failure(
+                paths,
+                RunError(
+                    type=ErrorType.UNEXPECTED,
+                    message=f"Unexpected error during generation: {str(e)}",
+                ),
+            )
+            success = False
+
+    return RunResult.collect(
+        paths,
+        success,
+        started_at,
+        diagram_path=diagram_path if success else None,
+    )
+
 
+async def _run_single_prompt_attempts(
+    system_prompt,
+    model,
+    system_name,
+    enable_auto_grading,
+    example_key,
+    paths,
+    speculative_attempts=None,
+):
+    """Build the prompt, run up to three attempts and record the run status."""
+    prompt_build_started = time.perf_counter()
     # Prepare the list of example to provide to the LLM (N shot prompting)
     n_shot_examples_single_prompt = list(
         n_shot_examples.keys()
@@ -152,6 +250,7 @@ def run_single_prompt(
         ),
         system_prompt=system_prompt,
     )
+    telemetry.record("prompt_build", prompt_build_started, prompt_chars=len(prompt))
 
     # Persist the exact prompt used for this run next to the generated outputs.
     prompt_file_path = os.path.join(paths["log_base_dir"], "prompt_single.txt")
@@ -165,18 +264,38 @@ def run_single_prompt(
     success = False
     max_attempts = 3
     attempt_errors: list[dict] = []
+    attempt_prompt = prompt
+    concurrent = attempts_per_round(speculative_attempts)
 
-    for i in range(max_attempts):
+    i = 0
+    while i < max_attempts:
         if i > 0:
             print(f"Retrying (attempt {i+1}/{max_attempts})...")
 
-        result, attempt_error = process_mermaid_attempt_openrouter(i, prompt, paths, model)
+        wave = range(i, min(i + concurrent, max_attempts))
+        if len(wave) > 1:
+            wave_prompt = attempt_prompt
+            result, wave_errors = await race_attempts(
+                lambda index, attempt_paths: aprocess_mermaid_attempt_openrouter(
+                    index, wave_prompt, attempt_paths, model
+                ),
+                wave,
+                paths,
+                model,
+            )
+        else:
+            with telemetry.labels(attempt=i + 1):
+                result, attempt_error = await aprocess_mermaid_attempt_openrouter(
+                    i, attempt_prompt, paths, model
+                )
+            wave_errors = [attempt_error] if attempt_error else []
+        i = wave.stop
 
         if result != "False":
             success = True
             if enable_auto_grading:
                 try:
-                    run_automatic_grading(
+                    await arun_automatic_grading(
                         student_mermaid_code=result,
                         system_prompt=system_prompt,
                         system_name=system_name,
@@ -198,9 +317,20 @@ def run_single_prompt(
                 write_success(paths)
             break
         else:
-            if attempt_error:
+            for attempt_error in wave_errors:
+                rejected_mermaid = attempt_error.pop("mermaid_code", None)
                 attempt_errors.append(attempt_error)
-            if i < max_attempts - 1:
+                if rejected_mermaid and attempt_error.get("diagnostics"):
+                    # Feed the validator's findings back instead of re-sending
+                    # the same prompt.
+                    attempt_prompt = build_retry_prompt(
+                        prompt,
+                        rejected_mermaid,
+                        format_diagnostics(
+                            Diagnostic(**d) for d in attempt_error["diagnostics"]
+                        ),
+                    )
+            if i < max_attempts:
                 print(f"Attempt failed, retrying...")
             else:
                 print(f"All attempts failed")
@@ -208,7 +338,7 @@ def run_single_prompt(
                 last_error_type = ErrorType.GENERATION
                 if attempt_errors:
                     last_kind = attempt_errors[-1].get("kind", "")
-                    if last_kind == "mermaid_compilation":
+                    if last_kind in ("mermaid_compilation", "mermaid_validation"):
                         last_error_type = ErrorType.MERMAID_COMPILATION
                 error = RunError(
                     type=last_error_type,
@@ -223,6 +353,13 @@ def run_single_prompt(
 
 def process_mermaid_attempt_openrouter(
     i: int, prompt: str, paths: dict, model: str = "anthropic/claude-3.5-sonnet"
+) -> tuple[str, dict | None]:
+    """Blocking wrapper around ``aprocess_mermaid_attempt_openrouter``."""
+    return run_sync(aprocess_mermaid_attempt_openrouter(i, prompt, paths, model))
+
+
+async def aprocess_mermaid_attempt_openrouter(
+    i: int, prompt: str, paths: dict, model: str = "anthropic/claude-3.5-sonnet"
 ) -> tuple[str, dict | None]:
     """
     Process a single attempt at generating and processing Mermaid code using OpenRouter
@@ -234,13 +371,19 @@ def process_mermaid_attempt_openrouter(
     Returns:
         tuple: (mermaid_code, error_info)
             - mermaid_code: Generated Mermaid code if successful, "False" otherwise
-            - error_info: dict with 'kind' and 'message' on failure, None on success
+            - error_info: dict with 'kind' and 'message' on failure, None on success.
+              A ``mermaid_validation`` failure also carries the rejected
+              ``mermaid_code`` and the validator ``diagnostics`` (as dicts).
     """
     try:
         # Call LLM
         try:
-            answer = call_openrouter_llm(
-                prompt, max_tokens=15000, temperature=0.01, model=model
+            answer = await acall_openrouter_llm(
+                prompt,
+                max_tokens=15000,
+                temperature=0.01,
+                model=model,
+                stream_mermaid=True,
             )
         except Exception as e:
             error_msg = f"LLM call failed: {str(e)}"
@@ -251,9 +394,10 @@ def process_mermaid_attempt_openrouter(
 
         # Extract Mermaid code
         try:
-            generated_mermaid_code = mermaidCodeSearch(
-                answer, paths["generated_mermaid_code_path"]
-            )
+            with telemetry.span("mermaid_extract", response_chars=len(answer)):
+                generated_mermaid_code = mermaidCodeSearch(
+                    answer, paths["generated_mermaid_code_path"]
+                )
         except Exception as e:
             error = f"Failed to extract mermaid code from LLM response"
             with open(paths["log_file_path"], "a") as file:
@@ -266,9 +410,30 @@ def process_mermaid_attempt_openrouter(
             file.write(generated_mermaid_code)
             file.write("\n\n")
 
+        # Structural checks take milliseconds; reject the answer here rather
+        # than after a worker render.
+        if mermaid_validation_enabled():
+            with telemetry.span("validate") as span:
+                diagnostics = validate_mermaid(generated_mermaid_code)
+                span["errors"] = sum(d.severity == ERROR for d in diagnostics)
+                span["warnings"] = len(diagnostics) - span["errors"]
+            if has_errors(diagnostics):
+                error = "Mermaid failed structural validation"
+                report = format_diagnostics(diagnostics)
+                with open(paths["log_file_path"], "a") as file:
+                    file.write(f"{error}:\n{report}\n\n")
+                print(f"{error}:\n{report}")
+                return "False", {
+                    "kind": "mermaid_validation",
+                    "message": f"{error}: {span['errors']} error(s)",
+                    "attempt": i + 1,
+                    "diagnostics": [d.to_dict() for d in diagnostics],
+                    "mermaid_code": generated_mermaid_code,
+                }
+
         # Render diagram
         try:
-            success = create_single_prompt_gsm_diagram_with_sherpa(
+            success = await acreate_single_prompt_gsm_diagram_with_sherpa(
                 generated_mermaid_code, paths["diagram_file_path"]
             )
             if not success:
@@ -385,7 +550,9 @@ def run_test_entry_exit_annotations():
             test_mermaid, paths["diagram_file_path"]
         )
         if success:
-            print(f"TEST PASSED: Diagram saved to {paths['diagram_file_path']}.png")
+            print(
+                f"TEST PASSED: Diagram saved to {rendered_diagram_path(paths['diagram_file_path'])}"
+            )
             return True
         else:
             print("TEST FAILED: Rendering returned False")
@@ -399,7 +566,10 @@ def run_test_entry_exit_annotations():
 
 
 def process_custom_mermaid(
-    mermaid_code, system_name="CustomMermaid", file_type="single_prompt"
+    mermaid_code,
+    system_name="CustomMermaid",
+    file_type="single_prompt",
+    render_formats=None,
 ):
     """
     Process user-provided Mermaid code (bypasses LLM).
@@ -410,14 +580,17 @@ def process_custom_mermaid(
     Args:
         mermaid_code: User-provided Mermaid state diagram code
         system_name: Name for file organization (default: "CustomMermaid")
+        render_formats: Image formats drawn next to the ``.gv`` (default
+            ``SHERPA_RENDER_FORMATS``)
 
     Returns:
-        tuple: (success: bool, diagram_path: str or None)
-            - success: True if processing succeeded
-            - diagram_path: Full path to the generated PNG diagram, or None if failed
+        RunResult: run folder, final status and timings; ``diagram_path`` is the
+        generated diagram (SVG by default), or None if rendering failed
     """
     import re
 
+    started_at = time.time()
+
     # Clean up common UI artifacts and markdown code fences.
     cleaned_code = mermaid_code or ""
     cleaned_code = cleaned_code.replace("Raw code", "")
@@ -454,15 +627,16 @@ def process_custom_mermaid(
         print(f"📄 Mermaid saved: {paths['generated_mermaid_code_path']}")
 
         # Render diagram using the same function as single_prompt
-        success = create_single_prompt_gsm_diagram_with_sherpa(
-            cleaned_code, paths["diagram_file_path"]
-        )
+        with render_formats_scope(render_formats):
+            success = create_single_prompt_gsm_diagram_with_sherpa(
+                cleaned_code, paths["diagram_file_path"]
+            )
+            diagram_output = rendered_diagram_path(paths["diagram_file_path"])
 
         if success:
-            diagram_output = paths["diagram_file_path"] + ".png"
             print(f"🖼️  Diagram saved: {diagram_output}")
             write_success(paths)
-            return (True, diagram_output)
+            return RunResult.collect(paths, True, started_at, diagram_path=diagram_output)
         else:
             print("Rendering returned False")
             error = RunError(
@@ -470,7 +644,7 @@ def process_custom_mermaid(
                 message="Mermaid rendering failed. Check your diagram syntax.",
             )
             write_failure(paths, error)
-            return (False, None)
+            return RunResult.collect(paths, False, started_at)
 
     except Exception as e:
         print(f"Error processing custom Mermaid: {str(e)}")
@@ -482,7 +656,7 @@ def process_custom_mermaid(
             message=f"Mermaid compilation error: {str(e)}",
         )
         write_failure(paths, error)
-        return (False, None)
+        return RunResult.collect(paths, False, started_at)
 
 
 if __name__ == "__main__":
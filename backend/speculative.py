@@ -0,0 +1,229 @@
+"""Speculative generation attempts: run several at once, keep the first success.
+
+Generation pipelines normally make their attempts one after another, so a
+run whose first two answers fail waits through three full LLM round-trips.
+With ``SHERPA_SPECULATIVE_ATTEMPTS=N`` (or ``speculative_attempts`` on a run)
+up to N attempts are issued concurrently instead.  Each one validates and
+renders its answer as soon as it arrives; the first that succeeds wins and
+the others are cancelled::
+
+    result, errors = await race_attempts(
+        lambda index, attempt_paths: aprocess_attempt(index, attempt_paths),
+        range(0, 3), paths, model,
+    )
+
+Concurrent attempts never share files: attempt ``n`` writes into
+``<run>/speculative/attempt_<n>/``.  Afterwards every attempt's logs are
+appended to the run's logs and the winner's artifacts (Mermaid, diagram,
+``stage1/``) are moved up into the run folder, so the folder looks the same
+as after a sequential run; a failed attempt's rejected Mermaid stays in its
+attempt folder.  Printed progress is prefixed with
+``[attempt n]``; only the first attempt streams tokens to the UI.
+
+Each concurrent attempt is a call to the model, so callers reserve
+``attempts_per_round`` scheduler slots for the run (``submit(slots=...)``).
+
+Speculation trades tokens for tail latency.  The ``speculative`` span in
+``status.json`` lists the tokens each attempt used and ``tokens_extra``,
+the tokens spent on attempts other than the winner; ``/metrics`` exports
+the same per model as ``sherpa_speculative_extra_tokens_total``.  Cancelled
+or early-stopped streams never receive a usage chunk, so their tokens are
+estimated from the characters sent and received (``tokens_estimated``).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import time
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+try:
+    from . import progress, telemetry
+except ImportError:
+    import progress
+    import telemetry
+
+# Rough characters-per-token ratio for estimating unmetered calls.
+CHARS_PER_TOKEN = 4
+ATTEMPTS_DIR = "speculative"
+FAILED = "False"
+
+AttemptFn = Callable[[int, dict], Awaitable[tuple[str, Optional[dict]]]]
+
+
+def attempts_per_round(requested: Optional[int] = None) -> int:
+    """Concurrent attempts per round; 1 keeps attempts sequential."""
+    if requested is None:
+        requested = int(os.environ.get("SHERPA_SPECULATIVE_ATTEMPTS", "1"))
+    return max(1, requested)
+
+
+def attempt_paths(paths: dict, number: int) -> dict:
+    """``paths`` with everything under the run folder moved into attempt ``number``'s."""
+    base = paths["log_base_dir"]
+    attempt_dir = os.path.join(base, ATTEMPTS_DIR, f"attempt_{number}")
+    os.makedirs(attempt_dir, exist_ok=True)
+    remapped = {}
+    for key, value in paths.items():
+        if isinstance(value, str) and (value == base or value.startswith(base + os.sep)):
+            value = attempt_dir + value[len(base) :]
+        remapped[key] = value
+    return remapped
+
+
+async def race_attempts(
+    run_attempt: AttemptFn, indices: Iterable[int], paths: dict, model: str
+) -> tuple[str, list[dict]]:
+    """Run the attempts ``indices`` concurrently; the first success wins.
+
+    ``run_attempt(index, attempt_paths)`` returns ``(mermaid_code, error)``
+    like the pipelines' per-attempt functions (``"False"`` on failure).
+    Returns the winning Mermaid (or ``"False"``) and the error dicts of the
+    attempts that failed, in attempt order.
+    """
+    indices = list(indices)
+    started = time.perf_counter()
+    tasks = {
+        asyncio.create_task(
+            _run_one(run_attempt, index, paths, forward_tokens=index == indices[0])
+        ): index
+        for index in indices
+    }
+    print(f"Running {len(indices)} speculative attempts concurrently")
+
+    winner = None
+    result = FAILED
+    errors: dict[int, dict] = {}
+    pending = set(tasks)
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in sorted(done, key=tasks.get):
+                index = tasks[task]
+                try:
+                    outcome, error = task.result()
+                except Exception as e:
+                    outcome, error = FAILED, {
+                        "kind": "unexpected",
+                        "message": f"Unexpected error in attempt {index}: {str(e)}",
+                        "attempt": index + 1,
+                    }
+                if outcome != FAILED and winner is None:
+                    winner, result = index, outcome
+                elif outcome == FAILED and error:
+                    errors[index] = error
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    cancelled = sorted(tasks[task] for task in pending)
+    _merge_attempts(paths, indices, winner, cancelled)
+    _report(started, model, indices, winner, cancelled)
+    return result, [errors[index] for index in sorted(errors)]
+
+
+async def _run_one(run_attempt: AttemptFn, index: int, paths: dict, forward_tokens: bool):
+    number = index + 1
+    with telemetry.labels(attempt=number), progress.child_scope(
+        f"[attempt {number}] ", forward_tokens=forward_tokens
+    ):
+        return await run_attempt(index, attempt_paths(paths, number))
+
+
+def _merge_attempts(paths: dict, indices: list, winner: Optional[int], cancelled: list) -> None:
+    """Append every attempt's logs to the run's, then promote the winner's files."""
+    base = paths["log_base_dir"]
+    log_names = {
+        os.path.basename(paths[key])
+        for key in ("log_file_path", "llm_log_path")
+        if key in paths
+    }
+    for index in indices:
+        attempt_dir = os.path.join(base, ATTEMPTS_DIR, f"attempt_{index + 1}")
+        outcome = (
+            "winner" if index == winner else "cancelled" if index in cancelled else "failed"
+        )
+        for name in sorted(log_names):
+            src = os.path.join(attempt_dir, name)
+            if not os.path.isfile(src):
+                continue
+            with open(src) as f:
+                text = f.read()
+            with open(os.path.join(base, name), "a") as f:
+                f.write(f"=== Speculative attempt {index + 1} ({outcome}) ===\n{text}\n")
+        if index != winner:
+            if os.path.isdir(attempt_dir) and not os.listdir(attempt_dir):
+                os.rmdir(attempt_dir)
+            continue
+        for name in os.listdir(attempt_dir):
+            if name in log_names:
+                continue
+            dest = os.path.join(base, name)
+            if os.path.isdir(dest):
+                shutil.rmtree(dest)
+            os.replace(os.path.join(attempt_dir, name), dest)
+        shutil.rmtree(attempt_dir, ignore_errors=True)
+    attempts_dir = os.path.join(base, ATTEMPTS_DIR)
+    if os.path.isdir(attempts_dir) and not os.listdir(attempts_dir):
+        os.rmdir(attempts_dir)
+
+
+def _attempt_tokens(spans: list[dict[str, Any]], number: int) -> tuple[int, bool]:
+    """Tokens attempt ``number`` used, and whether any of them are estimated."""
+    tokens, estimated = 0, False
+    for span in spans:
+        if span.get("stage") != "llm_call" or span.get("attempt") != number:
+            continue
+        if span.get("prompt_tokens") is not None or span.get("completion_tokens") is not None:
+            tokens += (span.get("prompt_tokens") or 0) + (span.get("completion_tokens") or 0)
+        else:
+            chars = (
+                span.get("prompt_chars", 0)
+                + span.get("completion_chars", 0)
+                + span.get("reasoning_chars", 0)
+            )
+            tokens += chars // CHARS_PER_TOKEN
+            estimated = True
+    return tokens, estimated
+
+
+def _report(started: float, model: str, indices: list, winner: Optional[int], cancelled: list) -> None:
+    trace = telemetry.current_trace()
+    spans = trace.snapshot() if trace is not None else []
+    usage = [_attempt_tokens(spans, index + 1) for index in indices]
+    total = sum(tokens for tokens, _ in usage)
+    extra = total - usage[indices.index(winner)][0] if winner is not None else 0
+    telemetry.record(
+        "speculative",
+        started,
+        attempts=len(indices),
+        winner=winner + 1 if winner is not None else None,
+        cancelled=[index + 1 for index in cancelled],
+        attempt_tokens=[tokens for tokens, _ in usage],
+        tokens_total=total,
+        tokens_extra=extra,
+        tokens_estimated=any(estimated for _, estimated in usage),
+    )
+    telemetry.inc(
+        "sherpa_speculative_rounds_total",
+        "Speculative attempt rounds by outcome.",
+        model=model,
+        outcome="won" if winner is not None else "failed",
+    )
+    if extra:
+        telemetry.inc(
+            "sherpa_speculative_extra_tokens_total",
+            "Tokens spent on speculative attempts other than the winner.",
+            extra,
+            model=model,
+        )
+    if winner is not None:
+        print(
+            f"Speculative attempt {winner + 1} of {len(indices)} won; "
+            f"~{extra} extra tokens on the other attempts"
+        )
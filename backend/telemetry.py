@@ -0,0 +1,261 @@
+"""Per-stage timing spans for runs, plus process-wide Prometheus metrics.
+
+A run opens a trace with ``run_trace``; every ``span`` (or ``record``)
+inside it appends a timing record, and the entry point persists the list to
+the run's ``status.json`` under ``"spans"``::
+
+    with telemetry.run_trace(on_close=lambda spans: record_spans(paths, spans)):
+        with telemetry.labels(attempt=1):
+            with telemetry.span("llm_call", model=model):
+                ...
+                telemetry.annotate(prompt_tokens=812, completion_tokens=2304)
+
+Each span is a flat dict::
+
+    {"stage": "llm_call", "attempt": 1, "start_ms": 41.2,
+     "duration_ms": 18234.5, "model": "...", "prompt_tokens": 812, ...}
+
+Every finished span is also observed in the ``sherpa_stage_duration_seconds``
+histogram (labelled by stage only), which ``render_prometheus`` exports
+together with the counters registered through ``inc``.
+
+Traces live in context variables, so concurrent runs never mix spans; work
+handed to threads must be run under ``contextvars.copy_context()``.
+"""
+
+from __future__ import annotations
+
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+# Stage latencies range from sub-millisecond parses to multi-minute LLM calls.
+STAGE_BUCKETS = (
+    0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+
+class RunTrace:
+    """Spans recorded for one run; safe to append to from several threads."""
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def offset_ms(self, perf_time: float) -> float:
+        return round((perf_time - self.origin) * 1000, 3)
+
+    def add(self, span: dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return list(self.spans)
+
+
+_trace: contextvars.ContextVar[Optional[RunTrace]] = contextvars.ContextVar(
+    "sherpa_run_trace", default=None
+)
+_labels: contextvars.ContextVar[dict[str, Any]] = contextvars.ContextVar(
+    "sherpa_span_labels", default={}
+)
+_open_span: contextvars.ContextVar[Optional[dict[str, Any]]] = contextvars.ContextVar(
+    "sherpa_open_span", default=None
+)
+
+
+@contextlib.contextmanager
+def run_trace(
+    on_close: Optional[Callable[[list[dict[str, Any]]], None]] = None,
+) -> Iterator[RunTrace]:
+    """Open a trace for the current run, or join the one already open.
+
+    ``on_close`` only runs for the outermost scope, i.e. the one that
+    actually owns the trace.
+    """
+    existing = _trace.get()
+    if existing is not None:
+        yield existing
+        return
+    trace = RunTrace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+        if on_close is not None:
+            on_close(trace.snapshot())
+
+
+def current_trace() -> Optional[RunTrace]:
+    return _trace.get()
+
+
+@contextlib.contextmanager
+def labels(**values: Any) -> Iterator[None]:
+    """Attach ``values`` (e.g. ``attempt=2``) to every span opened inside."""
+    token = _labels.set({**_labels.get(), **values})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+@contextlib.contextmanager
+def span(stage: str, **attrs: Any) -> Iterator[dict[str, Any]]:
+    """Time the enclosed block as ``stage``; yields the span dict for extra attrs."""
+    started = time.perf_counter()
+    record_ = {"stage": stage, **_labels.get(), **attrs}
+    token = _open_span.set(record_)
+    try:
+        yield record_
+    except BaseException as exc:
+        record_.setdefault("error", type(exc).__name__)
+        raise
+    finally:
+        _open_span.reset(token)
+        _finish(record_, started)
+
+
+def record(stage: str, started: float, **attrs: Any) -> None:
+    """Record a span that began at ``started`` (a ``time.perf_counter()`` value)."""
+    _finish({"stage": stage, **_labels.get(), **attrs}, started)
+
+
+def annotate(**attrs: Any) -> None:
+    """Add attributes (token counts, payload sizes...) to the innermost open span."""
+    open_span = _open_span.get()
+    if open_span is not None:
+        open_span.update(attrs)
+
+
+def _finish(record_: dict[str, Any], started: float) -> None:
+    ended = time.perf_counter()
+    duration = ended - started
+    observe(record_["stage"], duration)
+    trace = _trace.get()
+    if trace is not None:
+        record_["start_ms"] = trace.offset_ms(started)
+        record_["duration_ms"] = round(duration * 1000, 3)
+        trace.add(record_)
+
+
+def add_spans(spans: Iterable[dict[str, Any]], started: float) -> None:
+    """Merge spans recorded elsewhere (e.g. a render worker process).
+
+    Their ``start_ms`` offsets are rebased onto the current trace, taking
+    ``started`` (a local ``perf_counter`` value) as their origin.
+    """
+    trace = _trace.get()
+    base_ms = trace.offset_ms(started) if trace is not None else 0.0
+    for item in spans:
+        item = {**_labels.get(), **item}
+        observe(item["stage"], item.get("duration_ms", 0.0) / 1000)
+        if trace is not None:
+            item["start_ms"] = round(base_ms + item.get("start_ms", 0.0), 3)
+            trace.add(item)
+
+
+# ---------------------------------------------------------------------------
+# Process-wide metrics
+# ---------------------------------------------------------------------------
+
+_metrics_lock = threading.Lock()
+# stage -> [bucket counts..., +Inf count], running sum
+_histograms: dict[str, tuple[list[int], list[float]]] = {}
+# name -> (help text, {label items -> value})
+_counters: dict[str, tuple[str, dict[tuple[tuple[str, str], ...], float]]] = {}
+
+
+def observe(stage: str, seconds: float) -> None:
+    with _metrics_lock:
+        counts, total = _histograms.setdefault(
+            stage, ([0] * (len(STAGE_BUCKETS) + 1), [0.0])
+        )
+        counts[bisect.bisect_left(STAGE_BUCKETS, seconds)] += 1
+        total[0] += seconds
+
+
+def inc(name: str, help_text: str, value: float = 1.0, **label_values: str) -> None:
+    """Increment a Prometheus counter (created on first use)."""
+    key = tuple(sorted((k, str(v)) for k, v in label_values.items()))
+    with _metrics_lock:
+        _, series = _counters.setdefault(name, (help_text, {}))
+        series[key] = series.get(key, 0.0) + value
+
+
+def _format_labels(items: Iterable[tuple[str, str]]) -> str:
+    parts = []
+    for key, value in items:
+        escaped = value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _format_metric(
+    name: str, kind: str, help_text: str, samples: dict[tuple, float]
+) -> list[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for label_items, value in samples.items():
+        lines.append(f"{name}{_format_labels(label_items)} {_format_number(value)}")
+    return lines
+
+
+def format_gauge(name: str, help_text: str, samples: dict[tuple, float]) -> list[str]:
+    """Prometheus text lines for a gauge; ``samples`` maps label items to values."""
+    return _format_metric(name, "gauge", help_text, samples)
+
+
+def format_counter(name: str, help_text: str, samples: dict[tuple, float]) -> list[str]:
+    """Prometheus text lines for a monotonic counter kept outside ``inc``
+    (e.g. scheduler totals); ``name`` should end in ``_total``."""
+    return _format_metric(name, "counter", help_text, samples)
+
+
+def render_prometheus() -> str:
+    """All histograms and counters in Prometheus text exposition format."""
+    lines = [
+        "# HELP sherpa_stage_duration_seconds Time spent in each pipeline stage.",
+        "# TYPE sherpa_stage_duration_seconds histogram",
+    ]
+    with _metrics_lock:
+        histograms = {k: (list(c), t[0]) for k, (c, t) in _histograms.items()}
+        counters = {
+            name: (help_text, dict(series))
+            for name, (help_text, series) in _counters.items()
+        }
+
+    for stage in sorted(histograms):
+        counts, total = histograms[stage]
+        cumulative = 0
+        for bound, count in zip(STAGE_BUCKETS, counts):
+            cumulative += count
+            labels_ = _format_labels([("stage", stage), ("le", _format_number(bound))])
+            lines.append(f"sherpa_stage_duration_seconds_bucket{labels_} {cumulative}")
+        cumulative += counts[-1]
+        labels_ = _format_labels([("stage", stage), ("le", "+Inf")])
+        lines.append(f"sherpa_stage_duration_seconds_bucket{labels_} {cumulative}")
+        stage_label = _format_labels([("stage", stage)])
+        lines.append(
+            f"sherpa_stage_duration_seconds_sum{stage_label} {_format_number(total)}"
+        )
+        lines.append(f"sherpa_stage_duration_seconds_count{stage_label} {cumulative}")
+
+    for name in sorted(counters):
+        help_text, series = counters[name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for label_items, value in sorted(series.items()):
+            lines.append(f"{name}{_format_labels(label_items)} {_format_number(value)}")
+
+    return "\n".join(lines) + "\n"
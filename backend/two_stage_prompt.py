@@ -1,15 +1,19 @@
 import os
 import sys
+import time
 import logging
 
 sys.path.append(os.path.dirname(__file__))
 sys.path.append(os.path.join(os.path.dirname(__file__), "resources"))
 
 from resources.util import (
-    call_openrouter_llm,
+    acall_openrouter_llm,
+    acreate_single_prompt_gsm_diagram_with_sherpa,
+    run_sync,
     setup_file_paths,
     mermaidCodeSearch,
-    create_single_prompt_gsm_diagram_with_sherpa,
+    render_formats_scope,
+    rendered_diagram_path,
 )
 from resources.prompts.single_prompt.custom_mermaid_syntax import mermaid_syntax
 from resources.prompts.single_prompt.single_prompt_template import build_single_prompt
@@ -21,10 +25,14 @@ from resources.n_shot_examples_single_prompt_mermaid import (
     get_n_shot_examples,
     n_shot_examples,
 )
-from grading import run_automatic_grading
+from grading import arun_automatic_grading
+import telemetry
+from speculative import attempts_per_round, race_attempts
 from errors import (
     ErrorType,
     RunError,
+    RunResult,
+    record_spans,
     write_success,
     write_failure,
     write_partial,
@@ -44,6 +52,32 @@ def run_two_stage_prompt(
     system_name=None,
     enable_auto_grading=True,
     example_key=None,
+    render_formats=None,
+    speculative_attempts=None,
+):
+    """Blocking wrapper around ``arun_two_stage_prompt`` for synchronous callers."""
+    return run_sync(
+        arun_two_stage_prompt(
+            system_prompt,
+            model,
+            system_name,
+            enable_auto_grading,
+            example_key,
+            render_formats,
+            speculative_attempts,
+        )
+    )
+
+
+async def arun_two_stage_prompt(
+    system_prompt,
+    model="anthropic/claude-3.5-sonnet",
+    system_name=None,
+    enable_auto_grading=True,
+    example_key=None,
+    render_formats=None,
+    speculative_attempts=None,
+    on_folder=None,
 ):
     """
     Run the Two-Stage Prompt State Machine Framework.
@@ -58,13 +92,20 @@ def run_two_stage_prompt(
         system_name: Optional name for the system (used for output folder organization).
         enable_auto_grading: Whether automatic grading is executed after a successful run.
         example_key: Optional key identifying which preset example is being used (e.g., 'printer_winter_2017')
+        render_formats: Image formats drawn next to the ``.gv`` (default
+            ``SHERPA_RENDER_FORMATS``); ``()`` skips drawing entirely
+        speculative_attempts: Attempts issued concurrently per round, first
+            success wins (default ``SHERPA_SPECULATIVE_ATTEMPTS``, 1 = sequential)
+        on_folder: Called with the run folder as soon as it is created
 
     Returns:
-        bool: True if the stage 2 diagram rendered successfully, False otherwise.
+        RunResult: run folder, final status and timings; truthy if the stage 2
+        diagram rendered successfully.
     """
     if enable_auto_grading and not example_key:
         raise ValueError("example_key is required when automatic grading is enabled")
 
+    started_at = time.time()
     model_short_name = model.split("/")[-1] if "/" in model else model
 
     paths = setup_file_paths(
@@ -73,7 +114,53 @@ def run_two_stage_prompt(
         system_name=system_name,
         model_name=model_short_name,
     )
+    if on_folder is not None:
+        on_folder(paths["log_base_dir"])
+
+    with telemetry.run_trace(
+        on_close=lambda spans: record_spans(paths, spans)
+    ), render_formats_scope(render_formats):
+        diagram_path = rendered_diagram_path(paths["diagram_file_path"])
+        try:
+            success = await _run_two_stage_attempts(
+                system_prompt,
+                model,
+                system_name,
+                enable_auto_grading,
+                example_key,
+                paths,
+                speculative_attempts,
+            )
+        except Exception as e:
+            print(f"Unexpected error during two-stage generation: {str(e)}")
+            write_failure(
+                paths,
+                RunError(
+                    type=ErrorType.UNEXPECTED,
+                    message=f"Unexpected error during generation: {str(e)}",
+                ),
+            )
+            success = False
+
+    return RunResult.collect(
+        paths,
+        success,
+        started_at,
+        diagram_path=diagram_path if success else None,
+    )
+
 
+async def _run_two_stage_attempts(
+    system_prompt,
+    model,
+    system_name,
+    enable_auto_grading,
+    example_key,
+    paths,
+    speculative_attempts=None,
+):
+    """Build the stage 1 prompt, run up to three attempts and record the run status."""
+    prompt_build_started = time.perf_counter()
     # Prepare n-shot examples (same logic as single_prompt)
     n_shot_examples_list = list(n_shot_examples.keys())
     found = False
@@ -99,6 +186,9 @@ def run_two_stage_prompt(
         ),
         system_prompt=system_prompt,
     )
+    telemetry.record(
+        "prompt_build", prompt_build_started, prompt_chars=len(first_prompt)
+    )
 
     print(f"Running Two-Stage Prompt Generation with {model}")
 
@@ -107,20 +197,36 @@ def run_two_stage_prompt(
     success = False
     max_attempts = 3
     attempt_errors: list[dict] = []
+    concurrent = attempts_per_round(speculative_attempts)
 
-    for i in range(max_attempts):
+    i = 0
+    while i < max_attempts:
         if i > 0:
             print(f"Retrying (attempt {i+1}/{max_attempts})...")
 
-        result, attempt_error = process_two_stage_attempt(
-            first_prompt, system_prompt, paths, model, i
-        )
+        wave = range(i, min(i + concurrent, max_attempts))
+        if len(wave) > 1:
+            result, wave_errors = await race_attempts(
+                lambda index, attempt_paths: aprocess_two_stage_attempt(
+                    first_prompt, system_prompt, attempt_paths, model, index
+                ),
+                wave,
+                paths,
+                model,
+            )
+        else:
+            with telemetry.labels(attempt=i + 1):
+                result, attempt_error = await aprocess_two_stage_attempt(
+                    first_prompt, system_prompt, paths, model, i
+                )
+            wave_errors = [attempt_error] if attempt_error else []
+        i = wave.stop
 
         if result != "False":
             success = True
             if enable_auto_grading:
                 try:
-                    run_automatic_grading(
+                    await arun_automatic_grading(
                         student_mermaid_code=result,
                         system_prompt=system_prompt,
                         system_name=system_name,
@@ -142,9 +248,8 @@ def run_two_stage_prompt(
                 write_success(paths)
             break
         else:
-            if attempt_error:
-                attempt_errors.append(attempt_error)
-            if i < max_attempts - 1:
+            attempt_errors.extend(wave_errors)
+            if i < max_attempts:
                 print("Attempt failed, retrying...")
             else:
                 print("All attempts failed")
@@ -171,6 +276,21 @@ def process_two_stage_attempt(
     paths: dict,
     model: str = "anthropic/claude-3.5-sonnet",
     attempt_index: int = 0,
+) -> tuple[str, dict | None]:
+    """Blocking wrapper around ``aprocess_two_stage_attempt``."""
+    return run_sync(
+        aprocess_two_stage_attempt(
+            first_prompt, system_prompt, paths, model, attempt_index
+        )
+    )
+
+
+async def aprocess_two_stage_attempt(
+    first_prompt: str,
+    system_prompt: str,
+    paths: dict,
+    model: str = "anthropic/claude-3.5-sonnet",
+    attempt_index: int = 0,
 ) -> tuple[str, dict | None]:
     """
     Execute one full two-stage attempt: initial generation followed by refinement.
@@ -192,9 +312,14 @@ def process_two_stage_attempt(
         # --- Stage 1: Initial generation ---
         print("Running Stage 1: Initial Mermaid generation")
         try:
-            first_answer = call_openrouter_llm(
-                first_prompt, max_tokens=15000, temperature=0.01, model=model
-            )
+            with telemetry.labels(step="stage1"):
+                first_answer = await acall_openrouter_llm(
+                    first_prompt,
+                    max_tokens=15000,
+                    temperature=0.01,
+                    model=model,
+                    stream_mermaid=True,
+                )
         except Exception as e:
             error_msg = f"Stage 1: LLM call failed: {str(e)}"
             print(error_msg)
@@ -210,11 +335,14 @@ def process_two_stage_attempt(
             f.write(f"=== Stage 1 Raw LLM Response ===\n{first_answer}\n\n")
 
         try:
-            stage1_mermaid = mermaidCodeSearch(
-                first_answer,
-                paths["generated_mermaid_code_path"],
-                writeFile=False,
-            )
+            with telemetry.span(
+                "mermaid_extract", step="stage1", response_chars=len(first_answer)
+            ):
+                stage1_mermaid = mermaidCodeSearch(
+                    first_answer,
+                    paths["generated_mermaid_code_path"],
+                    writeFile=False,
+                )
         except Exception as e:
             error = "Stage 1: Failed to extract Mermaid code from LLM response"
             with open(paths["llm_log_path"], "a") as f:
@@ -238,10 +366,11 @@ def process_two_stage_attempt(
 
         # Render stage 1 — must succeed before proceeding to stage 2
         try:
-            stage1_diagram_path = os.path.join(stage1_dir, "output_stage1")
-            success = create_single_prompt_gsm_diagram_with_sherpa(
-                stage1_mermaid, stage1_diagram_path
-            )
+            with telemetry.labels(step="stage1"):
+                stage1_diagram_path = os.path.join(stage1_dir, "output_stage1")
+                success = await acreate_single_prompt_gsm_diagram_with_sherpa(
+                    stage1_mermaid, stage1_diagram_path
+                )
             if not success:
                 raise Exception("Stage 1 diagram rendering failed")
         except Exception as e:
@@ -259,9 +388,16 @@ def process_two_stage_attempt(
 
         # --- Stage 2: Refinement ---
         print("Running Stage 2: Refinement")
+        refinement_started = time.perf_counter()
         refinement_prompt = build_refinement_prompt(
             stage1_mermaid, system_prompt, mermaid_syntax
         )
+        telemetry.record(
+            "prompt_build",
+            refinement_started,
+            step="stage2",
+            prompt_chars=len(refinement_prompt),
+        )
 
         with open(paths["llm_log_path"], "a") as f:
             f.write(
@@ -269,9 +405,14 @@ def process_two_stage_attempt(
             )
 
         try:
-            second_answer = call_openrouter_llm(
-                refinement_prompt, max_tokens=15000, temperature=0.3, model=model
-            )
+            with telemetry.labels(step="stage2"):
+                second_answer = await acall_openrouter_llm(
+                    refinement_prompt,
+                    max_tokens=15000,
+                    temperature=0.3,
+                    model=model,
+                    stream_mermaid=True,
+                )
         except Exception as e:
             error_msg = f"Stage 2: LLM call failed: {str(e)}"
             print(error_msg)
@@ -286,9 +427,12 @@ def process_two_stage_attempt(
             f.write(f"=== Stage 2 Raw LLM Response ===\n{second_answer}\n\n")
 
         try:
-            stage2_mermaid = mermaidCodeSearch(
-                second_answer, paths["generated_mermaid_code_path"]
-            )
+            with telemetry.span(
+                "mermaid_extract", step="stage2", response_chars=len(second_answer)
+            ):
+                stage2_mermaid = mermaidCodeSearch(
+                    second_answer, paths["generated_mermaid_code_path"]
+                )
         except Exception as e:
             error = "Stage 2: Failed to extract Mermaid code from LLM response"
             with open(paths["llm_log_path"], "a") as f:
@@ -303,9 +447,10 @@ def process_two_stage_attempt(
 
         # --- Render stage 2 ---
         try:
-            success = create_single_prompt_gsm_diagram_with_sherpa(
-                stage2_mermaid, paths["diagram_file_path"]
-            )
+            with telemetry.labels(step="stage2"):
+                success = await acreate_single_prompt_gsm_diagram_with_sherpa(
+                    stage2_mermaid, paths["diagram_file_path"]
+                )
             if not success:
                 raise Exception("Diagram rendering failed")
         except Exception as e:
@@ -317,10 +317,19 @@ export function ArtifactView({ run, onNewRun }: Props) {
           {artifacts.png && (
             <div className="overflow-hidden rounded-2xl border border-white/[0.07] bg-white/[0.02] shadow-2xl shadow-black/50 ring-1 ring-white/[0.04]">
               <ZoomableImage
-                src={imageUrl(artifacts.png)}
+                src={imageUrl(artifacts.svg ?? artifacts.png)}
                 alt={`${run.system} state machine`}
                 className="w-full"
               />
+              <div className="flex justify-end border-t border-white/[0.05] px-3 py-2">
+                <a
+                  href={imageUrl(artifacts.png)}
+                  download
+                  className="rounded-md bg-white/[0.06] px-2 py-0.5 font-mono text-[10px] text-white/40 hover:text-white/70"
+                >
+                  Download PNG
+                </a>
+              </div>
             </div>
           )}
 
@@ -333,10 +342,10 @@ export function ArtifactView({ run, onNewRun }: Props) {
                 </CollapsibleSection>
               )}
               {isTwoStage && artifacts.stage1_png && (
-                <CollapsibleSection title="Stage 1 diagram" badge=".png">
+                <CollapsibleSection title="Stage 1 diagram" badge={artifacts.stage1_svg ? ".svg" : ".png"}>
                   <div className="overflow-hidden rounded-xl border border-white/[0.06] bg-black/20">
                     <ZoomableImage
-                      src={imageUrl(artifacts.stage1_png)}
+                      src={imageUrl(artifacts.stage1_svg ?? artifacts.stage1_png)}
                       alt={`${run.system} stage 1 state machine`}
                       className="w-full"
                     />
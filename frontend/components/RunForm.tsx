@@ -187,23 +187,31 @@ function buildProgressSteps(
 function GeneratingProgress({
   strategy,
   logs,
+  liveOutput,
   artifacts,
   showAutoGradingStages,
   onCancel,
 }: {
   strategy: PromptStrategy;
   logs: string[];
+  liveOutput: string;
   artifacts: Artifacts | null;
   showAutoGradingStages: boolean;
   onCancel: () => void;
 }) {
   const [showLogs, setShowLogs] = useState(false);
   const logsEndRef = useRef<HTMLDivElement>(null);
+  const liveOutputRef = useRef<HTMLPreElement>(null);
 
   useEffect(() => {
     if (showLogs) logsEndRef.current?.scrollIntoView({ behavior: "smooth" });
   }, [logs, showLogs]);
 
+  useEffect(() => {
+    const el = liveOutputRef.current;
+    if (el) el.scrollTop = el.scrollHeight;
+  }, [liveOutput]);
+
   const steps = buildProgressSteps(
     strategy,
     logs,
@@ -267,6 +275,18 @@ function GeneratingProgress({
         })}
       </div>
 
+      {/* Live model output, streamed token by token */}
+      {liveOutput && (
+        <div className="border-t border-white/[0.06] px-3 py-3">
+          <pre
+            ref={liveOutputRef}
+            className="max-h-44 overflow-y-auto whitespace-pre-wrap break-all font-mono text-[10px] leading-relaxed text-white/50"
+          >
+            {liveOutput}
+          </pre>
+        </div>
+      )}
+
       {/* Terminal log pane */}
       {showLogs && (
         <div className="border-t border-white/[0.06]">
@@ -394,6 +414,7 @@ export function RunForm({ onComplete, onHistoryRefresh, onGeneratingChange }: Pr
   const [examples, setExamples] = useState<Example[]>([]);
   const [generating, setGenerating] = useState(false);
   const [logs, setLogs] = useState<string[]>([]);
+  const [liveOutput, setLiveOutput] = useState("");
   const [enableAutoGrading, setEnableAutoGrading] = useState(false);
   const [progressArtifacts, setProgressArtifacts] = useState<Artifacts | null>(null);
   const [showAutoGradingStages, setShowAutoGradingStages] = useState(false);
@@ -489,6 +510,7 @@ async function handleExampleChange(key: string) {
     abortRef.current = null;
     setGenerating(false);
     setLogs([]);
+    setLiveOutput("");
     setProgressArtifacts(null);
     setShowAutoGradingStages(false);
     setGenerationError(null);
@@ -508,6 +530,7 @@ async function handleExampleChange(key: string) {
 
     setGenerating(true);
     setLogs([]);
+    setLiveOutput("");
     setProgressArtifacts(null);
     setGenerationError(null);
 
@@ -637,6 +660,11 @@ async function handleExampleChange(key: string) {
         signal: controller.signal,
       });
 
+      if (res.status === 429) {
+        const body = await res.json().catch(() => null);
+        failRun(`Error: ${body?.detail?.message ?? "the generation queue is full."}`);
+        return;
+      }
       if (!res.ok || !res.body) {
         failRun("Error: failed to start generation.");
         return;
@@ -665,6 +693,12 @@ async function handleExampleChange(key: string) {
 
           if (eventType === "progress") {
             setLogs((l) => [...l, data]);
+          } else if (eventType === "queued") {
+            const { position } = JSON.parse(data) as { position: number };
+            setLogs((l) => [...l, `Waiting for a free slot (queue position ${position})`]);
+          } else if (eventType === "token") {
+            const token = JSON.parse(data) as { text: string; reset: boolean };
+            setLiveOutput((o) => (token.reset ? token.text : o + token.text));
           } else if (eventType === "complete") {
             sawTerminalEvent = true;
             const payload = JSON.parse(data);
@@ -1412,6 +1446,7 @@ async function handleExampleChange(key: string) {
               <GeneratingProgress
                 strategy={strategy === "two_stage_prompt" ? "two_stage_prompt" : "single_prompt"}
                 logs={logs}
+                liveOutput={liveOutput}
                 artifacts={progressArtifacts}
                 showAutoGradingStages={showAutoGradingStages}
                 onCancel={handleCancel}
@@ -27,10 +27,15 @@ export interface RunStatus {
 }
 
 export interface Artifacts {
+  // Rasterized on demand from the .gv when only SVG / DOT was rendered.
   png: string | null;
+  svg?: string | null;
+  gv?: string | null;
   mmd: string | null;
   txt: string | null;
   stage1_png?: string | null;
+  stage1_svg?: string | null;
+  stage1_gv?: string | null;
   stage1_mmd?: string | null;
   stage1_txt?: string | null;
   llm_log: string | null;
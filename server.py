@@ -4,35 +4,46 @@ Replaces `chainlit run app.py` with `uvicorn server:app --reload --port 8000`
 """
 
 import asyncio
-import contextlib
-import io
 import json
-import logging
 import os
-import queue
+import sys
 import threading
-import time
 import traceback
 from pathlib import Path
 from typing import Literal
 
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
-from pydantic import BaseModel
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
 
-import backend.resources.state_machine_descriptions as sm_descriptions
-from backend.grading import run_automatic_grading
-from backend.errors import (
+# Backend modules import each other as top-level modules (``errors``,
+# ``resources.util``).  Import them under the same names here so process-wide
+# state such as the render worker pool exists once, not once per alias.
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import resources.state_machine_descriptions as sm_descriptions
+from grading import arun_automatic_grading, get_rubric_registry, grading_sample_models
+from errors import (
     read_status,
     write_in_progress,
     RunError,
     ErrorType,
     write_failure,
 )
-from backend.resources.util import setup_file_paths
-from backend.single_prompt import process_custom_mermaid, run_single_prompt
-from backend.two_stage_prompt import run_two_stage_prompt
+import batch
+import progress
+import run_index
+import telemetry
+from model_profiles import PROFILE_TO_OPENROUTER
+from scheduler import QueueFullError, get_scheduler
+from resources.llm_client import close_async_http_client, http_pool_stats
+from resources.render_cache import get_render_cache
+from resources.render_pool import get_render_pool, render_pool_enabled
+from resources.util import rasterize_png, setup_file_paths
+from single_prompt import arun_single_prompt, process_custom_mermaid
+from speculative import attempts_per_round
+from two_stage_prompt import arun_two_stage_prompt
 
 # ---------------------------------------------------------------------------
 # App setup
@@ -50,19 +61,6 @@ app.add_middleware(
 BASE_DIR = Path(__file__).parent
 RESOURCES_DIR = BASE_DIR / "backend" / "resources"
 
-# ---------------------------------------------------------------------------
-# Model mapping (copied from app.py)
-# ---------------------------------------------------------------------------
-
-# Keys match app.py chat profile names (provider:model-id format)
-# Values are OpenRouter model strings
-PROFILE_TO_OPENROUTER: dict[str, str] = {
-    "anthropic/claude-4.5-sonnet": "anthropic/claude-4.5-sonnet",
-    "google/gemini-3.1-pro-preview": "google/gemini-3.1-pro-preview",
-    "openai/gpt-5.5": "openai/gpt-5.5",
-    "deepseek/deepseek-v4-pro": "deepseek/deepseek-v4-pro",
-}
-
 # ---------------------------------------------------------------------------
 # Example catalogue (copied from app.py)
 # ---------------------------------------------------------------------------
@@ -167,127 +165,44 @@ def _safe_path(raw: str) -> Path:
 
 
 # ---------------------------------------------------------------------------
-# History helpers
+# API routes
 # ---------------------------------------------------------------------------
 
 
-def _scan_runs() -> list[dict]:
-    """Walk both output dirs and return a list of run metadata dicts."""
-    runs = []
-    for strategy in (
-        "single_prompt",
-        "two_stage_prompt",
-        "mermaid_compiler",
-        "automatic_grader",
-    ):
-        outputs_dir = RESOURCES_DIR / f"{strategy}_outputs"
-        if not outputs_dir.exists():
-            continue
-        for date_dir in outputs_dir.iterdir():
-            if not date_dir.is_dir():
-                continue
-            for model_dir in date_dir.iterdir():
-                if not model_dir.is_dir():
-                    continue
-                for system_dir in model_dir.iterdir():
-                    if not system_dir.is_dir():
-                        continue
-                    for time_dir in system_dir.iterdir():
-                        if not time_dir.is_dir():
-                            continue
-                        has_png = any(time_dir.glob("*.png"))
-                        date_fmt = date_dir.name.replace("_", "-")
-                        time_fmt = time_dir.name.replace("_", ":")
-                        status_val = None
-                        if (time_dir / "status.json").exists():
-                            full_status = read_status(str(time_dir))
-                            if full_status:
-                                status_val = full_status.get("status")
-                        runs.append(
-                            {
-                                "strategy": strategy,
-                                "date": date_fmt,
-                                "time": time_fmt,
-                                "model": model_dir.name,
-                                "system": system_dir.name,
-                                "folder": str(time_dir),
-                                "has_png": has_png,
-                                "run_status": status_val,
-                                "sort_key": f"{date_dir.name}_{time_dir.name}",
-                            }
-                        )
-    runs.sort(key=lambda r: r["sort_key"], reverse=True)
-    for r in runs:
-        del r["sort_key"]
-    return runs
-
-
-def _sanitize_system_name(system_name: str) -> str:
-    safe_system_name = "".join(
-        c if c.isalnum() or c in (" ", "-", "_") else "_" for c in system_name
-    )
-    return safe_system_name.strip().replace(" ", "_")
+@app.on_event("startup")
+def _install_progress_capture():
+    # Route print/logging output through per-request progress channels.
+    progress.install()
 
 
-def _has_run_artifacts(run_dir: Path) -> bool:
-    return any(
-        child.is_file()
-        and (
-            child.suffix in {".png", ".mmd", ".txt", ".csv", ".tsv"}
-            or child.name in {"LLM_log.txt", "grading_prompt.txt", "grading_output.txt"}
-        )
-        for child in run_dir.iterdir()
-    )
+@app.on_event("startup")
+def _prewarm_render_pool():
+    # Start the render workers now so the first request does not pay for
+    # the sherpa_ai / pythonmonkey imports.
+    if render_pool_enabled():
+        get_render_pool()
 
 
-def _find_latest_run_folder(
-    strategy: str,
-    *,
-    system_name: str | None = None,
-    model_name: str | None = None,
-    since: float | None = None,
-) -> str | None:
-    """Find the newest matching top-level run folder for a strategy."""
-    outputs_dir = RESOURCES_DIR / f"{strategy}_outputs"
-    if not outputs_dir.exists():
-        return None
-
-    safe_system_name = _sanitize_system_name(system_name) if system_name else None
-    latest_path: Path | None = None
-    latest_mtime = 0.0
-
-    for date_dir in outputs_dir.iterdir():
-        if not date_dir.is_dir():
-            continue
-        for model_dir in date_dir.iterdir():
-            if not model_dir.is_dir():
-                continue
-            if model_name and model_dir.name != model_name:
-                continue
-            for system_dir in model_dir.iterdir():
-                if not system_dir.is_dir():
-                    continue
-                if safe_system_name and system_dir.name != safe_system_name:
-                    continue
-                for time_dir in system_dir.iterdir():
-                    if not time_dir.is_dir() or not _has_run_artifacts(time_dir):
-                        continue
-                    try:
-                        mtime = time_dir.stat().st_mtime
-                    except OSError:
-                        continue
-                    if since is not None and mtime < since:
-                        continue
-                    if mtime > latest_mtime:
-                        latest_mtime = mtime
-                        latest_path = time_dir
-
-    return str(latest_path) if latest_path else None
+@app.on_event("startup")
+def _preload_rubrics():
+    # Parse the ground-truth rubrics and build their grading prompt prefixes
+    # once, so grading calls only assemble the per-run part.
+    get_rubric_registry(str(BASE_DIR / "backend")).preload()
 
 
-# ---------------------------------------------------------------------------
-# API routes
-# ---------------------------------------------------------------------------
+@app.on_event("startup")
+def _bootstrap_run_index():
+    # First start against an existing output tree: build the history index
+    # in the background (later runs keep it current as they are created).
+    if not os.path.exists(run_index.index_path()):
+        threading.Thread(
+            target=run_index.reindex, args=(str(RESOURCES_DIR),), daemon=True
+        ).start()
+
+
+@app.on_event("shutdown")
+async def _close_llm_client():
+    await close_async_http_client()
 
 
 @app.get("/health")
@@ -295,6 +210,60 @@ def healthcheck():
     return {"status": "ok"}
 
 
+@app.get("/api/queue")
+def queue_stats():
+    return get_scheduler().stats()
+
+
+@app.get("/api/llm-pool")
+def llm_pool_stats():
+    return http_pool_stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Prometheus scrape endpoint: stage latencies, token counts and queue state."""
+    queue = get_scheduler().stats()
+    lines = telemetry.format_gauge(
+        "sherpa_generations_running",
+        "Pipeline runs currently holding a scheduler slot.",
+        {(): queue["running"]},
+    )
+    lines += telemetry.format_gauge(
+        "sherpa_generations_queued",
+        "Pipeline runs waiting for a scheduler slot.",
+        {(): queue["queued"]},
+    )
+    lines += telemetry.format_counter(
+        "sherpa_generations_total",
+        "Pipeline runs completed or rejected since startup.",
+        {
+            (("outcome", "completed"),): queue["completed"],
+            (("outcome", "rejected"),): queue["rejected"],
+        },
+    )
+    if render_pool_enabled():
+        pool = get_render_pool().stats()
+        lines += telemetry.format_gauge(
+            "sherpa_render_workers",
+            "Render worker processes by state.",
+            {
+                (("state", "idle"),): pool["idle"],
+                (("state", "busy"),): pool["size"] - pool["idle"],
+            },
+        )
+    cache = get_render_cache()
+    lines += telemetry.format_counter(
+        "sherpa_render_cache_lookups_total",
+        "Render cache lookups since startup.",
+        {(("result", "hit"),): cache.hits, (("result", "miss"),): cache.misses},
+    )
+    return PlainTextResponse(
+        telemetry.render_prometheus() + "\n".join(lines) + "\n",
+        media_type="text/plain; version=0.0.4",
+    )
+
+
 @app.get("/api/examples")
 def get_examples():
     return [
@@ -324,8 +293,26 @@ def get_models():
 
 
 @app.get("/api/history")
-def get_history():
-    return _scan_runs()
+def get_history(
+    strategy: str | None = None,
+    model: str | None = None,
+    system: str | None = None,
+    status: str | None = None,
+    date_from: str | None = Query(None, description="Inclusive, YYYY-MM-DD"),
+    date_to: str | None = Query(None, description="Inclusive, YYYY-MM-DD"),
+    limit: int | None = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+):
+    return run_index.query_runs(
+        strategy=strategy,
+        model=model,
+        system=system,
+        status=status,
+        date_from=date_from,
+        date_to=date_to,
+        limit=limit,
+        offset=offset,
+    )
 
 
 @app.get("/api/artifacts")
@@ -334,11 +321,17 @@ def get_artifacts(folder: str = Query(...)):
     if not path.is_dir():
         raise HTTPException(status_code=404, detail="Folder not found")
 
+    # ``png`` is also reported when only the ``.gv`` exists: ``/api/image``
+    # rasterizes it on first request.
     files: dict[str, str | dict | None] = {
         "png": None,
+        "svg": None,
+        "gv": None,
         "mmd": None,
         "txt": None,
         "stage1_png": None,
+        "stage1_svg": None,
+        "stage1_gv": None,
         "stage1_mmd": None,
         "stage1_txt": None,
         "llm_log": None,
@@ -347,12 +340,14 @@ def get_artifacts(folder: str = Query(...)):
         "ground_truth_csv": None,
         "grading_csv": None,
         "grading_tsv": None,
+        "grading_samples_csv": None,
+        "grading_agreement": None,
         "status": None,
     }
 
     for f in path.iterdir():
-        if f.suffix == ".png":
-            files["png"] = str(f)
+        if f.suffix in (".png", ".svg", ".gv"):
+            files[f.suffix[1:]] = str(f)
         elif f.suffix == ".mmd":
             files["mmd"] = str(f)
         elif f.name == "LLM_log.txt":
@@ -367,6 +362,10 @@ def get_artifacts(folder: str = Query(...)):
             files["grading_csv"] = str(f)
         elif f.name == "grading_results.tsv":
             files["grading_tsv"] = str(f)
+        elif f.name == "grading_samples.csv":
+            files["grading_samples_csv"] = str(f)
+        elif f.name == "grading_agreement.json":
+            files["grading_agreement"] = str(f)
         elif f.name == "status.json":
             files["status"] = read_status(str(path))
         elif f.suffix == ".txt" and f.name != "LLM_log.txt":
@@ -375,22 +374,41 @@ def get_artifacts(folder: str = Query(...)):
     stage1_dir = path / "stage1"
     if stage1_dir.is_dir():
         for f in stage1_dir.iterdir():
-            if f.suffix == ".png":
-                files["stage1_png"] = str(f)
+            if f.suffix in (".png", ".svg", ".gv"):
+                files[f"stage1_{f.suffix[1:]}"] = str(f)
             elif f.suffix == ".mmd":
                 files["stage1_mmd"] = str(f)
             elif f.suffix == ".txt":
                 files["stage1_txt"] = str(f)
 
+    for prefix in ("", "stage1_"):
+        if not files[f"{prefix}png"] and files[f"{prefix}gv"]:
+            files[f"{prefix}png"] = str(Path(files[f"{prefix}gv"]).with_suffix(".png"))
+
     return files
 
 
+_IMAGE_MEDIA_TYPES = {".png": "image/png", ".svg": "image/svg+xml"}
+
+
 @app.get("/api/image")
 def serve_image(path: str = Query(...)):
     resolved = _safe_path(path)
+    media_type = _IMAGE_MEDIA_TYPES.get(resolved.suffix)
+    if media_type is None:
+        raise HTTPException(status_code=400, detail="Not an image")
+    gv_path = resolved.with_suffix(".gv")
+    if not resolved.exists() and resolved.suffix == ".png" and gv_path.is_file():
+        # PNGs are drawn on demand from the kept DOT source, then reused.
+        try:
+            rasterize_png(str(gv_path))
+        except Exception as exc:
+            raise HTTPException(
+                status_code=500, detail=f"Could not rasterize diagram: {exc}"
+            )
     if not resolved.exists():
         raise HTTPException(status_code=404)
-    return FileResponse(resolved, media_type="image/png")
+    return FileResponse(resolved, media_type=media_type)
 
 
 @app.get("/api/file")
@@ -414,194 +432,149 @@ class GenerateRequest(BaseModel):
     example_key: str | None = None
     enable_auto_grading: bool = True
     input_mode: Literal["example", "custom"] | None = None
+    # Higher runs first when generations are queued (see scheduler aging).
+    priority: int = Field(default=0, ge=0, le=10)
+    # Images drawn next to the ``.gv``; None uses SHERPA_RENDER_FORMATS and
+    # [] skips drawing (PNGs are still rasterized on demand by /api/image).
+    render_formats: list[Literal["svg", "png"]] | None = None
+    # Attempts issued concurrently per round (first success wins); None uses
+    # SHERPA_SPECULATIVE_ATTEMPTS.
+    speculative_attempts: int | None = Field(default=None, ge=1, le=3)
 
 
-class _QueueWriter(io.RawIOBase):
-    """Redirect stdout lines into a queue for SSE streaming."""
-
-    def __init__(self, q: queue.Queue):
-        self._q = q
-        self._buf = ""
-
-    def write(self, text: str) -> int:
-        self._buf += text
-        while "\n" in self._buf:
-            line, self._buf = self._buf.split("\n", 1)
-            if line.strip():
-                self._q.put(("progress", line.strip()))
-        return len(text)
-
-    def flush(self):
-        if self._buf.strip():
-            self._q.put(("progress", self._buf.strip()))
-            self._buf = ""
-
-
-class _QueueLogHandler(logging.Handler):
-    """Mirror logging output into the SSE progress queue."""
-
-    def __init__(self, q: queue.Queue):
-        super().__init__(level=logging.INFO)
-        self._q = q
-
-    def emit(self, record: logging.LogRecord):
-        try:
-            message = self.format(record).strip()
-        except Exception:
-            self.handleError(record)
-            return
-        if message:
-            self._q.put(("progress", message))
+# Strong references to in-flight generations; a run keeps going (and writes
+# its status) even if the client disconnects from the stream.
+_generation_tasks: set[asyncio.Task] = set()
 
 
 @app.post("/api/generate")
-def generate(req: GenerateRequest):
+async def generate(req: GenerateRequest):
     openrouter_model = PROFILE_TO_OPENROUTER.get(req.model, req.model)
-    q: queue.Queue = queue.Queue()
+    loop = asyncio.get_running_loop()
+    q: asyncio.Queue = asyncio.Queue()
+
+    def _put(item):
+        # Progress may be printed from render executor threads.
+        loop.call_soon_threadsafe(q.put_nowait, item)
+
+    # Automatic grading may call further models (consensus samples).
+    grading_models = (
+        grading_sample_models(openrouter_model)
+        if req.enable_auto_grading and req.input_mode != "custom"
+        else []
+    )
+    try:
+        ticket = get_scheduler().submit(
+            openrouter_model,
+            priority=req.priority,
+            on_position=lambda position: _put(("queued", {"position": position})),
+            extra_models=tuple(grading_models),
+            slots=attempts_per_round(req.speculative_attempts),
+        )
+    except QueueFullError as exc:
+        raise HTTPException(
+            status_code=429,
+            detail={"message": str(exc), "error_type": "queue_full"},
+        ) from exc
 
-    def _run():
-        writer = _QueueWriter(q)
-        log_handler = _QueueLogHandler(q)
-        log_handler.setFormatter(
-            logging.Formatter("%(levelname)s %(name)s: %(message)s")
+    async def _generate():
+        effective_auto_grading = (
+            req.enable_auto_grading and req.input_mode != "custom"
         )
-        root_logger = logging.getLogger()
-        previous_root_level = root_logger.level
-        request_started_at = time.time()
-        try:
-            root_logger.addHandler(log_handler)
-            if root_logger.getEffectiveLevel() > logging.INFO:
-                root_logger.setLevel(logging.INFO)
-            effective_auto_grading = (
-                req.enable_auto_grading and req.input_mode != "custom"
-            )
-            if effective_auto_grading and not req.example_key:
-                q.put(
-                    (
-                        "error",
-                        "example_key is required when automatic grading is enabled.",
-                    )
+        if effective_auto_grading and not req.example_key:
+            _put(
+                (
+                    "error",
+                    "example_key is required when automatic grading is enabled.",
                 )
-                return
-
-            with contextlib.redirect_stdout(writer), contextlib.redirect_stderr(
-                writer
-            ):  # type: ignore[arg-type]
-                if req.strategy == "single_prompt":
-                    success = run_single_prompt(
-                        req.description,
-                        openrouter_model,
-                        req.system_name,
-                        effective_auto_grading,
-                        req.example_key,
-                    )
-                else:
-                    success = run_two_stage_prompt(
-                        req.description,
-                        openrouter_model,
-                        req.system_name,
-                        effective_auto_grading,
-                        req.example_key,
-                    )
-            writer.flush()
-            log_handler.flush()
-            if not success:
-                # Try to find the folder so the UI can still show the
-                # error banner + whatever partial artifacts were created.
-                model_short_name = (
-                    openrouter_model.split("/")[-1]
-                    if "/" in openrouter_model
-                    else openrouter_model
+            )
+            return
+
+        # Scoped to this request's context, so concurrent generations
+        # never see each other's output.
+        with progress.progress_scope(
+            lambda line: _put(("progress", line)),
+            on_token=lambda text, reset: _put(
+                ("token", {"text": text, "reset": reset})
+            ),
+        ):
+            if req.strategy == "single_prompt":
+                result = await arun_single_prompt(
+                    req.description,
+                    openrouter_model,
+                    req.system_name,
+                    effective_auto_grading,
+                    req.example_key,
+                    req.render_formats,
+                    req.speculative_attempts,
                 )
-                fail_folder = _find_latest_run_folder(
-                    req.strategy,
-                    system_name=req.system_name,
-                    model_name=model_short_name,
-                    since=request_started_at,
+            else:
+                result = await arun_two_stage_prompt(
+                    req.description,
+                    openrouter_model,
+                    req.system_name,
+                    effective_auto_grading,
+                    req.example_key,
+                    req.render_formats,
+                    req.speculative_attempts,
                 )
-                fail_status = read_status(fail_folder) if fail_folder else None
-                error_payload: dict = {
-                    "message": "Generation failed.",
-                }
-                if fail_folder:
-                    error_payload["folder"] = fail_folder
-                if fail_status:
-                    error_payload["status"] = fail_status.get("status", "failed")
-                    if fail_status.get("error"):
-                        error_payload["error"] = fail_status["error"]
-                        error_payload["message"] = fail_status["error"].get(
-                            "message", error_payload["message"]
-                        )
-                q.put(("error", error_payload))
-                return
-
-            model_short_name = (
-                openrouter_model.split("/")[-1]
-                if "/" in openrouter_model
-                else openrouter_model
-            )
-            folder = _find_latest_run_folder(
-                req.strategy,
-                system_name=req.system_name,
-                model_name=model_short_name,
-                since=request_started_at,
-            )
-            if not folder:
-                q.put(("error", "Generation finished without a fresh output folder."))
-                return
-
-            # Read status.json to include in the complete event
-            status = read_status(folder)
-            complete_payload = {"folder": folder}
-            if status:
-                complete_payload["status"] = status.get("status", "success")
-                if status.get("error"):
-                    complete_payload["error"] = status["error"]
-            q.put(("complete", complete_payload))
-        except BaseException as exc:
+        if not result:
+            # Include the folder so the UI can still show the
+            # error banner + whatever partial artifacts were created.
+            error_payload: dict = {
+                "message": "Generation failed.",
+                "folder": result.folder,
+            }
+            if result.status:
+                error_payload["status"] = result.status.get("status", "failed")
+                if result.status.get("error"):
+                    error_payload["error"] = result.status["error"]
+                    error_payload["message"] = result.status["error"].get(
+                        "message", error_payload["message"]
+                    )
+            _put(("error", error_payload))
+            return
+
+        complete_payload = {"folder": result.folder}
+        if result.status:
+            complete_payload["status"] = result.status.get("status", "success")
+            if result.status.get("error"):
+                complete_payload["error"] = result.status["error"]
+        _put(("complete", complete_payload))
+
+    async def _run():
+        try:
+            # Holds a scheduler slot for the whole run; queue positions are
+            # streamed while waiting.
+            async with ticket:
+                await _generate()
+        except Exception as exc:
             tb = traceback.format_exc().strip()
             if tb:
                 for line in tb.splitlines():
                     if line.strip():
-                        q.put(("progress", line))
-            # Try to locate the run folder so the UI can display
-            # the error banner alongside any partial artifacts.
-            model_short_name = (
-                openrouter_model.split("/")[-1]
-                if "/" in openrouter_model
-                else openrouter_model
-            )
-            exc_folder = _find_latest_run_folder(
-                req.strategy,
-                system_name=req.system_name,
-                model_name=model_short_name,
-                since=request_started_at,
-            )
-            exc_payload: dict = {"message": str(exc)}
-            if exc_folder:
-                exc_payload["folder"] = exc_folder
-                exc_status = read_status(exc_folder)
-                if exc_status:
-                    exc_payload["status"] = exc_status.get("status", "failed")
-                    if exc_status.get("error"):
-                        exc_payload["error"] = exc_status["error"]
-            q.put(("error", exc_payload))
+                        _put(("progress", line))
+            # The pipelines record their own failures; anything reaching here
+            # was raised before a run folder existed.
+            _put(("error", {"message": str(exc)}))
         finally:
-            writer.flush()
-            log_handler.flush()
-            root_logger.removeHandler(log_handler)
-            root_logger.setLevel(previous_root_level)
-            q.put(None)  # sentinel
+            _put(None)  # sentinel
 
-    threading.Thread(target=_run, daemon=True).start()
+    task = asyncio.create_task(_run())
+    _generation_tasks.add(task)
+    task.add_done_callback(_generation_tasks.discard)
 
-    def _stream():
+    async def _stream():
         while True:
             try:
-                item = q.get(timeout=60)
-            except queue.Empty:
-                yield "event: error\ndata: timeout\n\n"
-                break
+                item = await asyncio.wait_for(q.get(), timeout=60)
+            except asyncio.TimeoutError:
+                if task.done():
+                    yield "event: error\ndata: timeout\n\n"
+                    break
+                # Still queued or waiting on the model: keep the stream open.
+                yield ": keep-alive\n\n"
+                continue
             if item is None:
                 break
             event_type, payload = item
@@ -619,42 +592,43 @@ def generate(req: GenerateRequest):
 class MermaidRequest(BaseModel):
     mermaid_code: str
     system_name: str = "CustomMermaid"
+    render_formats: list[Literal["svg", "png"]] | None = None
 
 
 @app.post("/api/render-mermaid")
 def render_mermaid(req: MermaidRequest):
-    success, _ = process_custom_mermaid(
+    result = process_custom_mermaid(
         req.mermaid_code,
         req.system_name,
         file_type="mermaid_compiler",
+        render_formats=req.render_formats,
     )
-    folder = _find_latest_run_folder("mermaid_compiler")
-    if not success:
+    if not result:
         detail: dict = {
             "message": "Mermaid rendering failed. Check your diagram syntax.",
             "error_type": "mermaid_compilation",
+            "folder": result.folder,
         }
-        if folder:
-            detail["folder"] = folder
-            status = read_status(folder)
-            if status:
-                detail["status"] = status
+        if result.status:
+            detail["status"] = result.status
         raise HTTPException(status_code=422, detail=detail)
-    if not folder:
-        raise HTTPException(
-            status_code=500, detail="Could not locate rendered output folder."
-        )
-    return {"folder": folder}
+    return {"folder": result.folder}
 
 
 class AutomaticGraderRequest(BaseModel):
     mermaid_code: str
     example_key: str
     model: str = "google/gemini-3.1-pro-preview"
+    # Consensus grading: samples run concurrently, cycling through
+    # grading_models (profile keys); see SHERPA_GRADING_SAMPLES.
+    grading_samples: int | None = Field(default=None, ge=1, le=5)
+    grading_models: list[str] | None = Field(default=None, max_length=5)
+    # Grade afresh even when identical inputs were graded before.
+    bypass_grading_cache: bool = False
 
 
 @app.post("/api/automatic-grade")
-def automatic_grade(req: AutomaticGraderRequest):
+async def automatic_grade(req: AutomaticGraderRequest):
     system_prompt = getattr(sm_descriptions, req.example_key, None)
     if system_prompt is None:
         raise HTTPException(status_code=404, detail="Example not found")
@@ -663,29 +637,51 @@ def automatic_grade(req: AutomaticGraderRequest):
     model_short_name = (
         openrouter_model.split("/")[-1] if "/" in openrouter_model else openrouter_model
     )
-    backend_dir = BASE_DIR / "backend"
-    paths = setup_file_paths(
-        str(backend_dir),
-        file_type="automatic_grader",
-        system_name=req.example_key,
-        model_name=model_short_name,
+    # Samples call their models concurrently: hold a slot for each of them.
+    sample_models = grading_sample_models(
+        openrouter_model, req.grading_samples, req.grading_models
     )
+    try:
+        ticket = get_scheduler().submit(
+            sample_models[0], extra_models=tuple(sample_models[1:])
+        )
+    except QueueFullError as exc:
+        raise HTTPException(
+            status_code=429,
+            detail={"message": str(exc), "error_type": "queue_full"},
+        ) from exc
+
+    backend_dir = BASE_DIR / "backend"
+    try:
+        paths = setup_file_paths(
+            str(backend_dir),
+            file_type="automatic_grader",
+            system_name=req.example_key,
+            model_name=model_short_name,
+        )
 
-    with open(paths["generated_mermaid_code_path"], "w") as f:
-        f.write(req.mermaid_code.strip())
+        with open(paths["generated_mermaid_code_path"], "w") as f:
+            f.write(req.mermaid_code.strip())
+    except BaseException:
+        ticket.release()
+        raise
 
     write_in_progress(paths)
 
     try:
-        run_automatic_grading(
-            student_mermaid_code=req.mermaid_code.strip(),
-            system_prompt=system_prompt,
-            system_name=req.example_key,
-            model=openrouter_model,
-            paths=paths,
-            base_dir=str(backend_dir),
-            example_key=req.example_key,
-        )
+        async with ticket:
+            await arun_automatic_grading(
+                student_mermaid_code=req.mermaid_code.strip(),
+                system_prompt=system_prompt,
+                system_name=req.example_key,
+                model=openrouter_model,
+                paths=paths,
+                base_dir=str(backend_dir),
+                example_key=req.example_key,
+                samples=req.grading_samples,
+                sample_models=req.grading_models,
+                use_cache=False if req.bypass_grading_cache else None,
+            )
     except FileNotFoundError as exc:
         raise HTTPException(
             status_code=404,
@@ -700,8 +696,8 @@ def automatic_grade(req: AutomaticGraderRequest):
         # Grading ran but validation failed after retries.
         # The folder exists with fallback artifacts — return it with error info
         # so the frontend can show the failure state with context.
-        folder = _find_latest_run_folder("automatic_grader")
-        status = read_status(folder) if folder else None
+        folder = paths["log_base_dir"]
+        status = read_status(folder)
         raise HTTPException(
             status_code=422,
             detail={
@@ -716,7 +712,7 @@ def automatic_grade(req: AutomaticGraderRequest):
             },
         ) from exc
     except Exception as exc:  # Final guard so the UI can show a toast
-        folder = _find_latest_run_folder("automatic_grader")
+        folder = paths["log_base_dir"]
         raise HTTPException(
             status_code=500,
             detail={
@@ -726,14 +722,62 @@ def automatic_grade(req: AutomaticGraderRequest):
             },
         ) from exc
 
-    folder = _find_latest_run_folder("automatic_grader")
-    if not folder:
-        raise HTTPException(
-            status_code=500,
-            detail={
-                "message": "Could not locate grading output folder.",
-                "error_type": "unexpected",
-            },
-        )
+    folder = paths["log_base_dir"]
     status = read_status(folder)
     return {"folder": folder, "status": status}
+
+
+# ---------------------------------------------------------------------------
+# Batch evaluation — examples × models × strategies
+# ---------------------------------------------------------------------------
+
+
+class BatchRequest(BaseModel):
+    # An existing batch name resumes it: cells with a terminal status are skipped.
+    name: str | None = None
+    # Omitted axes cover every example / model profile / strategy.
+    examples: list[str] | None = None
+    models: list[str] | None = None
+    strategies: list[Literal["single_prompt", "two_stage_prompt"]] | None = None
+    grading: list[bool] = [True]
+    concurrency: int | None = Field(default=None, ge=1)
+    rerun_failed: bool = False
+    render_formats: list[Literal["svg", "png"]] | None = None
+    speculative_attempts: int | None = Field(default=None, ge=1, le=3)
+
+
+# Running batches by name; a batch keeps running after the request returns.
+_batch_tasks: dict[str, asyncio.Task] = {}
+
+
+@app.post("/api/batch", status_code=202)
+async def start_batch(req: BatchRequest):
+    name = Path(batch.batch_folder(req.name or batch.default_batch_name())).name
+    running = _batch_tasks.get(name)
+    if running is not None and not running.done():
+        raise HTTPException(status_code=409, detail=f"Batch '{name}' is already running")
+    try:
+        cells = batch.build_matrix(req.examples, req.models, req.strategies, req.grading)
+    except ValueError as exc:
+        raise HTTPException(status_code=422, detail=str(exc)) from exc
+
+    _batch_tasks[name] = asyncio.create_task(
+        batch.run_batch(
+            cells,
+            name,
+            req.concurrency,
+            req.rerun_failed,
+            req.render_formats,
+            req.speculative_attempts,
+        )
+    )
+    return {"name": name, "folder": batch.batch_folder(name), "cells": len(cells)}
+
+
+@app.get("/api/batch/{name}")
+def get_batch(name: str):
+    manifest = batch.load_manifest(name)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail=f"Batch '{name}' not found")
+    task = _batch_tasks.get(manifest["name"])
+    return {**batch.summarize(manifest), "running": task is not None and not task.done()}
@@ -14,7 +14,20 @@ NS = {
     "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
 }
 PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}Relationship"
-TEXT_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t"
+MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+TEXT_NS = MAIN_NS + "t"
+SI_TAG = MAIN_NS + "si"
+SHEET_DATA_TAG = MAIN_NS + "sheetData"
+ROW_TAG = MAIN_NS + "row"
+CELL_TAG = MAIN_NS + "c"
+REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+CELL_REF = re.compile(r"([A-Z]+)(\d+)$")
+# The only cells the summaries read: labels and precision / recall / F1 in
+# the Metrics sheet's two blocks (rows 1-21), section labels and kappa
+# values in the Weighted Cohens Kappa sheet.
+METRICS_COLUMNS = frozenset({"A", "F", "G", "H"})
+METRICS_LAST_ROW = 21
+KAPPA_COLUMNS = frozenset({"F", "V", "W"})
 CATEGORY_ORDER = [
     "Composite State",
     "State",
@@ -44,16 +57,97 @@ def empty_kappa_block():
     }
 
 
-def parse_shared_strings(workbook_zip):
-    try:
-        root = ET.fromstring(workbook_zip.read("xl/sharedStrings.xml"))
-    except KeyError:
-        return []
+def split_cell_ref(cell_ref):
+    match = CELL_REF.match(cell_ref)
+    return match.group(1), int(match.group(2))
+
+
+class Workbook:
+    """An open ``.xlsx`` file: shared strings and the sheet map are parsed once.
+
+    Sheets are streamed with ``iterparse`` and cleared row by row, so only
+    the requested cells are ever held in memory.
+    """
+
+    def __init__(self, path):
+        self.zip = zipfile.ZipFile(path)
+        try:
+            self.shared_strings = self._parse_shared_strings()
+            self.sheet_paths = self._parse_sheet_paths()
+        except BaseException:
+            self.zip.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.zip.close()
+
+    def _parse_shared_strings(self):
+        try:
+            source = self.zip.open("xl/sharedStrings.xml")
+        except KeyError:
+            return []
+
+        values = []
+        with source:
+            for _, element in ET.iterparse(source):
+                if element.tag == SI_TAG:
+                    values.append("".join(node.text or "" for node in element.iter(TEXT_NS)))
+                    element.clear()
+        return values
+
+    def _parse_sheet_paths(self):
+        workbook_root = ET.fromstring(self.zip.read("xl/workbook.xml"))
+        rels_root = ET.fromstring(self.zip.read("xl/_rels/workbook.xml.rels"))
+        rel_targets = {
+            rel.attrib["Id"]: "xl/" + rel.attrib["Target"]
+            for rel in rels_root.findall(PKG_REL_NS)
+            if rel.attrib.get("Type", "").endswith("/worksheet")
+        }
+
+        sheet_paths = OrderedDict()
+        for sheet in workbook_root.find("a:sheets", NS).findall("a:sheet", NS):
+            sheet_paths[sheet.attrib["name"]] = rel_targets.get(sheet.attrib[REL_ID])
+        return sheet_paths
+
+    def first_sheet_name(self):
+        return next(iter(self.sheet_paths))
+
+    def sheet_values(self, sheet_name, columns=None, max_row=None):
+        """Non-empty cell values of a sheet, keyed by cell reference (``"A1"``).
+
+        Only cells in ``columns`` (all when None) are kept, and reading stops
+        after row ``max_row``.
+        """
+        sheet_path = self.sheet_paths.get(sheet_name)
+        if sheet_path is None:
+            raise ValueError(f"{sheet_name} sheet not found")
+
+        values = {}
+        sheet_data = None
+        with self.zip.open(sheet_path) as source:
+            for event, element in ET.iterparse(source, events=("start", "end")):
+                if event == "start":
+                    if element.tag == SHEET_DATA_TAG:
+                        sheet_data = element
+                    continue
+
+                if element.tag == CELL_TAG:
+                    cell_ref = element.attrib["r"]
+                    column, row = split_cell_ref(cell_ref)
+                    if max_row is not None and row > max_row:
+                        break
+                    if columns is None or column in columns:
+                        value = cell_value(element, self.shared_strings)
+                        if value not in (None, ""):
+                            values[cell_ref] = value
+                elif element.tag == ROW_TAG and sheet_data is not None:
+                    # Finished rows are never looked at again.
+                    sheet_data.clear()
 
-    values = []
-    for item in root.findall("a:si", NS):
-        values.append("".join(node.text or "" for node in item.iter(TEXT_NS)))
-    return values
+        return values
 
 
 def cell_value(cell, shared_strings):
@@ -70,45 +164,6 @@ def cell_value(cell, shared_strings):
     return None
 
 
-def sheet_values(workbook_zip, sheet_path):
-    shared_strings = parse_shared_strings(workbook_zip)
-    root = ET.fromstring(workbook_zip.read(sheet_path))
-    values = {}
-
-    for cell in root.findall(".//a:c", NS):
-        value = cell_value(cell, shared_strings)
-        if value not in (None, ""):
-            values[cell.attrib["r"]] = value
-
-    return values
-
-
-def metrics_sheet_path(workbook_zip):
-    return named_sheet_path(workbook_zip, "Metrics")
-
-
-def named_sheet_path(workbook_zip, sheet_name):
-    workbook_root = ET.fromstring(workbook_zip.read("xl/workbook.xml"))
-    rels_root = ET.fromstring(workbook_zip.read("xl/_rels/workbook.xml.rels"))
-    rel_targets = {
-        rel.attrib["Id"]: "xl/" + rel.attrib["Target"]
-        for rel in rels_root.findall(PKG_REL_NS)
-        if rel.attrib.get("Type", "").endswith("/worksheet")
-    }
-
-    for sheet in workbook_root.find("a:sheets", NS).findall("a:sheet", NS):
-        if sheet.attrib["name"] == sheet_name:
-            rel_id = sheet.attrib["{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"]
-            return rel_targets[rel_id]
-
-    raise ValueError(f"{sheet_name} sheet not found")
-
-
-def state_machine_name(workbook_zip):
-    workbook_root = ET.fromstring(workbook_zip.read("xl/workbook.xml"))
-    return workbook_root.find("a:sheets", NS).findall("a:sheet", NS)[0].attrib["name"]
-
-
 def normalize_number(value):
     if value is None:
         return None
@@ -158,16 +213,12 @@ def parse_kappa_value(value):
     return float(text)
 
 
-def parse_weighted_cohens_kappa(workbook_zip):
-    values = sheet_values(workbook_zip, named_sheet_path(workbook_zip, "Weighted Cohens Kappa"))
+def parse_weighted_cohens_kappa(workbook):
+    values = workbook.sheet_values("Weighted Cohens Kappa", columns=KAPPA_COLUMNS)
     result = empty_kappa_block()
     current_category = None
 
-    max_row = 0
-    for cell_ref in values:
-        digits = "".join(ch for ch in cell_ref if ch.isdigit())
-        if digits:
-            max_row = max(max_row, int(digits))
+    max_row = max((split_cell_ref(cell_ref)[1] for cell_ref in values), default=0)
 
     for row in range(1, max_row + 1):
         section_label = values.get(f"F{row}")
@@ -198,9 +249,11 @@ def infer_week(folder_name):
 
 
 def parse_metrics_file(path):
-    with zipfile.ZipFile(path) as workbook_zip:
-        values = sheet_values(workbook_zip, metrics_sheet_path(workbook_zip))
-        weighted_cohens_kappa = parse_weighted_cohens_kappa(workbook_zip)
+    with Workbook(path) as workbook:
+        values = workbook.sheet_values(
+            "Metrics", columns=METRICS_COLUMNS, max_row=METRICS_LAST_ROW
+        )
+        weighted_cohens_kappa = parse_weighted_cohens_kappa(workbook)
         block_labels = {1: values.get("A1", ""), 2: values.get("A12", "")}
         role_map = {1: "Human", 2: "LLM"}
 
@@ -232,7 +285,7 @@ def parse_metrics_file(path):
 
             result[role_map[index]] = block
 
-        return state_machine_name(workbook_zip), result, weighted_cohens_kappa
+        return workbook.first_sheet_name(), result, weighted_cohens_kappa
 
 
 def build_summary(folder):